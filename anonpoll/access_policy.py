@@ -0,0 +1,125 @@
+import ipaddress
+import socket
+import syslog
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponseForbidden
+from django.template.loader import render_to_string
+from django.utils.deprecation import MiddlewareMixin
+
+# intranet address ranges allowed by default
+DEFAULT_ALLOWED_NETWORKS = [
+    '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '127.0.0.0/8', '169.254.0.0/16',
+    '::1/128', 'fc00::/7', 'fe80::/10',
+]
+
+DEFAULT_VERDICT_CACHE_SIZE = 4096
+
+
+class CIDRMatcher:
+    """
+    Precompiled allow/deny lists of CIDR networks.
+
+    For each IP version the networks are stored as {prefix length: set of network prefixes (int)}, so checking
+    an address costs one set lookup per distinct prefix length. The verdicts of the most recent addresses are
+    kept in a bounded LRU cache.
+
+    An address is allowed if it matches no deny network and at least one allow network.
+    Malformed addresses are denied.
+
+    Args:
+        allow (list): Allowed networks (e.g. '10.0.0.0/8').
+        deny (list, optional): Denied networks, checked first.
+        cache_size (int): Number of verdicts kept in the LRU cache.
+    """
+
+    def __init__(self, allow, deny=(), cache_size=DEFAULT_VERDICT_CACHE_SIZE):
+        self.allow = self._compile(allow)
+        self.deny = self._compile(deny)
+        self.is_allowed = lru_cache(maxsize=cache_size)(self._is_allowed)
+
+    @staticmethod
+    def _compile(networks):
+        compiled = {4: {}, 6: {}}
+        for network in networks:
+            network = ipaddress.ip_network(network.strip(), strict=False)
+            shift = network.max_prefixlen - network.prefixlen
+            compiled[network.version].setdefault(shift, set()).add(int(network.network_address) >> shift)
+        # longer prefixes (smaller shifts) first
+        return {version: sorted(prefixes.items()) for version, prefixes in compiled.items()}
+
+    @staticmethod
+    def _parse(ip):
+        # socket.inet_pton is strict and much cheaper than building an ipaddress object
+        try:
+            if ':' in ip:
+                return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        except (OSError, ValueError):
+            return None, None
+
+    @staticmethod
+    def _matches(compiled, address):
+        for shift, prefixes in compiled:
+            if address >> shift in prefixes:
+                return True
+        return False
+
+    def _is_allowed(self, ip):
+        version, address = self._parse(ip)
+        if version is None:
+            return False
+        if self._matches(self.deny[version], address):
+            return False
+        return self._matches(self.allow[version], address)
+
+
+class AccessPolicyMiddleware(MiddlewareMixin):
+    """
+    Rejects the requests to the intranet-only views coming from an address not allowed by the access policy.
+
+    It must be the first middleware with a process_view hook, so that the check runs before any session,
+    authentication or ORM work. The client address is read from ACCESS_POLICY_IP_HEADER (set by the
+    reverse proxy); requests without it are allowed, as is everything when DEBUG is on.
+
+    Settings:
+        ACCESS_POLICY_ALLOW, ACCESS_POLICY_DENY: lists of CIDR networks.
+        ACCESS_POLICY_VIEW_NAMES: {view name: template of the 403 page} of the protected views.
+        ACCESS_POLICY_SUPERUSER_VIEW_NAMES: protected views a logged superuser may open from anywhere
+            (the session is looked up only for requests that would otherwise be rejected).
+        ACCESS_POLICY_CACHE_SIZE: number of verdicts kept in the LRU cache.
+    """
+
+    def __init__(self, get_response):
+        if settings.DEBUG:
+            raise MiddlewareNotUsed()
+
+        super().__init__(get_response)
+        self.matcher = CIDRMatcher(
+            getattr(settings, 'ACCESS_POLICY_ALLOW', DEFAULT_ALLOWED_NETWORKS),
+            getattr(settings, 'ACCESS_POLICY_DENY', []),
+            cache_size=getattr(settings, 'ACCESS_POLICY_CACHE_SIZE', DEFAULT_VERDICT_CACHE_SIZE),
+        )
+        self.ip_header = getattr(settings, 'ACCESS_POLICY_IP_HEADER', 'HTTP_X_REAL_IP')
+        self.view_names = getattr(settings, 'ACCESS_POLICY_VIEW_NAMES', {})
+        self.superuser_view_names = set(getattr(settings, 'ACCESS_POLICY_SUPERUSER_VIEW_NAMES', []))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        template_name = self.view_names.get(request.resolver_match.view_name)
+        if template_name is None:
+            return None
+
+        http_real_ip = request.META.get(self.ip_header, '')
+        if http_real_ip == '' or self.matcher.is_allowed(http_real_ip):
+            return None
+
+        if request.resolver_match.view_name in self.superuser_view_names \
+                and settings.SESSION_COOKIE_NAME in request.COOKIES and request.user.is_superuser:
+            return None
+
+        syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
+        # rendered without request: no context processor, hence no session access
+        return HttpResponseForbidden(render_to_string(
+            template_name, {'message': "403 Forbidden - accesso consentito solo da intranet"}))
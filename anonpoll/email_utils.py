@@ -4,6 +4,9 @@ import os
 import smtplib
 from email.message import EmailMessage
 
+from anonpoll.instrumentation import timed
+from anonpoll.metrics import get_metrics
+
 # from anonpoll.settings import DEBUG, FROM_EMAIL, EMAIL_HOST, DEBUG_EMAIL
 
 
@@ -31,25 +34,24 @@ class MyTemporaryFile:
         return self.content
 
 
-def my_send_email(from_email, to_addresses, subject, body, cc_addresses=None, bcc_addresses=None, attachments=None, email_host=None):
+def build_email_message(from_email, to_addresses, subject, body, cc_addresses=None, attachments=None):
     """
-    Send an email with HTML body and optional attachments.
+    Build an email message with HTML body and optional attachments.
 
     Parameters:
+        from_email (str): Sender email address.
+        to_addresses (list): List of recipient email addresses.
         subject (str): Email subject.
         body (str): HTML body of the email.
-        to_addresses (list): List of recipient email addresses.
         cc_addresses (list, optional): List of CC email addresses.
-        bcc_addresses (list, optional): List of BCC email addresses.
         attachments (list, optional): List of attachments (file paths or MyTemporaryFile instances).
-        from_email (str, optional): Sender email address.
-        email_host (str, optional): SMTP server host.
+
+    Returns:
+        EmailMessage: the message, ready to be sent.
     """
 
     if cc_addresses is None:
         cc_addresses = []
-    if bcc_addresses is None:
-        bcc_addresses = []
     if attachments is None:
         attachments = []
 
@@ -82,9 +84,102 @@ def my_send_email(from_email, to_addresses, subject, body, cc_addresses=None, bc
         maintype, subtype = ctype.split('/', 1)
         msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
 
+    return msg
+
+
+def my_send_email(from_email, to_addresses, subject, body, cc_addresses=None, bcc_addresses=None, attachments=None, email_host=None):
+    """
+    Send an email with HTML body and optional attachments.
+
+    Parameters:
+        subject (str): Email subject.
+        body (str): HTML body of the email.
+        to_addresses (list): List of recipient email addresses.
+        cc_addresses (list, optional): List of CC email addresses.
+        bcc_addresses (list, optional): List of BCC email addresses.
+        attachments (list, optional): List of attachments (file paths or MyTemporaryFile instances).
+        from_email (str, optional): Sender email address.
+        email_host (str, optional): SMTP server host.
+    """
+
+    if cc_addresses is None:
+        cc_addresses = []
+    if bcc_addresses is None:
+        bcc_addresses = []
+
+    msg = build_email_message(from_email, to_addresses, subject, body, cc_addresses=cc_addresses, attachments=attachments)
+
     # Send email
-    with smtplib.SMTP(email_host) as s:
-        s.send_message(msg, from_addr=from_email, to_addrs=to_addresses + cc_addresses + bcc_addresses)
+    metrics = get_metrics()
+    try:
+        with timed('smtp'), metrics.time('anonpoll_smtp_send_seconds'), smtplib.SMTP(email_host) as s:
+            s.send_message(msg, from_addr=from_email, to_addrs=to_addresses + cc_addresses + bcc_addresses)
+    except (smtplib.SMTPException, OSError):
+        metrics.inc('anonpoll_smtp_failures_total')
+        raise
+
+
+class PooledSMTPSender:
+    """
+    Sends many messages over the same SMTP connection.
+
+    The connection is opened on the first send, reopened if the server drops it, and renewed every
+    max_messages_per_connection messages (relays often limit the messages accepted per session).
+
+    Args:
+        email_host (str): SMTP server host ('host' or 'host:port').
+        max_messages_per_connection (int): Messages sent before the connection is renewed.
+        timeout (float): Socket timeout in seconds.
+    """
+
+    def __init__(self, email_host, max_messages_per_connection=100, timeout=30):
+        self.email_host = email_host
+        self.max_messages_per_connection = max_messages_per_connection
+        self.timeout = timeout
+        self.connection = None
+        self.messages_on_connection = 0
+        self.connections_opened = 0
+
+    def _connect(self):
+        self.connection = smtplib.SMTP(self.email_host, timeout=self.timeout)
+        self.messages_on_connection = 0
+        self.connections_opened += 1
+
+    def send(self, msg, from_addr, to_addrs):
+        if self.connection is not None and self.messages_on_connection >= self.max_messages_per_connection:
+            self.close()
+        if self.connection is None:
+            self._connect()
+
+        metrics = get_metrics()
+        try:
+            with timed('smtp'), metrics.time('anonpoll_smtp_send_seconds'):
+                try:
+                    self.connection.send_message(msg, from_addr=from_addr, to_addrs=to_addrs)
+                except smtplib.SMTPServerDisconnected:
+                    # the server has dropped an idle connection: retry once on a new one
+                    self.close()
+                    self._connect()
+                    self.connection.send_message(msg, from_addr=from_addr, to_addrs=to_addrs)
+        except (smtplib.SMTPException, OSError):
+            metrics.inc('anonpoll_smtp_failures_total')
+            raise
+
+        self.messages_on_connection += 1
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, OSError):
+                self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 # Example usage:
 # send_email(
@@ -0,0 +1,268 @@
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# upper bounds (ms) of the histogram buckets shown on the staff page, the last bucket is open
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# timed categories, in the order of the Server-Timing header
+TIMED_CATEGORIES = ('db', 'tpl', 'registry', 'smtp')
+
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_WINDOW = 1000
+
+_current_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Time spent by a request in each category (seconds) and number of SQL queries.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(TIMED_CATEGORIES, 0.0)
+        self.queries = 0
+        self.rendering = False
+
+    def add(self, category, seconds):
+        self.seconds[category] = self.seconds.get(category, 0.0) + seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds['db'] += time.perf_counter() - start
+
+    def server_timing(self, total):
+        metrics = [f'db;dur={self.seconds["db"] * 1000:.1f};desc="{self.queries} queries"']
+        metrics += [f'{category};dur={self.seconds[category] * 1000:.1f}'
+                    for category in TIMED_CATEGORIES[1:] if self.seconds[category]]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(category):
+    """
+    Adds the time spent in the block to the given category of the current request, if it is instrumented.
+
+    Usage:
+        with timed('registry'):
+            response = session.get(url)
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(category, time.perf_counter() - start)
+
+
+_templates_instrumented = False
+_templates_lock = threading.Lock()
+
+
+def _instrument_render(template_class):
+    original_render = template_class.render
+
+    def render(self, context=None, request=None):
+        timings = _current_timings.get()
+        if timings is None or timings.rendering:
+            return original_render(self, context, request)
+
+        timings.rendering = True
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            timings.rendering = False
+            timings.add('tpl', time.perf_counter() - start)
+
+    template_class.render = render
+
+
+def instrument_templates():
+    """
+    Wraps the render method of the Django template backend (and of django-jinja, when installed), once per
+    process, to time template rendering. Only the outermost render of a request is timed, templates rendered
+    from a template are part of it.
+    """
+    global _templates_instrumented
+    with _templates_lock:
+        if _templates_instrumented:
+            return
+        from django.template.backends.django import Template
+        _instrument_render(Template)
+
+        try:
+            from django_jinja.backend import Template as Jinja2Template
+        except ImportError:
+            pass
+        else:
+            _instrument_render(Jinja2Template)
+
+        _templates_instrumented = True
+
+
+class ViewStats:
+    """
+    Rolling window of the timings of the last `window` sampled requests of each view (per process).
+    """
+
+    METRICS = ('total',) + TIMED_CATEGORIES + ('queries',)
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, view_name, total, timings):
+        sample = (total * 1000,) + tuple(timings.seconds[category] * 1000 for category in TIMED_CATEGORIES) + \
+            (timings.queries,)
+        with self._lock:
+            samples = self._samples.get(view_name)
+            if samples is None:
+                samples = self._samples[view_name] = deque(maxlen=self.window)
+            samples.append(sample)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    @staticmethod
+    def _histogram(values):
+        counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        for value in values:
+            for n, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+                if value <= bound:
+                    counts[n] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return counts
+
+    def summary(self):
+        """
+        Returns a list, sorted by view name, of {'view', 'samples', 'metrics': {metric: {'p50', 'p95', 'max'}},
+        'histogram': counts of the total time per bucket of HISTOGRAM_BUCKETS_MS}.
+        """
+        with self._lock:
+            snapshot = {view_name: list(samples) for view_name, samples in self._samples.items()}
+
+        views = []
+        for view_name, samples in sorted(snapshot.items()):
+            metrics = {}
+            for n, metric in enumerate(self.METRICS):
+                values = sorted(sample[n] for sample in samples)
+                metrics[metric] = {
+                    'p50': values[(len(values) - 1) // 2],
+                    'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+                    'max': values[-1],
+                }
+            views.append({
+                'view': view_name,
+                'samples': len(samples),
+                'metrics': metrics,
+                'histogram': self._histogram(sample[0] for sample in samples),
+            })
+        return views
+
+
+view_stats = ViewStats(window=getattr(settings, 'INSTRUMENTATION_WINDOW', DEFAULT_WINDOW))
+
+
+class InstrumentationMiddleware:
+    """
+    Measures, for a sample of the requests, the SQL queries (count and time), the template rendering time and
+    the time spent calling the subscriber registry and the SMTP server (see timed()).
+
+    The timings are sent back in a Server-Timing header and aggregated per view in view_stats, shown on the
+    staff page core:instrumentation. It should be the first middleware, so that the total includes the others.
+
+    Settings:
+        INSTRUMENTATION_ENABLED: False removes the middleware.
+        INSTRUMENTATION_SAMPLE_RATE: fraction of the requests instrumented (0.0 - 1.0).
+        INSTRUMENTATION_WINDOW: requests per view kept in the rolling window.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', True):
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        instrument_templates()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    @staticmethod
+    def wrap_connections(stack, timings):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timings.execute_wrapper))
+
+    @staticmethod
+    def record(request, response, timings, total):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None:
+            view_stats.record(resolver_match.view_name, total, timings)
+
+        response['Server-Timing'] = timings.server_timing(total)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack, timings)
+                response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+
+        self.record(request, response, timings, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        # the connections are per thread: the ORM work of the request runs in its thread sensitive thread
+        # (one per request under ASGIHandler), so the wrappers are installed and removed there
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current_timings.reset(token)
+
+        self.record(request, response, timings, time.perf_counter() - start)
+        return response
@@ -0,0 +1,291 @@
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# upper bounds (seconds) of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help)
+METRICS = {
+    'anonpoll_votes_total': ('counter', 'Votes accepted, per question.'),
+    'anonpoll_free_text_suggestions_total': ('counter', 'Votes for a free text choice, per question.'),
+    'anonpoll_logins_total': ('counter', 'Subscriber logins, per result.'),
+    'anonpoll_registry_request_seconds': ('histogram', 'Latency of the subscriber registry web service.'),
+    'anonpoll_registry_failures_total': ('counter', 'Failed calls to the subscriber registry web service.'),
+    'anonpoll_smtp_send_seconds': ('histogram', 'Latency of an SMTP send.'),
+    'anonpoll_smtp_failures_total': ('counter', 'Failed SMTP sends.'),
+    'anonpoll_request_duration_seconds': ('histogram', 'Request latency, per URL name.'),
+    'anonpoll_event_log_delayed_total': ('counter', 'Event logs buffered, written with a delay.'),
+    'anonpoll_event_log_dropped_total': ('counter', 'Event logs dropped by the buffered writer.'),
+    'anonpoll_event_log_fallback_writes_total': ('counter', 'Event logs written one by one, bulk insert failed.'),
+}
+
+DEFAULT_FLUSH_INTERVAL = 1.0  # in seconds
+
+ARCHIVE_FILE = 'archived.json'
+LOCK_FILE = '.lock'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of the process, shared with the other worker processes through a directory.
+
+    Each process keeps its values in memory and writes them to <directory>/<pid>-<start time>.json (atomically,
+    at most every flush_interval seconds, from a background thread, and at exit). A scrape merges the files of
+    all the processes: counters and histogram buckets are summed. The files of dead processes are folded into
+    archived.json, so counters never go back when a worker is recycled.
+
+    Args:
+        directory (str): Directory shared by the workers of the same deployment.
+        flush_interval (float, optional): Seconds between two writes; None disables the background thread.
+        process_id (str, optional): Name of the process file (default: pid and start time).
+    """
+
+    def __init__(self, directory, flush_interval=DEFAULT_FLUSH_INTERVAL, process_id=None):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.process_id = process_id or f"{os.getpid()}-{int(time.time() * 1000)}"
+        os.makedirs(directory, exist_ok=True)
+
+        # {(name, labels): value} and {(name, labels): [bucket counts..., sum, count]}
+        self.counters = {}
+        self.histograms = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if flush_interval is not None:
+            threading.Thread(target=self._run, name='metrics-flusher', daemon=True).start()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.process_id}.json")
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            self._dirty = True
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+            # non cumulative counts, the last bucket is +Inf; then sum and count
+            values[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            values[-2] += seconds
+            values[-1] += 1
+            self._dirty = True
+
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _dump(self):
+        with self._lock:
+            self._dirty = False
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, values] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self):
+        data = self._dump()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _merge(data, counters, histograms):
+        for name, labels, value in data.get('counters', []):
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data.get('histograms', []):
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = list(values)
+            else:
+                histograms[key] = [a + b for a, b in zip(merged, values)]
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def collect(self):
+        """
+        Returns (counters, histograms) summed over all the processes, archiving the files of the dead ones.
+        """
+        self.flush()
+        counters, histograms = {}, {}
+
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+                archived = self._read(archive_path)
+                dead = []
+                for file_name in os.listdir(self.directory):
+                    if not file_name.endswith('.json') or file_name == ARCHIVE_FILE:
+                        continue
+                    pid = file_name.split('-', 1)[0]
+                    if pid.isdigit() and not _pid_alive(int(pid)):
+                        dead.append(file_name)
+
+                if dead:
+                    archived_counters, archived_histograms = {}, {}
+                    self._merge(archived, archived_counters, archived_histograms)
+                    for file_name in dead:
+                        self._merge(self._read(os.path.join(self.directory, file_name)),
+                                    archived_counters, archived_histograms)
+                    archived = {
+                        'counters': [[n, l, v] for (n, l), v in archived_counters.items()],
+                        'histograms': [[n, l, v] for (n, l), v in archived_histograms.items()],
+                    }
+                    fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump(archived, f)
+                    os.replace(tmp_path, archive_path)
+                    for file_name in dead:
+                        os.remove(os.path.join(self.directory, file_name))
+
+                self._merge(archived, counters, histograms)
+                for file_name in os.listdir(self.directory):
+                    if file_name.endswith('.json') and file_name != ARCHIVE_FILE:
+                        self._merge(self._read(os.path.join(self.directory, file_name)), counters, histograms)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        return counters, histograms
+
+    def render(self):
+        """
+        Returns the metrics of all the processes in the Prometheus text exposition format.
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == 'counter':
+                for (metric_name, labels), value in sorted(counters.items()):
+                    if metric_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+            else:
+                for (metric_name, labels), values in sorted(histograms.items()):
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the MetricsRegistry of the process, writing to METRICS_DIR; it is flushed at exit.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(
+                    getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'anonpoll-metrics')),
+                    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                )
+                atexit.register(_registry.flush)
+    return _registry
+
+
+class MetricsMiddleware:
+    """
+    Observes the latency of every request in anonpoll_request_duration_seconds, per URL name.
+    It should be the first middleware. Removed when METRICS_ENABLED is False.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def observe(request, seconds):
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = resolver_match.view_name if resolver_match is not None else 'unresolved'
+        get_metrics().observe('anonpoll_request_duration_seconds', seconds, view=view_name)
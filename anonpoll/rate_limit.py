@@ -0,0 +1,149 @@
+import math
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+# cache backends whose data is private to each process
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class RateLimiter:
+    """
+    Sliding window counters kept in a Django cache.
+
+    Each limit allows `capacity` requests per `period` seconds. The requests are counted in fixed windows of
+    `period` seconds (atomic cache.incr), and the count of the sliding window ending now is estimated as the
+    count of the current window plus the share of the previous window still inside the sliding one (assuming
+    its requests were evenly spread). Only cache operations are involved, never the database.
+
+    A request is counted only when it is allowed by all its limits: refused requests do not extend the wait.
+    The limits are checked before counting, without a lock, so concurrent requests can exceed a limit by the
+    number of requests in flight.
+
+    To share the counters between gunicorn workers the cache must be shared too (memcached, redis, ...).
+
+    Args:
+        cache_alias (str): Alias of the Django cache holding the counters.
+    """
+
+    def __init__(self, cache_alias='default'):
+        self.cache = caches[cache_alias]
+
+    def consume(self, limits):
+        """
+        Counts a request against every limit in `limits`, a list of (key, capacity, period) tuples, when none
+        of them is exceeded.
+
+        Returns:
+        - tuple: (allowed, retry_after) where retry_after is the number of seconds to wait when not allowed.
+        """
+        now = time.time()
+        windows = []
+        retry_after = 0
+        for key, capacity, period in limits:
+            window = int(now // period)
+            elapsed = (now % period) / period
+            current_key = f"rate-limit:{key}:{window}"
+            counts = self.cache.get_many([current_key, f"rate-limit:{key}:{window - 1}"])
+            taken = counts.get(current_key, 0)
+            previous = counts.get(f"rate-limit:{key}:{window - 1}", 0)
+
+            if previous * (1 - elapsed) + taken + 1 > capacity:
+                retry_after = max(retry_after, self.retry_after(previous, taken, capacity, period, elapsed))
+            windows.append((current_key, period))
+
+        if retry_after:
+            return False, retry_after
+
+        for current_key, period in windows:
+            # counters live for two periods: the current one and the next, where they are the previous window
+            self.cache.add(current_key, 0, timeout=period * 2)
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                # the counter expired between add and incr
+                self.cache.add(current_key, 1, timeout=period * 2)
+        return True, 0
+
+    @staticmethod
+    def retry_after(previous, taken, capacity, period, elapsed):
+        # seconds until one more request fits in the sliding window
+        if taken + 1 > capacity:
+            # not before the next window, where the requests of this one start to slide out
+            return max(1, math.ceil(period * (1 - elapsed)))
+        fits_at = 1 - (capacity - taken - 1) / previous
+        return max(1, math.ceil(period * (fits_at - elapsed)))
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """
+    Rate limits the views listed in RATE_LIMITS, answering 429 Too Many Requests without touching the database.
+
+    RATE_LIMITS maps a view name to its limits, e.g.:
+
+        'core:subscriber-login': {'methods': ['POST'], 'per_ip': (5, 60), 'global': (120, 60)}
+
+    per_ip is a (requests, period in seconds) limit for each client address (ACCESS_POLICY_IP_HEADER or
+    REMOTE_ADDR), global a limit shared by all the clients of the view. Both are optional, see RateLimiter.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+            raise MiddlewareNotUsed()
+
+        super().__init__(get_response)
+        self.limits = getattr(settings, 'RATE_LIMITS', {})
+        self.ip_header = getattr(settings, 'ACCESS_POLICY_IP_HEADER', 'HTTP_X_REAL_IP')
+        self.limiter = RateLimiter(getattr(settings, 'RATE_LIMIT_CACHE', 'default'))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name
+        limits = self.limits.get(view_name)
+        if limits is None or request.method not in limits.get('methods', ['GET', 'POST']):
+            return None
+
+        client_ip = request.META.get(self.ip_header) or request.META.get('REMOTE_ADDR', '')
+
+        counters = []
+        if 'per_ip' in limits:
+            counters.append((f"{view_name}:ip:{client_ip}", *limits['per_ip']))
+        if 'global' in limits:
+            counters.append((f"{view_name}:global", *limits['global']))
+
+        allowed, retry_after = self.limiter.consume(counters)
+        if not allowed:
+            response = HttpResponse("429 Too Many Requests - riprova tra qualche istante", status=429,
+                                    content_type='text/plain; charset=utf-8')
+            response['Retry-After'] = str(retry_after)
+            return response
+
+        return None
+
+
+def check_rate_limit_cache(app_configs, **kwargs):
+    """
+    System check: with RATE_LIMIT_ENABLED, the RATE_LIMIT_CACHE alias must exist and should be shared between
+    the worker processes, otherwise each worker counts on its own and N workers allow N times the limits.
+    """
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return []
+
+    alias = getattr(settings, 'RATE_LIMIT_CACHE', 'default')
+    cache_settings = settings.CACHES.get(alias)
+    if cache_settings is None:
+        return [checks.Error(f"RATE_LIMIT_CACHE '{alias}' is not in CACHES.", id='anonpoll.E001')]
+    if cache_settings['BACKEND'] in PROCESS_LOCAL_CACHE_BACKENDS:
+        return [checks.Warning(
+            f"The rate limits are counted in the '{alias}' cache ({cache_settings['BACKEND']}), which is not "
+            f"shared between processes: each worker applies them on its own.",
+            hint="Point RATE_LIMIT_CACHE to a shared cache (redis, memcached, database) or run a single worker.",
+            id='anonpoll.W001')]
+    return []
@@ -51,6 +51,29 @@ EMAIL_HOST = env('EMAIL_HOST')
 EMAIL_PORT = env('EMAIL_PORT')
 DEBUG_EMAIL = env('DEBUG_EMAIL')
 
+# emails are stored in the outbox (OutgoingEmail) and delivered by ./manage.py send_queued_emails;
+# set to False to send them inline from the request
+EMAIL_OUTBOX_ENABLED = env.bool('EMAIL_OUTBOX_ENABLED', default=True)
+# with the outbox disabled, the async views hand the emails to this many sender threads
+EMAIL_BACKGROUND_SENDERS = env.int('EMAIL_BACKGROUND_SENDERS', default=4)
+
+# serve the vote, login and survey submit flows with their async views (core/urls.py); anonpoll/asgi.py turns
+# it on, under WSGI each async view would need its own event loop
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
+# 'sync': each EventLog is inserted by the request; 'buffered': events are kept in a per-process buffer and
+# written with one bulk insert every EVENT_LOG_BUFFER_SIZE events or EVENT_LOG_FLUSH_INTERVAL seconds
+# (see core/event_log_buffer.py)
+EVENT_LOG_MODE = env('EVENT_LOG_MODE', default='sync')
+EVENT_LOG_BUFFER_SIZE = env.int('EVENT_LOG_BUFFER_SIZE', default=100)
+EVENT_LOG_FLUSH_INTERVAL = env.float('EVENT_LOG_FLUSH_INTERVAL', default=2.0)
+EVENT_LOG_MAX_PENDING = env.int('EVENT_LOG_MAX_PENDING', default=10000)
+
+# events older than EVENT_LOG_RETENTION_DAYS are moved by ./manage.py archive_event_logs into
+# compressed daily JSONL files under EVENT_LOG_ARCHIVE_DIR (see core/event_log_archive.py)
+EVENT_LOG_RETENTION_DAYS = env.int('EVENT_LOG_RETENTION_DAYS', default=180)
+EVENT_LOG_ARCHIVE_DIR = env('EVENT_LOG_ARCHIVE_DIR', default=os.path.join(BASE_DIR, 'archive', 'eventlog'))
+
 APPLICATION_TITLE = env('APPLICATION_TITLE')
 
 TECHNICAL_CONTACT_EMAIL = env('TECHNICAL_CONTACT_EMAIL')
@@ -62,6 +85,47 @@ INTERNET_DOMAIN = env('INTERNET_DOMAIN')
 
 CHECK_SUBSCRIBER_WS_URL = env('CHECK_SUBSCRIBER_WS_URL')
 
+# subscriber registry client (see core/subscriber_registry.py): timeouts and cache TTLs in seconds,
+# the circuit opens after FAILURE_THRESHOLD consecutive failures and stays open RESET_TIMEOUT seconds
+CHECK_SUBSCRIBER_WS_CONNECT_TIMEOUT = env.float('CHECK_SUBSCRIBER_WS_CONNECT_TIMEOUT', default=2.0)
+CHECK_SUBSCRIBER_WS_READ_TIMEOUT = env.float('CHECK_SUBSCRIBER_WS_READ_TIMEOUT', default=5.0)
+CHECK_SUBSCRIBER_WS_CACHE_TTL = env.int('CHECK_SUBSCRIBER_WS_CACHE_TTL', default=600)
+CHECK_SUBSCRIBER_WS_NEGATIVE_CACHE_TTL = env.int('CHECK_SUBSCRIBER_WS_NEGATIVE_CACHE_TTL', default=60)
+CHECK_SUBSCRIBER_WS_FAILURE_THRESHOLD = env.int('CHECK_SUBSCRIBER_WS_FAILURE_THRESHOLD', default=5)
+CHECK_SUBSCRIBER_WS_RESET_TIMEOUT = env.int('CHECK_SUBSCRIBER_WS_RESET_TIMEOUT', default=30)
+
+# per-process LRU cache of the subscribers resolved at login (see core/subscriber_cache.py)
+SUBSCRIBER_CACHE_SIZE = env.int('SUBSCRIBER_CACHE_SIZE', default=1024)
+SUBSCRIBER_CACHE_TTL = env.int('SUBSCRIBER_CACHE_TTL', default=300)
+
+# number of counter rows per Choice used to spread concurrent vote increments (see core/vote_counters.py)
+VOTE_COUNTER_SHARDS = env.int('VOTE_COUNTER_SHARDS', default=8)
+
+# 'sync': votes are applied in the request; 'journal': votes are queued in JournaledVote and applied
+# in batches by ./manage.py flush_vote_journal (see core/vote_journal.py)
+VOTE_INGESTION_MODE = env('VOTE_INGESTION_MODE', default='sync')
+
+# the live results (core:results, core:results-json) are recomputed at most every LIVE_RESULTS_REFRESH_INTERVAL
+# seconds (see core/live_results.py), or precomputed by ./manage.py refresh_live_results --loop (this needs a
+# cache shared between processes); unless LIVE_RESULTS_PUBLIC they are shown to staff users only
+LIVE_RESULTS_REFRESH_INTERVAL = env.int('LIVE_RESULTS_REFRESH_INTERVAL', default=10)
+LIVE_RESULTS_PUBLIC = env.bool('LIVE_RESULTS_PUBLIC', default=False)
+
+# server-sent events of the tallies (core:results-stream, ASGI only): every worker reads the tallies of a
+# streamed question from the database every LIVE_STREAM_INTERVAL seconds, whatever the number of clients and
+# independently of LIVE_RESULTS_REFRESH_INTERVAL (see core/live_stream.py)
+LIVE_STREAM_INTERVAL = env.float('LIVE_STREAM_INTERVAL', default=2.0)
+LIVE_STREAM_HEARTBEAT = env.float('LIVE_STREAM_HEARTBEAT', default=15.0)
+LIVE_STREAM_MAX_AGE = env.int('LIVE_STREAM_MAX_AGE', default=3600)
+
+# seconds a cached poll snapshot (question + choices) may be served before being rebuilt (see core/poll_snapshots.py)
+# the snapshots are invalidated on change in the default cache only: processes that do not share it may serve a
+# stale snapshot for up to this long
+POLL_SNAPSHOT_CACHE_TIMEOUT = env.int('POLL_SNAPSHOT_CACHE_TIMEOUT', default=300)
+
+# seconds the field specs of a named survey form are kept in cache (see core/forms.py)
+NAMED_SURVEY_FORM_CACHE_TIMEOUT = env.int('NAMED_SURVEY_FORM_CACHE_TIMEOUT', default=3600)
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -73,10 +137,19 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'core.apps.CoreConfig',
     'bootstrap5',
+    'django_jinja',
 ]
 
 MIDDLEWARE = [
+    # request latency histograms per URL name (see anonpoll/metrics.py)
+    'anonpoll.metrics.MetricsMiddleware',
+    # Server-Timing header and per-view timings of a sample of the requests (see anonpoll/instrumentation.py)
+    'anonpoll.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # intranet-only views: must come before the other middlewares (see anonpoll/access_policy.py)
+    'anonpoll.access_policy.AccessPolicyMiddleware',
+    # 429 on the vote and login endpoints, before any database work (see anonpoll/rate_limit.py)
+    'anonpoll.rate_limit.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,9 +159,99 @@ MIDDLEWARE = [
     'django.middleware.locale.LocaleMiddleware',
 ]
 
+# access policy of the intranet-only views (anonpoll/access_policy.py)
+ACCESS_POLICY_ALLOW = env.list('ACCESS_POLICY_ALLOW', default=[
+    '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '127.0.0.0/8', '169.254.0.0/16',
+    '::1/128', 'fc00::/7', 'fe80::/10',
+])
+ACCESS_POLICY_DENY = env.list('ACCESS_POLICY_DENY', default=[])
+ACCESS_POLICY_IP_HEADER = 'HTTP_X_REAL_IP'
+ACCESS_POLICY_CACHE_SIZE = env.int('ACCESS_POLICY_CACHE_SIZE', default=4096)
+ACCESS_POLICY_VIEW_NAMES = {
+    'core:show-poll-question': 'core/show_generic_message.html',
+    'core:success_url': 'core/show_generic_message.html',
+    'core:show-survey-question': 'core/show_generic_message.html',
+    'core:subscriber-login': 'show_message.html',
+    'core:post-authenticated-survey': 'show_message.html',
+    'core:metrics': 'show_message.html',
+    'core:results': 'core/show_generic_message.html',
+    'core:results-json': 'core/show_generic_message.html',
+    'core:results-stream': 'core/show_generic_message.html',
+}
+ACCESS_POLICY_SUPERUSER_VIEW_NAMES = ['core:show-poll-question', 'core:success_url', 'core:show-survey-question']
+
+# sliding window limits (requests, period in seconds) per client address and per view (anonpoll/rate_limit.py);
+# the counters are kept in the RATE_LIMIT_CACHE cache, which must be shared to limit across workers: with a
+# per-process cache (the default LocMemCache) N workers allow N times the limits, see the anonpoll.W001 check
+RATE_LIMIT_ENABLED = env.bool('RATE_LIMIT_ENABLED', default=True)
+RATE_LIMIT_CACHE = env('RATE_LIMIT_CACHE', default='default')
+RATE_LIMITS = {
+    'core:show-poll-question': {'methods': ['POST'], 'per_ip': (10, 60), 'global': (1200, 60)},
+    'core:subscriber-login': {'methods': ['POST'], 'per_ip': (5, 60), 'global': (300, 60)},
+}
+
+# fraction of the requests instrumented by InstrumentationMiddleware, and number of requests per view kept
+# for the staff page core:instrumentation
+INSTRUMENTATION_ENABLED = env.bool('INSTRUMENTATION_ENABLED', default=True)
+INSTRUMENTATION_SAMPLE_RATE = env.float('INSTRUMENTATION_SAMPLE_RATE', default=0.1)
+INSTRUMENTATION_WINDOW = env.int('INSTRUMENTATION_WINDOW', default=1000)
+
+# metrics of the worker processes, merged through the files in METRICS_DIR (one directory per deployment,
+# shared by its workers) and served at core:metrics, to intranet clients sending METRICS_TOKEN if set
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_DIR = env('METRICS_DIR', default=os.path.join(BASE_DIR, 'run', 'metrics'))
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=1.0)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
 ROOT_URLCONF = 'anonpoll.urls'
 
-TEMPLATES = [
+# optional Jinja2 rendering (django-jinja) of the hot pages: the vote page, the named survey form and the
+# thank-you pages have a .jinja version next to the .html one, rendered instead of it when JINJA2_TEMPLATES is
+# on (see anonpoll/templating.py); their bytecode is kept in the 'jinja2-bytecode' cache, which outlives the
+# process, and they are compiled at startup when JINJA2_PRECOMPILE is on
+JINJA2_TEMPLATES = env.bool('JINJA2_TEMPLATES', default=False)
+JINJA2_PRECOMPILE = env.bool('JINJA2_PRECOMPILE', default=True)
+JINJA2_BYTECODE_CACHE_DIR = env('JINJA2_BYTECODE_CACHE_DIR', default=os.path.join(BASE_DIR, 'run', 'jinja2'))
+
+JINJA2_TEMPLATE_BACKEND = {
+    'BACKEND': 'django_jinja.backend.Jinja2',
+    'APP_DIRS': True,
+    'OPTIONS': {
+        'match_extension': '.jinja',
+        'context_processors': [
+            'django.template.context_processors.request',
+            'django.contrib.messages.context_processors.messages',
+        ],
+        'globals': {
+            'bootstrap_css': 'bootstrap5.templatetags.bootstrap5.bootstrap_css',
+            'bootstrap_javascript': 'bootstrap5.templatetags.bootstrap5.bootstrap_javascript',
+        },
+        'bytecode_cache': {
+            'name': 'jinja2-bytecode',
+            'backend': 'django_jinja.cache.BytecodeCache',
+            'enabled': True,
+        },
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'jinja2-bytecode': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': JINJA2_BYTECODE_CACHE_DIR,
+        # an entry is only replaced when its template changes
+        'TIMEOUT': None,
+    },
+    # sessions of the subscribers: shared by the worker processes (a per-process cache is not), e.g.
+    # SESSION_CACHE_URL=redis://127.0.0.1:6379/1
+    'sessions': env.cache('SESSION_CACHE_URL',
+                          default=f"filecache://{os.path.join(BASE_DIR, 'run', 'sessions')}"),
+}
+
+TEMPLATES = [JINJA2_TEMPLATE_BACKEND] if JINJA2_TEMPLATES else []
+TEMPLATES += [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
@@ -167,6 +330,12 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
 SESSION_COOKIE_AGE = 3600*2  # in seconds
 
+# sessions are read from the 'sessions' cache, the database is only written when a session changes (login,
+# survey submitted, logout); with django.contrib.sessions.backends.cache it is not used at all, and the
+# sessions are lost with the cache
+SESSION_ENGINE = env('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+SESSION_CACHE_ALIAS = 'sessions'
+
 # Languages you want to support in your application
 LANGUAGES = [
     ('en', 'English'),
@@ -0,0 +1,49 @@
+"""
+Settings profile for local benchmarks: SQLite database, no .env needed, no rate limits.
+
+    DJANGO_SETTINGS_MODULE=anonpoll.settings_bench ./manage.py bench_flows --output bench.json
+
+Values read by the views straight from anonpoll.settings must be given as environment variables (below),
+before anonpoll.settings is imported; everything else can be overridden after the star import.
+"""
+import os
+
+BENCH_DEFAULTS = {
+    'SECRET_KEY': 'bench-not-secret',
+    'DEBUG': 'False',
+    'ALLOWED_HOSTS': '*',
+    'BASE_URL': 'http://testserver',
+    'FROM_EMAIL': 'noreply@example.com',
+    'SUBJECT_EMAIL': 'anonpoll',
+    'EMAIL_HOST': '127.0.0.1',
+    'EMAIL_PORT': '25',
+    'DEBUG_EMAIL': 'debug@example.com',
+    'APPLICATION_TITLE': 'anonpoll bench',
+    'TECHNICAL_CONTACT_EMAIL': 'tech@example.com',
+    'TECHNICAL_CONTACT': 'tech',
+    'PRODUCT_NAME': 'anonpoll',
+    'INTERNET_DOMAIN': 'example.com',
+    # the bench_flows command serves a stub registry on this address
+    'CHECK_SUBSCRIBER_WS_URL': 'http://127.0.0.1:18765/check-subscriber/',
+    'RATE_LIMIT_ENABLED': 'False',
+    'DB_NAME': '', 'DB_USER': '', 'DB_PASSWORD': '',
+}
+
+for name, value in BENCH_DEFAULTS.items():
+    os.environ.setdefault(name, value)
+
+from .settings import *  # noqa: E402,F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB_NAME', os.path.join(BASE_DIR, 'bench.sqlite3')),  # noqa: F405
+        # concurrent writers wait for the lock instead of failing with "database is locked"
+        'OPTIONS': {'timeout': 30},
+        # the tests with concurrent writers need a file: the in-memory test database refuses writes from threads
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_bench.sqlite3')},  # noqa: F405
+    }
+}
+
+# the core migrations are not kept in the repository: create the tables with migrate --run-syncdb
+MIGRATION_MODULES = {'core': None}
@@ -0,0 +1,82 @@
+import copy
+
+from django.conf import settings
+from django.forms.renderers import BaseRenderer, Jinja2 as Jinja2FormRenderer, get_default_renderer
+from django.template import engines
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+JINJA2_EXTENSION = '.jinja'
+
+
+def jinja2_enabled():
+    return getattr(settings, 'JINJA2_TEMPLATES', False)
+
+
+def hot_template(template_name):
+    """
+    Returns the name of the template to render for one of the hot pages: its Jinja2 version (same name, .jinja
+    extension, rendered by django-jinja) when JINJA2_TEMPLATES is on, the Django template otherwise.
+    """
+    if jinja2_enabled():
+        return template_name.rsplit('.', 1)[0] + JINJA2_EXTENSION
+    return template_name
+
+
+def get_jinja2_engine():
+    """
+    Returns the django-jinja engine of TEMPLATES or, when JINJA2_TEMPLATES is off, one built from
+    JINJA2_TEMPLATE_BACKEND (for the benchmarks and the tests).
+    """
+    for engine in engines.all():
+        if engine.__class__.__module__ == 'django_jinja.backend':
+            return engine
+    return build_jinja2_engine()
+
+
+def build_jinja2_engine(bytecode_cache=True):
+    """
+    Builds a new engine (with its own, empty, in-memory template cache) from JINJA2_TEMPLATE_BACKEND,
+    optionally without the bytecode cache.
+    """
+    params = copy.deepcopy(settings.JINJA2_TEMPLATE_BACKEND)
+    params.setdefault('NAME', 'jinja2')
+    params.setdefault('DIRS', [])
+    if not bytecode_cache:
+        params['OPTIONS'].pop('bytecode_cache', None)
+    return import_string(params.pop('BACKEND'))(params)
+
+
+def precompile_jinja2_templates(engine=None):
+    """
+    Loads every .jinja template of the engine, so that the first requests find them compiled: from the
+    bytecode cache when a previous process has already compiled them, else compiled and stored there.
+
+    Returns:
+    - int: number of templates loaded.
+    """
+    env = (engine or get_jinja2_engine()).env
+    names = env.list_templates(filter_func=lambda name: name.endswith(JINJA2_EXTENSION))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+class HotPagesFormRenderer(BaseRenderer):
+    """
+    Form renderer of the forms of the hot pages (vote page, named survey form): with JINJA2_TEMPLATES on, their
+    widgets are rendered from the Jinja2 widget templates shipped with Django, otherwise by the default form
+    renderer. The other forms (admin) are not affected.
+    """
+
+    @cached_property
+    def jinja2(self):
+        return Jinja2FormRenderer()
+
+    def get_template(self, template_name):
+        if jinja2_enabled():
+            return self.jinja2.get_template(template_name)
+        return get_default_renderer().get_template(template_name)
+
+
+hot_pages_form_renderer = HotPagesFormRenderer()
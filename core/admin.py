@@ -1,49 +1,17 @@
 from django.contrib import admin
-from django.http import HttpResponse
+from django.db.models import Sum
 from django.utils.translation import gettext_lazy as _
 from .models import Question, Choice, ChoiceVote, ChoiceSuggestedByUser, ChoiceVoteSuggestedByUser, EventLog, \
-    Subscriber, NamedSurveyQuestionOption
+    Subscriber, NamedSurveyQuestionOption, OutgoingEmail
 from .models import NamedSurvey, NamedSurveyQuestion, NamedSurveyResponse, NamedSurveyAnswer
 
 
-from openpyxl import Workbook
+from .exports import named_survey_answers_response
 
 
 def export_named_survey_answers_to_excel(modeladmin, request, queryset):
-    # Create a workbook and add a worksheet.
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Survey Answers"
-
-    # Define the header
-    columns = ['Survey Title', 'Question', 'Answer', 'Subscriber Email', 'Subscriber Name', 'Subscriber Surname', 'Subscriber UAF', 'Subscriber structure']
-    ws.append(columns)
-
-    # Append data rows
-    for answer in queryset:
-        subscriber = answer.response.subscriber
-        row = [
-            answer.response.survey.title,
-            answer.question.text,
-            answer.text or "No Answer",
-            subscriber.email if subscriber else "No Subscriber",
-            subscriber.name if subscriber else "No Name",
-            subscriber.surname if subscriber else "No Surname",
-            subscriber.uaf if subscriber else "No UAF",
-            subscriber.structure if subscriber else "No Structure",
-        ]
-        ws.append(row)
-
-    # Prepare the HTTP response with the appropriate headers
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = 'attachment; filename="named_survey_answers.xlsx"'
-
-    # Save the workbook to the response
-    wb.save(response)
-
-    return response
+    # write-only workbook streamed from a temporary file (see core/exports.py)
+    return named_survey_answers_response(queryset)
 
 
 export_named_survey_answers_to_excel.short_description = "Export Selected Answers to Excel"
@@ -86,11 +54,21 @@ admin.site.register(Question, QuestionAdmin)
 
 
 class ChoiceAdmin(admin.ModelAdmin):
-    list_display = ('choice_text', 'votes', 'question')
+    list_display = ('choice_text', 'total_votes', 'question')
     list_filter = ('question',)
     search_fields = ('choice_text',)
     raw_id_fields = ('question',)
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # votes stored on the choice plus the sum of its counter shards
+        return queryset.annotate(shard_votes=Sum('counter_shards__votes'))
+
+    def total_votes(self, obj):
+        return obj.votes + (obj.shard_votes or 0)
+
+    total_votes.short_description = 'Votes'
+
     def view_question_text(self, obj):
         return obj.question.question_text
 
@@ -134,13 +112,31 @@ class ChoiceVoteSuggestedByUserAdmin(admin.ModelAdmin):
 
 @admin.register(EventLog)
 class EventLogAdmin(admin.ModelAdmin):
-    list_display = ('id', 'created_at', 'event_type', 'event_title', 'event_target', 'event_data', 'created_at')
+    list_display = ('id', 'created_at', 'event_type', 'event_title', 'event_target', 'short_event_data')
     list_filter = ['event_type']
+    # served by the (event_type, created_at) index, also when filtering by type
+    ordering = ('-created_at',)
+    # no COUNT(*) over the whole table on every page
+    show_full_result_count = False
+
+    @admin.display(description='event data')
+    def short_event_data(self, obj):
+        # event_data of EMAIL_SENT events holds the whole message
+        if obj.event_data and len(obj.event_data) > 200:
+            return obj.event_data[:200] + '…'
+        return obj.event_data
 
 
 admin.site.register(ChoiceVoteSuggestedByUser, ChoiceVoteSuggestedByUserAdmin)
 
 
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'status', 'to_addresses', 'subject', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_addresses', 'subject')
+
+
 @admin.register(Subscriber)
 class SubscriberAdmin(admin.ModelAdmin):
     list_display = ('email', 'name', 'surname', 'matricola')
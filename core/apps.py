@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # connect the signal handlers (cache invalidation)
+        from . import signals  # noqa: F401
+
+        from anonpoll.rate_limit import check_rate_limit_cache
+        checks.register(check_rate_limit_cache, checks.Tags.caches)
+
+        # the hot pages are compiled (or loaded from the bytecode cache) before the first request
+        if getattr(settings, 'JINJA2_TEMPLATES', False) and getattr(settings, 'JINJA2_PRECOMPILE', True):
+            from anonpoll.templating import precompile_jinja2_templates
+            precompile_jinja2_templates()
@@ -0,0 +1,261 @@
+import asyncio
+import contextlib
+import inspect
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import ThreadSensitiveContext
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Question, Choice, NamedSurvey, NamedSurveyQuestion, NamedSurveyQuestionOption
+
+BENCH_POLL_SLUG = 'bench-poll'
+BENCH_SURVEY_SLUG = 'bench-survey'
+
+# answers posted for each question type of the bench survey
+SURVEY_ANSWERS = {'YNK': 'yes', 'YN': 'Sì', 'TXT': 'risposta libera', 'MCQ': 'Opzione 1'}
+
+
+def create_bench_poll(slug=BENCH_POLL_SLUG, choices=10):
+    """
+    (Re)creates an active poll with the given number of choices plus the user defined one.
+    """
+    Question.objects.filter(slug=slug).delete()
+    now = timezone.now()
+    question = Question.objects.create(name='Bench poll', question_text='Quale preferisci?', slug=slug,
+                                       start_time=now - timedelta(days=1), end_time=now + timedelta(days=30))
+    Choice.objects.bulk_create([Choice(question=question, choice_text=f'Scelta {n}') for n in range(choices)] +
+                               [Choice(question=question, choice_text='ZZZ_USER_DEFINED')])
+    return question
+
+
+def create_bench_survey(slug=BENCH_SURVEY_SLUG, questions=20, options=5):
+    """
+    (Re)creates an active named survey cycling over all the question types; MCQ questions get `options` options.
+    """
+    NamedSurvey.objects.filter(slug=slug).delete()
+    now = timezone.now()
+    survey = NamedSurvey.objects.create(title='Bench survey', name='Bench survey', slug=slug,
+                                        start_date=now - timedelta(days=1), end_date=now + timedelta(days=30))
+
+    question_types = list(SURVEY_ANSWERS)
+    for n in range(questions):
+        question = NamedSurveyQuestion.objects.create(survey=survey, text=f'Domanda {n}',
+                                                      question_type=question_types[n % len(question_types)])
+        if question.question_type == 'MCQ':
+            NamedSurveyQuestionOption.objects.bulk_create([
+                NamedSurveyQuestionOption(question=question, option_text=f'Opzione {m}') for m in range(options)])
+    return survey
+
+
+def subscriber_credentials(n, subscribers=200):
+    # the stub registry knows every matricola not starting with '0'
+    n = n % subscribers
+    return {'matricola': str(100000 + n), 'email': f'utente{n}@example.com'}
+
+
+def make_scenarios(poll, survey):
+    """
+    Returns {name: (description, setup, request, expected status)} for the fixtures given.
+
+    setup(client) runs once before the warm up, request(client, n) sends the n-th request; with an AsyncClient
+    both return awaitables.
+    """
+    vote_url = reverse('core:show-poll-question', args=(poll.slug,))
+    login_url = reverse('core:subscriber-login', args=(survey.slug,))
+    survey_url = reverse('core:post-authenticated-survey', args=(survey.slug,))
+
+    choice_ids = list(poll.choice_set.exclude(choice_text='ZZZ_USER_DEFINED').values_list('id', flat=True))
+    user_defined_id = poll.choice_set.get(choice_text='ZZZ_USER_DEFINED').id
+    survey_data = {f'question_{question.id}': SURVEY_ANSWERS[question.question_type]
+                   for question in survey.questions.all()}
+
+    def no_setup(client):
+        pass
+
+    def vote_get(client, n):
+        return client.get(vote_url)
+
+    def vote_post(client, n):
+        # every voter is a new client, without the has_voted cookie
+        client.cookies.clear()
+        return client.post(vote_url, {'choice': choice_ids[n % len(choice_ids)], 'accept_privacy_policy': 'yes'})
+
+    def free_text_vote(client, n):
+        client.cookies.clear()
+        return client.post(vote_url, {'choice': user_defined_id, 'text_choice': f'Proposta {n % 50}',
+                                      'accept_privacy_policy': 'yes'})
+
+    def subscriber_login(client, n):
+        client.cookies.clear()
+        return client.post(login_url, subscriber_credentials(n))
+
+    def survey_login(client):
+        return client.post(login_url, subscriber_credentials(0))
+
+    def named_survey_submit(client, n):
+        return client.post(survey_url, survey_data)
+
+    return {
+        'vote_get': ('anonymous poll page', no_setup, vote_get, 200),
+        'vote_post': ('anonymous vote', no_setup, vote_post, 302),
+        'free_text_vote': ('anonymous vote with a free text choice', no_setup, free_text_vote, 302),
+        'subscriber_login': ('subscriber login against the stub registry', no_setup, subscriber_login, 302),
+        'named_survey_submit': ('named survey submit', survey_login, named_survey_submit, 302),
+    }
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(setup, request, expected_status, requests=500, warmup=50):
+    """
+    Sends warmup + requests requests through the Django test client (in process, no network) and returns
+    throughput, latency percentiles (ms) and database queries per request of the measured ones.
+    Responses with a status other than expected_status are counted as errors.
+    """
+    client = Client()
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    latencies = []
+    errors = 0
+
+    # the views print to stdout
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        setup(client)
+        for n in range(warmup):
+            request(client, n)
+
+        with connection.execute_wrapper(count_queries):
+            start = time.perf_counter()
+            for n in range(warmup, warmup + requests):
+                request_start = time.perf_counter()
+                response = request(client, n)
+                latencies.append(time.perf_counter() - request_start)
+                if response.status_code != expected_status:
+                    errors += 1
+            elapsed = time.perf_counter() - start
+
+    result = summarize(latencies, errors, elapsed)
+    result['queries_per_request'] = round(queries / requests, 2) if requests else 0.0
+    return result
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Throughput and latency percentiles (ms) of a run.
+    """
+    requests = len(latencies)
+    latencies = sorted(latencies)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput': round(requests / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def run_scenario_threaded(setup, request, expected_status, requests=500, concurrency=32, workers=8):
+    """
+    The load of `concurrency` clients, each sending the next request as soon as it has the previous answer,
+    served like a WSGI server with `workers` sync worker threads: the requests wait in a FIFO queue for a free
+    worker, and the wait is part of the latency. Returns the same figures as run_scenario(), without the
+    query count.
+    """
+    numbers = iter(range(requests))
+    numbers_lock = threading.Lock()
+    latencies = []
+    errors = 0
+
+    def next_number():
+        with numbers_lock:
+            return next(numbers, None)
+
+    def serve(make_request, *args):
+        try:
+            return make_request(*args)
+        finally:
+            connection.close()
+
+    def client_loop(pool):
+        nonlocal errors
+        client = Client()
+        pool.submit(serve, setup, client).result()
+        while (n := next_number()) is not None:
+            request_start = time.perf_counter()
+            response = pool.submit(serve, request, client, n).result()
+            latencies.append(time.perf_counter() - request_start)
+            if response.status_code != expected_status:
+                errors += 1
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        start = time.perf_counter()
+        clients = [threading.Thread(target=client_loop, args=(pool,)) for _ in range(concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+
+    return summarize(latencies, errors, elapsed)
+
+
+def run_scenario_async(setup, request, expected_status, requests=500, concurrency=32):
+    """
+    The same load as run_scenario_threaded(), served by the async handler on one event loop, like an ASGI
+    worker: every request gets its own thread sensitive context, as under ASGIHandler.
+    """
+    latencies = []
+    errors = 0
+
+    async def send(client, make_request):
+        async with ThreadSensitiveContext():
+            result = make_request(client)
+            return await result if inspect.isawaitable(result) else result
+
+    numbers = iter(range(requests))
+
+    async def client_loop():
+        nonlocal errors
+        client = AsyncClient()
+        await send(client, setup)
+        while (n := next(numbers, None)) is not None:
+            request_start = time.perf_counter()
+            response = await send(client, lambda c: request(c, n))
+            latencies.append(time.perf_counter() - request_start)
+            if response.status_code != expected_status:
+                errors += 1
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        elapsed = asyncio.run(run())
+
+    return summarize(latencies, errors, elapsed)
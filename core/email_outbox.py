@@ -0,0 +1,165 @@
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from anonpoll.email_utils import build_email_message, my_send_email, PooledSMTPSender
+from .logic import create_event_log
+from .models import EventLog, OutgoingEmail
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BACKOFF = 60  # in seconds, doubled at every failed attempt
+DEFAULT_BACKGROUND_SENDERS = 4
+
+
+def _split_addresses(addresses):
+    return [address.strip() for address in addresses.split(',') if address.strip()]
+
+
+def queue_email(from_email, to_addresses, subject, body, cc_addresses=None, bcc_addresses=None):
+    """
+    Stores an email in the outbox; it is delivered later by deliver_queued_emails().
+
+    Parameters:
+    - from_email (str): Sender email address.
+    - to_addresses (list): List of recipient email addresses.
+    - subject (str): Email subject.
+    - body (str): HTML body of the email.
+    - cc_addresses (list, optional): List of CC email addresses.
+    - bcc_addresses (list, optional): List of BCC email addresses.
+
+    Returns:
+    - OutgoingEmail: The queued email.
+    """
+    return OutgoingEmail.objects.create(
+        from_email=from_email,
+        to_addresses=','.join(to_addresses),
+        cc_addresses=','.join(cc_addresses or []),
+        bcc_addresses=','.join(bcc_addresses or []),
+        subject=subject,
+        body=body,
+    )
+
+
+_background_senders = None
+_background_senders_lock = threading.Lock()
+
+
+def _send_email_and_log(from_email, to_addresses, subject, body, bcc_addresses, email_host, event_data):
+    close_old_connections()
+    try:
+        try:
+            my_send_email(from_email, to_addresses, subject, body, bcc_addresses=bcc_addresses, email_host=email_host)
+        except (smtplib.SMTPException, OSError) as e:
+            create_event_log(
+                event_type=EventLog.ERROR_SENDING_EMAIL,
+                event_title=subject,
+                event_data=f"email: {','.join(to_addresses)} error: {e}",
+                event_target=','.join(to_addresses),
+            )
+            raise
+        create_event_log(
+            event_type=EventLog.EMAIL_SENT,
+            event_title=subject,
+            event_data=event_data,
+            event_target=','.join(to_addresses),
+        )
+    finally:
+        close_old_connections()
+
+
+def send_email_in_background(from_email, to_addresses, subject, body, bcc_addresses=None, email_host=None,
+                             event_data=''):
+    """
+    Hands an email to a pool of EMAIL_BACKGROUND_SENDERS threads and returns at once, for the async views when
+    the outbox is disabled. The thread records an EMAIL_SENT event (with event_data) or an ERROR_SENDING_EMAIL
+    one; the email is not retried.
+
+    Returns:
+    - concurrent.futures.Future: done when the email has been sent (or has failed).
+    """
+    global _background_senders
+    if _background_senders is None:
+        with _background_senders_lock:
+            if _background_senders is None:
+                _background_senders = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'EMAIL_BACKGROUND_SENDERS', DEFAULT_BACKGROUND_SENDERS),
+                    thread_name_prefix='email-sender')
+    return _background_senders.submit(_send_email_and_log, from_email, to_addresses, subject, body,
+                                      bcc_addresses or [], email_host, event_data)
+
+
+def deliver_queued_emails(email_host, batch_size=DEFAULT_BATCH_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                          retry_backoff=DEFAULT_RETRY_BACKOFF, sender=None):
+    """
+    Sends the emails of the outbox that are due, reusing the same SMTP connection for the whole batch.
+
+    A failed email is retried after retry_backoff * 2 ** (attempts - 1) seconds and marked FAILED after
+    max_attempts attempts. Each delivery records an EMAIL_SENT event, each failure an ERROR_SENDING_EMAIL event.
+    The outbox is meant to be processed by a single worker (the send_queued_emails command).
+
+    Returns:
+    - tuple: (number of emails sent, number of failed attempts)
+    """
+    emails = list(OutgoingEmail.objects
+                  .filter(status=OutgoingEmail.QUEUED, next_attempt_at__lte=timezone.now())
+                  .order_by('next_attempt_at', 'id')[:batch_size])
+    if not emails:
+        return 0, 0
+
+    sent = failed = 0
+    own_sender = sender is None
+    if own_sender:
+        sender = PooledSMTPSender(email_host)
+
+    try:
+        for email in emails:
+            to_addresses = _split_addresses(email.to_addresses)
+            cc_addresses = _split_addresses(email.cc_addresses)
+            bcc_addresses = _split_addresses(email.bcc_addresses)
+            msg = build_email_message(email.from_email, to_addresses, email.subject, email.body,
+                                      cc_addresses=cc_addresses)
+
+            email.attempts += 1
+            try:
+                sender.send(msg, from_addr=email.from_email, to_addrs=to_addresses + cc_addresses + bcc_addresses)
+            except (smtplib.SMTPException, OSError) as e:
+                # start again from a fresh connection for the next email
+                sender.close()
+
+                email.last_error = str(e)
+                if email.attempts >= max_attempts:
+                    email.status = OutgoingEmail.FAILED
+                else:
+                    email.next_attempt_at = timezone.now() + timedelta(seconds=retry_backoff * 2 ** (email.attempts - 1))
+                email.save(update_fields=['attempts', 'status', 'next_attempt_at', 'last_error'])
+
+                create_event_log(
+                    event_type=EventLog.ERROR_SENDING_EMAIL,
+                    event_title=email.subject,
+                    event_data=f"email: {email.to_addresses} attempt: {email.attempts} error: {e}",
+                    event_target=email.to_addresses,
+                )
+                failed += 1
+            else:
+                email.status = OutgoingEmail.SENT
+                email.sent_at = timezone.now()
+                email.save(update_fields=['attempts', 'status', 'sent_at'])
+
+                create_event_log(
+                    event_type=EventLog.EMAIL_SENT,
+                    event_title=email.subject,
+                    event_data=f"email: {email.to_addresses} {email.body}",
+                    event_target=email.to_addresses,
+                )
+                sent += 1
+    finally:
+        if own_sender:
+            sender.close()
+
+    return sent, failed
@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+from collections import OrderedDict
+from datetime import timezone as dt_timezone
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import EventLog
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_MAX_OPEN_FILES = 8
+
+ARCHIVE_FIELDS = ('id', 'created_at', 'event_type', 'event_title', 'event_data', 'event_target')
+
+
+def get_archive_path(archive_dir, day):
+    """
+    Returns the path of the archive holding the events of a day (UTC), e.g. eventlog-2024-03-01.jsonl.gz
+    """
+    return os.path.join(archive_dir, f"eventlog-{day.isoformat()}.jsonl.gz")
+
+
+def _sync_archive(archive):
+    archive.flush()
+    os.fsync(archive.fileno())
+
+
+def archive_event_logs(before, archive_dir, event_types=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False,
+                       progress=None, max_open_files=DEFAULT_MAX_OPEN_FILES):
+    """
+    Moves the events created before a cutoff into compressed JSONL archives, one file per day.
+
+    Events are read in primary key order, chunk_size at a time, and each chunk is deleted (in its own
+    transaction) only after it has been written and flushed to the archives. Files are opened in append mode:
+    a gzip file may hold several members, so archiving the same day twice just adds to its file. At most
+    max_open_files archives are open at once: the least recently written one is synced and closed first, and
+    reopened if a later event of its day comes (ids roughly follow created_at, so this is rare).
+
+    Parameters:
+    - before (datetime): Events created before this moment are archived.
+    - archive_dir (str): Directory of the archives, created if missing.
+    - event_types (list, optional): Archive only these event types.
+    - chunk_size (int): Events read and deleted per step.
+    - dry_run (bool): Only count the events to archive.
+    - progress (callable, optional): Called as progress(events archived so far) after each chunk.
+    - max_open_files (int): Archives kept open at the same time.
+
+    Returns:
+    - dict: {'archived': number of events, 'files': sorted list of the archive paths written}
+    """
+    events = EventLog.objects.filter(created_at__lt=before)
+    if event_types:
+        events = events.filter(event_type__in=event_types)
+
+    if dry_run:
+        return {'archived': events.count(), 'files': []}
+
+    os.makedirs(archive_dir, exist_ok=True)
+    files = OrderedDict()  # the open archives, the least recently written first
+    paths = set()
+    archived = 0
+    last_id = 0
+
+    try:
+        while True:
+            rows = list(events.filter(id__gt=last_id).order_by('id').values(*ARCHIVE_FIELDS)[:chunk_size])
+            if not rows:
+                break
+
+            written = set()  # archives written in this chunk and still open
+            for row in rows:
+                created_at = row['created_at'].astimezone(dt_timezone.utc)
+                path = get_archive_path(archive_dir, created_at.date())
+                if path in files:
+                    files.move_to_end(path)
+                else:
+                    if len(files) >= max_open_files:
+                        closed_path, archive = files.popitem(last=False)
+                        # the rows written there must be on disk before they are deleted from the database
+                        _sync_archive(archive)
+                        archive.close()
+                        written.discard(closed_path)
+                    files[path] = gzip.open(path, 'at', encoding='utf-8')
+                    paths.add(path)
+                row['created_at'] = created_at.isoformat()
+                files[path].write(json.dumps(row, ensure_ascii=False) + '\n')
+                written.add(path)
+
+            # the rows must be on disk before they are deleted from the database
+            for path in written:
+                _sync_archive(files[path])
+
+            with transaction.atomic():
+                EventLog.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+            archived += len(rows)
+            last_id = rows[-1]['id']
+            if progress is not None:
+                progress(archived)
+    finally:
+        for archive in files.values():
+            archive.close()
+
+    return {'archived': archived, 'files': sorted(paths)}
+
+
+def import_event_log_archive(path, batch_size=1000):
+    """
+    Loads the events of an archive back into EventLog, keeping their ids.
+
+    Events already in the table are skipped, so importing the same archive twice is harmless.
+    Returns the number of events read from the archive.
+    """
+    imported = 0
+    batch = []
+
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            row = json.loads(line)
+            row['created_at'] = parse_datetime(row['created_at'])
+            batch.append(EventLog(**row))
+            if len(batch) >= batch_size:
+                EventLog.objects.bulk_create(batch, ignore_conflicts=True)
+                imported += len(batch)
+                batch = []
+
+    if batch:
+        EventLog.objects.bulk_create(batch, ignore_conflicts=True)
+        imported += len(batch)
+
+    return imported
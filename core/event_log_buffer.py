@@ -0,0 +1,173 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from anonpoll.metrics import get_metrics
+from .models import EventLog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 2.0  # in seconds
+DEFAULT_MAX_PENDING = 10000
+
+
+class EventLogBuffer:
+    """
+    In-process buffer of EventLog rows, written with one bulk_create per flush.
+
+    The buffer is flushed when it holds max_size events, when flush_interval seconds have passed since the
+    last flush (checked on every add and by a background thread) and when the process exits.
+    If the bulk insert fails the events are written one by one; the ones that still fail are dropped, as are
+    the events exceeding max_pending while the database is unreachable. The failures are logged, and the
+    events delayed, dropped and written by the fallback are counted in the metrics (anonpoll_event_log_*).
+
+    Args:
+        max_size (int): Number of buffered events triggering a flush.
+        flush_interval (float, optional): Maximum age in seconds of a buffered event; None disables the
+            background thread (flushes then happen on add, on flush() and at exit only).
+        max_pending (int): Maximum number of buffered events, the newer ones are dropped.
+    """
+
+    def __init__(self, max_size=DEFAULT_BUFFER_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.stats = {'buffered': 0, 'written': 0, 'dropped': 0, 'flushes': 0, 'fallback_writes': 0}
+        self._events = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        # only one flush at a time, so that the rows are written in order
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._run, name='event-log-flusher', daemon=True)
+            self._thread.start()
+
+    def add(self, event_log):
+        """
+        Buffers an unsaved EventLog, flushing the buffer if a threshold is reached.
+        """
+        with self._lock:
+            dropped = len(self._events) >= self.max_pending
+            if dropped:
+                self.stats['dropped'] += 1
+            else:
+                self._events.append(event_log)
+                self.stats['buffered'] += 1
+            due = not dropped and (len(self._events) >= self.max_size or (
+                self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval))
+
+        if dropped:
+            logger.warning("event log dropped, %d events already pending: %s", self.max_pending,
+                           event_log.event_title)
+            get_metrics().inc('anonpoll_event_log_dropped_total')
+            return
+        get_metrics().inc('anonpoll_event_log_delayed_total')
+
+        if due:
+            self.flush()
+
+    def pending(self):
+        """
+        Returns the number of events waiting to be written.
+        """
+        with self._lock:
+            return len(self._events)
+
+    def flush(self):
+        """
+        Writes the buffered events and returns how many have been written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                self._last_flush = time.monotonic()
+            if not events:
+                return 0
+
+            written = self._write(events)
+
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['written'] += written
+                self.stats['dropped'] += len(events) - written
+            if written < len(events):
+                get_metrics().inc('anonpoll_event_log_dropped_total', len(events) - written)
+            return written
+
+    def _write(self, events):
+        try:
+            EventLog.objects.bulk_create(events)
+            return len(events)
+        except Exception:
+            logger.exception("bulk insert of %d event logs failed, writing them one by one", len(events))
+
+        # synchronous fallback, one row at a time, so that a single bad row does not lose the whole batch
+        written = 0
+        for event_log in events:
+            try:
+                event_log.pk = None
+                event_log.save()
+                written += 1
+            except Exception:
+                logger.exception("event log dropped, it could not be written: %s", event_log.event_title)
+        with self._lock:
+            self.stats['fallback_writes'] += written
+        get_metrics().inc('anonpoll_event_log_fallback_writes_total', written)
+        return written
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            with self._lock:
+                due = self._events and time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self.flush()
+                # the connection of this thread is not managed by the request cycle
+                connections.close_all()
+
+    def close(self):
+        """
+        Stops the background thread and writes the pending events.
+        """
+        self._stopped.set()
+        self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_event_log_buffer():
+    """
+    Returns the EventLogBuffer shared by the process, configured from the settings; it is flushed at exit.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = EventLogBuffer(
+                    max_size=getattr(settings, 'EVENT_LOG_BUFFER_SIZE', DEFAULT_BUFFER_SIZE),
+                    flush_interval=getattr(settings, 'EVENT_LOG_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                    max_pending=getattr(settings, 'EVENT_LOG_MAX_PENDING', DEFAULT_MAX_PENDING),
+                )
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def get_event_log_stats():
+    """
+    Returns the counters of the process buffer, shown on the staff instrumentation page: events buffered
+    (i.e. written with a delay), written, dropped, number of flushes and of rows written by the synchronous
+    fallback, plus the pending events. Empty when the process has no buffer.
+    """
+    if _buffer is None:
+        return {}
+    return dict(_buffer.stats, pending=_buffer.pending())
@@ -0,0 +1,75 @@
+import tempfile
+
+from django.http import FileResponse
+from openpyxl import Workbook
+
+NAMED_SURVEY_ANSWERS_COLUMNS = ['Survey Title', 'Question', 'Answer', 'Subscriber Email', 'Subscriber Name',
+                                'Subscriber Surname', 'Subscriber UAF', 'Subscriber structure']
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def iter_named_survey_answer_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields one row (list) per NamedSurveyAnswer of the queryset.
+
+    Survey, subscriber and question come from the same query (select_related) and the answers are
+    fetched chunk_size at a time, so memory does not grow with the number of answers.
+    """
+    queryset = (queryset
+                .select_related('response__survey', 'response__subscriber', 'question')
+                .only('text', 'question__text', 'response__survey__title',
+                      'response__subscriber__email', 'response__subscriber__name', 'response__subscriber__surname',
+                      'response__subscriber__uaf', 'response__subscriber__structure')
+                .order_by('id'))
+
+    for answer in queryset.iterator(chunk_size=chunk_size):
+        subscriber = answer.response.subscriber
+        yield [
+            answer.response.survey.title,
+            answer.question.text,
+            answer.text or "No Answer",
+            subscriber.email if subscriber else "No Subscriber",
+            subscriber.name if subscriber else "No Name",
+            subscriber.surname if subscriber else "No Surname",
+            subscriber.uaf if subscriber else "No UAF",
+            subscriber.structure if subscriber else "No Structure",
+        ]
+
+
+def write_named_survey_answers(queryset, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Writes the answers of the queryset as an Excel workbook to fileobj (a path or a binary file object).
+
+    The workbook is in openpyxl write-only mode: rows are flushed to disk as they are appended.
+
+    Returns:
+    - int: The number of answers written.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Survey Answers")
+
+    ws.append(NAMED_SURVEY_ANSWERS_COLUMNS)
+
+    count = 0
+    for row in iter_named_survey_answer_rows(queryset, chunk_size=chunk_size):
+        ws.append(row)
+        count += 1
+
+    wb.save(fileobj)
+    return count
+
+
+def named_survey_answers_response(queryset, filename='named_survey_answers.xlsx'):
+    """
+    Returns a FileResponse streaming the Excel export of the answers of the queryset.
+
+    The workbook is built in a temporary file, which is sent in blocks and removed when the response is closed.
+    """
+    tmp = tempfile.TemporaryFile(suffix='.xlsx')
+    write_named_survey_answers(queryset, tmp)
+    tmp.seek(0)
+
+    return FileResponse(tmp, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
@@ -1,7 +1,14 @@
+import random
+from collections import namedtuple
+from functools import lru_cache
+
 from django import forms
-from .models import Choice, NamedSurveyAnswer, NamedSurveyQuestionOption
+from django.conf import settings
+from django.core.cache import cache
+from .models import Choice, NamedSurveyAnswer, NamedSurveyQuestion
 from django.utils.translation import gettext_lazy as _
-from .models import NamedSurveyQuestion
+
+from anonpoll.templating import hot_pages_form_renderer
 
 # class VoteFormV1(forms.Form):
 #     choice = forms.ModelChoiceField(queryset=None, widget=forms.RadioSelect, empty_label=None)
@@ -14,19 +21,68 @@ from .models import NamedSurveyQuestion
 #         self.fields['choice'].queryset = question.get_choices(sorted=question.choices_are_sorted)
 
 
+class ObjectChoiceField(forms.ChoiceField):
+    """
+    A ChoiceField over an already materialized list of objects (Choice instances or ChoiceSnapshot).
+
+    Unlike ModelChoiceField it neither renders nor validates through a queryset, so it costs no query;
+    the cleaned value is the selected object.
+    """
+
+    def __init__(self, *, objects=(), **kwargs):
+        super().__init__(**kwargs)
+        self.objects = objects
+
+    @property
+    def objects(self):
+        return self._objects
+
+    @objects.setter
+    def objects(self, objects):
+        self._objects = list(objects)
+        self._objects_by_key = {str(obj.pk): obj for obj in self._objects}
+        self.choices = [(str(obj.pk), str(obj)) for obj in self._objects]
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self._objects_by_key[str(value)]
+        except KeyError:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                        params={'value': value})
+
+    def validate(self, value):
+        # the membership check is done by to_python
+        forms.Field.validate(self, value)
+
+
 class VoteForm(forms.Form):  # WithTextField
-    choice = forms.ModelChoiceField(queryset=None, widget=forms.RadioSelect, empty_label=None)
+    choice = ObjectChoiceField(widget=forms.RadioSelect)
     text_choice = forms.CharField(required=False, widget=forms.TextInput(attrs={'placeholder': 'Scrivi la tua scelta qui...'}))
     accept_privacy_policy = forms.ChoiceField(choices=[('scegli', 'scegli'), ('yes', 'Sì'), ('no', 'No')], label="Accetti la privacy policy?", widget=forms.Select)
+    # seed of the random order of the choices, posted back so that the form is redisplayed in the same order
+    choice_seed = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
+    # Jinja2 widget templates with JINJA2_TEMPLATES (see anonpoll/templating.py)
+    default_renderer = hot_pages_form_renderer
 
     def __init__(self, *args, **kwargs):
         question = kwargs.pop('question')
         super().__init__(*args, **kwargs)
-        self.fields['choice'].queryset = question.get_choices(sorted=question.choices_are_sorted)
+        seed = self.get_choice_seed()
+        self.fields['choice_seed'].initial = seed
+        self.fields['choice'].objects = question.get_choices(sorted=question.choices_are_sorted, seed=seed)
         self.fields['choice'].required = True
         if not question.enable_textfield_choice:
             del self.fields['text_choice']  # Remove the text field if not enabled
 
+    def get_choice_seed(self):
+        try:
+            return int(self.data.get('choice_seed'))
+        except (TypeError, ValueError):
+            return random.randrange(2 ** 31)
+
     def is_valid(self):
         valid = super().is_valid()
 
@@ -110,48 +166,89 @@ TEXT_AREA_ROWS = 4
 #     return PollForm
 
 
+NamedSurveyFieldSpec = namedtuple('NamedSurveyFieldSpec', ['question_id', 'question_type', 'text', 'required', 'choices'])
+
+DEFAULT_NAMED_SURVEY_FORM_CACHE_TIMEOUT = 3600  # in seconds
+
+
+def get_named_survey_field_specs(survey):
+    """
+    Returns the field specs (a tuple of NamedSurveyFieldSpec) of the questions of a survey.
+
+    The specs are cached by survey id and version stamp (survey.updated_at): any change to the survey, to one of
+    its questions or to their options bumps updated_at (see core/signals.py), so a stale entry is never read.
+    """
+    key = f"named-survey-form:{survey.id}:{survey.updated_at.timestamp()}"
+    specs = cache.get(key)
+    if specs is None:
+        specs = tuple(
+            NamedSurveyFieldSpec(
+                question_id=question.id,
+                question_type=question.question_type,
+                text=question.text,
+                required=question.mandatory,
+                choices=tuple((option.option_text, option.option_text) for option in question.options.all()),
+            )
+            for question in NamedSurveyQuestion.objects.filter(survey=survey).prefetch_related('options')
+        )
+        cache.set(key, specs, getattr(settings, 'NAMED_SURVEY_FORM_CACHE_TIMEOUT', DEFAULT_NAMED_SURVEY_FORM_CACHE_TIMEOUT))
+    return specs
+
+
+def make_named_survey_field(spec):
+    # the required status comes from the 'mandatory' attribute of the question
+    if spec.question_type == 'YNK':
+        choices = [('do_not_know', 'Non lo so'), ('yes', 'Sì'), ('no', 'No')]
+        return forms.ChoiceField(
+            choices=choices,
+            label=spec.text,
+            widget=forms.Select,
+            initial='do_not_know',
+            required=spec.required
+        )
+    elif spec.question_type == 'YN':
+        choices = [('Sì', 'Sì'), ('No', 'No')]
+        return forms.ChoiceField(
+            choices=choices,
+            label=spec.text,
+            widget=forms.Select,
+            required=spec.required
+        )
+    elif spec.question_type == 'TXT':
+        return forms.CharField(
+            label=spec.text,
+            widget=forms.Textarea(attrs={'rows': 4}),
+            required=spec.required
+        )
+    elif spec.question_type == 'MCQ':
+        # the options of the question are part of the spec
+        return forms.ChoiceField(
+            choices=list(spec.choices),
+            label=spec.text,
+            widget=forms.Select,
+            required=spec.required
+        )
+    return None
+
+
+@lru_cache(maxsize=128)
+def compile_named_survey_form(specs):
+    """
+    Builds (once per distinct tuple of specs) the form class of a named survey.
+
+    The fields are declared on the class, so creating a form instance only copies them.
+    The class attribute 'questions' maps the question id to its spec, used by the view to save the answers.
+    """
+    attrs = {}
+    for spec in specs:
+        field = make_named_survey_field(spec)
+        if field is not None:
+            attrs[f"question_{spec.question_id}"] = field
+    attrs['questions'] = {spec.question_id: spec for spec in specs}
+    attrs['default_renderer'] = hot_pages_form_renderer
+
+    return type('NamedSurveyForm', (forms.Form,), attrs)
+
+
 def make_named_survey_form(survey):
-    class NamedSurveyForm(forms.Form):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            questions = NamedSurveyQuestion.objects.filter(survey=survey)
-            for question in questions:
-                field_name = f"question_{question.id}"
-                # Get the required status from the 'mandatory' attribute of the question
-                required_status = question.mandatory
-
-                if question.question_type == 'YNK':
-                    choices = [('do_not_know', 'Non lo so'), ('yes', 'Sì'), ('no', 'No')]
-                    self.fields[field_name] = forms.ChoiceField(
-                        choices=choices,
-                        label=question.text,
-                        widget=forms.Select,
-                        initial='do_not_know',
-                        required=required_status  # Set the required status based on the question's mandatory attribute
-                    )
-                elif question.question_type == 'YN':
-                    choices = [('Sì', 'Sì'), ('No', 'No')]
-                    self.fields[field_name] = forms.ChoiceField(
-                        choices=choices,
-                        label=question.text,
-                        widget=forms.Select,
-                        required=required_status  # Apply the mandatory attribute
-                    )
-                elif question.question_type == 'TXT':
-                    self.fields[field_name] = forms.CharField(
-                        label=question.text,
-                        widget=forms.Textarea(attrs={'rows': 4}),
-                        required=required_status  # Apply the mandatory attribute
-                    )
-                elif question.question_type == 'MCQ':
-                    # Fetch the options related to the current question
-                    options = NamedSurveyQuestionOption.objects.filter(question=question)
-                    choices = [(option.option_text, option.option_text) for option in options]
-                    self.fields[field_name] = forms.ChoiceField(
-                        choices=choices,
-                        label=question.text,
-                        widget=forms.Select,
-                        required=required_status  # Apply the mandatory attribute
-                    )
-
-    return NamedSurveyForm
+    return compile_named_survey_form(get_named_survey_field_specs(survey))
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .results import compute_poll_results
+
+DEFAULT_LIVE_RESULTS_REFRESH_INTERVAL = 10  # in seconds
+
+# a stale entry is still served (while one request recomputes it) up to this many refresh intervals
+STALE_FACTOR = 6
+
+
+def get_refresh_interval():
+    return getattr(settings, 'LIVE_RESULTS_REFRESH_INTERVAL', DEFAULT_LIVE_RESULTS_REFRESH_INTERVAL)
+
+
+def _cache_key(question_id):
+    return f"poll-results:{question_id}"
+
+
+def compute_live_results(question):
+    """
+    Computes the tallies of a question (see core.results) and caches them with their JSON body and strong ETag.
+
+    The body holds only the tallies, so the ETag changes only when a vote changes them.
+    """
+    (result,) = compute_poll_results([question])
+
+    payload = {
+        'question': question.slug,
+        'question_text': result['question_text'],
+        'total_votes': result['total_votes'],
+        # votes descending, then text, so that the same tallies always give the same body
+        'results': [{'choice': choice_text, 'votes': votes}
+                    for choice_text, votes in sorted(result['results'], key=lambda x: (-x[1], x[0]))],
+    }
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+
+    entry = {
+        'payload': payload,
+        'body': body,
+        'etag': hashlib.sha256(body).hexdigest()[:32],
+        'computed_at': time.time(),
+    }
+    interval = get_refresh_interval()
+    cache.set(_cache_key(question.id), entry, timeout=interval * STALE_FACTOR)
+    return entry
+
+
+def get_live_results(question):
+    """
+    Returns the cached results of a question, recomputing them when older than LIVE_RESULTS_REFRESH_INTERVAL.
+
+    When the entry is stale, only the request that takes the refresh lock recomputes it, the others keep
+    serving the stale entry, so that a crowd of dashboards never runs the aggregates concurrently.
+
+    Returns:
+    - dict: {'payload', 'body' (JSON bytes), 'etag' (unquoted), 'computed_at' (timestamp)}
+    """
+    entry = cache.get(_cache_key(question.id))
+    if entry is None:
+        return compute_live_results(question)
+
+    interval = get_refresh_interval()
+    if time.time() - entry['computed_at'] >= interval and \
+            cache.add(f"poll-results-lock:{question.id}", 1, timeout=interval):
+        return compute_live_results(question)
+
+    return entry
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .live_results import compute_live_results
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIVE_STREAM_INTERVAL = 2.0  # in seconds
+DEFAULT_LIVE_STREAM_HEARTBEAT = 15.0  # in seconds
+DEFAULT_LIVE_STREAM_MAX_AGE = 3600  # in seconds, then the browser reconnects
+
+# milliseconds the browser waits before reconnecting
+RECONNECT_DELAY = 5000
+
+
+class Subscription:
+    """
+    A client of the broadcaster: the changes not sent yet, merged, so a slow client never holds a backlog.
+    """
+    __slots__ = ('changes', 'total_votes', 'event')
+
+    def __init__(self):
+        self.changes = {}
+        self.total_votes = None
+        self.event = asyncio.Event()
+
+    def push(self, changes, total_votes):
+        self.changes.update(changes)
+        self.total_votes = total_votes
+        self.event.set()
+
+    async def wait(self, timeout):
+        """
+        Returns (changes, total votes) as soon as there are changes, or None after timeout seconds.
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        changes, self.changes = self.changes, {}
+        self.event.clear()
+        return changes, self.total_votes
+
+
+class TallyBroadcaster:
+    """
+    Shares the polling of the tallies among all the clients streaming the same question.
+
+    While a question has subscribers, one task reads its tallies from the database every `interval` seconds
+    (compute_live_results(), which also refreshes the live results cache, see core/live_results.py) and
+    pushes the choices whose votes changed to every subscription; the task stops with the last subscriber.
+    There is one broadcaster per event loop (i.e. per worker), see get_broadcaster().
+
+    Args:
+        interval (float): Seconds between two reads of the tallies of a question.
+    """
+
+    def __init__(self, interval=DEFAULT_LIVE_STREAM_INTERVAL):
+        self.interval = interval
+        self.polls = 0
+        self._subscriptions = {}
+        self._tallies = {}
+        self._loading = {}
+        self._tasks = {}
+
+    def subscribers(self, question_id=None):
+        if question_id is not None:
+            return len(self._subscriptions.get(question_id, ()))
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    async def _read_tallies(self, question):
+        self.polls += 1
+        # not get_live_results(): its entries are only refreshed every LIVE_RESULTS_REFRESH_INTERVAL seconds
+        live_results = await sync_to_async(compute_live_results)(question)
+        return {result['choice']: result['votes'] for result in live_results['payload']['results']}
+
+    async def subscribe(self, question):
+        """
+        Returns (subscription, current tallies {choice text: votes}).
+        """
+        subscription = Subscription()
+        self._subscriptions.setdefault(question.id, set()).add(subscription)
+
+        if question.id not in self._tallies:
+            # the clients connecting together share the first read
+            loading = self._loading.get(question.id)
+            if loading is None:
+                loading = self._loading[question.id] = asyncio.ensure_future(self._read_tallies(question))
+                loading.add_done_callback(lambda _: self._loading.pop(question.id, None))
+            try:
+                tallies = await asyncio.shield(loading)
+            except BaseException:
+                self.unsubscribe(question, subscription)
+                raise
+            self._tallies.setdefault(question.id, tallies)
+        if question.id not in self._tasks:
+            self._tasks[question.id] = asyncio.create_task(self._poll(question))
+
+        return subscription, dict(self._tallies[question.id])
+
+    def unsubscribe(self, question, subscription):
+        subscriptions = self._subscriptions.get(question.id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[question.id]
+            self._tallies.pop(question.id, None)
+            task = self._tasks.pop(question.id, None)
+            if task is not None:
+                task.cancel()
+
+    async def _poll(self, question):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                tallies = await self._read_tallies(question)
+            except Exception:
+                # the database may be momentarily unavailable: keep the clients, retry at the next interval
+                logger.exception("reading the tallies of %s failed, retrying in %s s", question.slug, self.interval)
+                continue
+
+            previous = self._tallies.get(question.id, {})
+            changes = {choice: votes for choice, votes in tallies.items() if previous.get(choice) != votes}
+            # a choice gone from the tallies (a suggested choice deleted by a reset) drops to zero on the clients
+            changes.update({choice: 0 for choice in previous.keys() - tallies.keys()})
+            if not changes:
+                continue
+
+            self._tallies[question.id] = tallies
+            total_votes = sum(tallies.values())
+            for subscription in list(self._subscriptions.get(question.id, ())):
+                subscription.push(changes, total_votes)
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    """
+    Returns the TallyBroadcaster of the running event loop, configured from LIVE_STREAM_INTERVAL.
+    """
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = TallyBroadcaster(
+            interval=getattr(settings, 'LIVE_STREAM_INTERVAL', DEFAULT_LIVE_STREAM_INTERVAL))
+    return broadcaster
+
+
+def format_event(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+async def stream_tallies(question, broadcaster=None, heartbeat=None, max_age=None):
+    """
+    Server-sent events of the tallies of a question: a 'snapshot' event with all the tallies, then a 'delta'
+    event with the choices whose votes changed, and a comment line every `heartbeat` seconds without changes
+    (keeps proxies from closing idle connections). The stream ends after max_age seconds.
+    """
+    broadcaster = broadcaster or get_broadcaster()
+    heartbeat = heartbeat or getattr(settings, 'LIVE_STREAM_HEARTBEAT', DEFAULT_LIVE_STREAM_HEARTBEAT)
+    max_age = max_age or getattr(settings, 'LIVE_STREAM_MAX_AGE', DEFAULT_LIVE_STREAM_MAX_AGE)
+
+    subscription, tallies = await broadcaster.subscribe(question)
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_age
+        event_id = 0
+        yield f"retry: {RECONNECT_DELAY}\n".encode() + format_event(
+            'snapshot', {'results': tallies, 'total_votes': sum(tallies.values())}, event_id)
+
+        while loop.time() < deadline:
+            update = await subscription.wait(min(heartbeat, max(0.0, deadline - loop.time())))
+            if update is None:
+                yield b": keepalive\n\n"
+                continue
+            changes, total_votes = update
+            event_id += 1
+            yield format_event('delta', {'changes': changes, 'total_votes': total_votes}, event_id)
+    finally:
+        broadcaster.unsubscribe(question, subscription)
@@ -1,11 +1,24 @@
-from .models import EventLog, Subscriber
+import logging
+
+from .models import EventLog, Subscriber, ChoiceVote, ChoiceVoteSuggestedByUser, NamedSurveyResponse
+from .vote_counters import increment_choice_votes, upsert_suggested_choice
+from .event_log_buffer import get_event_log_buffer
+from .subscriber_cache import subscriber_cache
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
 from django.utils import timezone
 
+logger = logging.getLogger(__name__)
+
 
 def create_event_log(event_type, event_title, event_data, event_target=None):
     """
     Creates an instance of EventLog with the provided details.
 
+    With EVENT_LOG_MODE = 'buffered' the event is handed to the process EventLogBuffer and written later
+    with other events in one bulk insert (see core/event_log_buffer.py); the returned instance is not saved yet.
+
     Args:
     event_type (str): The type of the event (e.g., EMAIL_SENT, NEWSLETTER_SUBSCRIPTION_CONFIRMED).
     event_title (str): A short title or description of the event.
@@ -23,10 +36,13 @@ def create_event_log(event_type, event_title, event_data, event_target=None):
             event_target=event_target,
             created_at=timezone.now()
         )
-        event_log.save()
+        if getattr(settings, 'EVENT_LOG_MODE', 'sync') == 'buffered':
+            get_event_log_buffer().add(event_log)
+        else:
+            event_log.save()
         return event_log
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("event log could not be recorded: %s", event_title)
         return None
 
 
@@ -50,17 +66,94 @@ def create_subscriber(email, name, surname, matricola):
 
 def create_subscriber_if_not_exits(email, name, surname, matricola, uaf, structure):
     """
-    Creates a new Subscriber instance and saves it to the database if it does not already exist.
+    Returns the Subscriber identified by (matricola, email), creating it if it does not exist yet.
+
+    The other attributes are updated in place when they differ from the stored ones. Subscribers resolved
+    recently by this process are served from an LRU cache (see core/subscriber_cache.py) without queries.
 
     Parameters:
     - email (str): The email of the subscriber.
     - name (str): The first name of the subscriber.
     - surname (str): The last name of the subscriber.
     - matricola (str): The matricola (unique identifier) of the subscriber.
+    - uaf (str): The UAF of the subscriber.
+    - structure (str): The structure of the subscriber.
 
     Returns:
     - subscriber (Subscriber): The newly created or existing Subscriber instance.
     """
-    subscriber, created = Subscriber.objects.get_or_create(email=email, name=name, surname=surname, matricola=matricola, uaf=uaf, structure=structure)
+    key = (matricola, email)
+    attributes = {'name': name, 'surname': surname, 'uaf': uaf, 'structure': structure}
+
+    subscriber = subscriber_cache.get(key, attributes)
+    if subscriber is not None:
+        return subscriber
+
+    subscriber = Subscriber.objects.filter(matricola=matricola, email=email).first()
+    if subscriber is None:
+        try:
+            with transaction.atomic():
+                subscriber = Subscriber.objects.create(matricola=matricola, email=email, **attributes)
+        except IntegrityError:
+            # created by a concurrent login in the meantime
+            subscriber = Subscriber.objects.get(matricola=matricola, email=email)
+
+    changed = [field for field, value in attributes.items() if getattr(subscriber, field) != value]
+    if changed:
+        for field in changed:
+            setattr(subscriber, field, attributes[field])
+        subscriber.save(update_fields=changed)
+
+    subscriber_cache.put(key, attributes, subscriber)
     return subscriber
 
+
+def merge_duplicate_subscribers(dry_run=False):
+    """
+    Merges the subscribers sharing the same (matricola, email), created when attributes changed upstream.
+
+    The most recent row of each group is kept (it has the latest attributes); the survey responses of the
+    others are moved to it and they are deleted. Run it before adding the unique key on (matricola, email).
+
+    Returns:
+    - tuple: (number of duplicate subscribers merged, number of survey responses moved)
+    """
+    groups = (Subscriber.objects.values('matricola', 'email')
+              .annotate(count=Count('id'), keep_id=Max('id')).filter(count__gt=1))
+
+    merged = moved = 0
+    for group in groups:
+        duplicates = (Subscriber.objects.filter(matricola=group['matricola'], email=group['email'])
+                      .exclude(id=group['keep_id']))
+        responses = NamedSurveyResponse.objects.filter(subscriber__in=duplicates)
+        merged += group['count'] - 1
+        if dry_run:
+            moved += responses.count()
+            continue
+
+        with transaction.atomic():
+            moved += responses.update(subscriber_id=group['keep_id'])
+            duplicates.delete()
+
+    return merged, moved
+
+
+def register_vote(question, choice, text_choice=None):
+    """
+    Records a vote synchronously: updates the counters and stores the ChoiceVote/ChoiceVoteSuggestedByUser row.
+
+    Parameters:
+    - question (Question or QuestionSnapshot): The question being voted.
+    - choice (Choice or ChoiceSnapshot): The selected choice.
+    - text_choice (str, optional): The text typed by the voter when the choice is the user defined one.
+    """
+    if choice.is_choice_text_user_defined():
+        # insert the choice typed by the user, or increment it if another user has already typed it
+        user_choice_id = upsert_suggested_choice(question, text_choice)
+
+        ChoiceVoteSuggestedByUser.objects.create(question_id=question.pk, choice_id=user_choice_id)
+    else:
+        # atomic increment of one of the counter shards of the choice
+        increment_choice_votes(choice)
+
+        ChoiceVote.objects.create(question_id=question.pk, choice_id=choice.pk)
@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from core.event_log_archive import archive_event_logs, import_event_log_archive, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Move old EventLog rows into compressed daily JSONL archives, or load an archive back.'
+    # ./manage.py archive_event_logs --older-than-days 90 --event-type EMAIL_SENT
+    # ./manage.py archive_event_logs --import archive/eventlog/eventlog-2024-03-01.jsonl.gz
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.EVENT_LOG_RETENTION_DAYS,
+                            help='archive the events older than this number of days')
+        parser.add_argument('--archive-dir', default=settings.EVENT_LOG_ARCHIVE_DIR, help='directory of the archives')
+        parser.add_argument('--event-type', action='append', help='archive only this event type (can be repeated)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='events archived and deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='only count the events to archive')
+        parser.add_argument('--import', dest='import_paths', action='append', metavar='PATH',
+                            help='load this archive back into the database (can be repeated)')
+
+    def handle(self, *args, **options):
+        if options['import_paths']:
+            for path in options['import_paths']:
+                imported = import_event_log_archive(path)
+                self.stdout.write(f"{path}: {imported} events imported")
+            return
+
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        start = time.perf_counter()
+
+        summary = archive_event_logs(
+            before, options['archive_dir'], event_types=options['event_type'], chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'], progress=lambda archived: self.stdout.write(f"  {archived} events archived"))
+
+        if options['dry_run']:
+            self.stdout.write(f"Events to archive (created before {before:%Y-%m-%d %H:%M}): {summary['archived']}")
+            return
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Events archived: {summary['archived']} in {elapsed:.2f} s, "
+                          f"files: {len(summary['files'])}")
+        for path in summary['files']:
+            self.stdout.write(f"  {path}")
@@ -0,0 +1,41 @@
+import random
+import timeit
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from anonpoll.access_policy import CIDRMatcher, DEFAULT_ALLOWED_NETWORKS
+from anonpoll.view_tools import is_private_ip
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark of the intranet check: per-view is_private_ip() against the precompiled CIDR matcher.'
+    # ./manage.py bench_access_policy --addresses 200 --number 200000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addresses', type=int, default=200, help='distinct client addresses')
+        parser.add_argument('--number', type=int, default=200000, help='checks per variant')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        # mostly intranet clients, some public ones
+        addresses = [f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+                     if rng.random() < 0.9 else f"93.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+                     for _ in range(options['addresses'])]
+        sequence = [rng.choice(addresses) for _ in range(options['number'])]
+
+        allow = getattr(settings, 'ACCESS_POLICY_ALLOW', DEFAULT_ALLOWED_NETWORKS)
+        deny = getattr(settings, 'ACCESS_POLICY_DENY', [])
+        uncached = CIDRMatcher(allow, deny, cache_size=0)
+        cached = CIDRMatcher(allow, deny)
+
+        variants = (
+            ('is_private_ip (per view)', is_private_ip),
+            ('CIDR matcher, no cache', uncached.is_allowed),
+            ('CIDR matcher + LRU cache', cached.is_allowed),
+        )
+
+        self.stdout.write(f"{options['number']} checks over {options['addresses']} distinct addresses")
+        for name, check in variants:
+            seconds = timeit.timeit(lambda: [check(ip) for ip in sequence], number=1)
+            self.stdout.write(f"{name:<28} {seconds * 1e9 / len(sequence):8.1f} ns/check")
@@ -0,0 +1,111 @@
+import json
+import platform
+import subprocess
+from urllib.parse import urlparse
+
+import django
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.utils import timezone
+
+from core.benchmarks import create_bench_poll, create_bench_survey, make_scenarios, run_scenario
+from core.registry_stub import StubSubscriberRegistry
+
+COMPARED_METRICS = ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+
+
+class Command(BaseCommand):
+    help = 'End-to-end benchmark of the poll and survey flows, run in process against a local SQLite database.'
+    # DJANGO_SETTINGS_MODULE=anonpoll.settings_bench ./manage.py bench_flows --requests 1000 --output bench.json
+    # DJANGO_SETTINGS_MODULE=anonpoll.settings_bench ./manage.py bench_flows --scenario vote_post --compare bench.json
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append',
+                            help='run only this scenario (can be repeated): vote_get, vote_post, free_text_vote, '
+                                 'subscriber_login, named_survey_submit')
+        parser.add_argument('--requests', type=int, default=500, help='measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=50, help='requests sent before measuring')
+        parser.add_argument('--choices', type=int, default=10, help='choices of the bench poll')
+        parser.add_argument('--questions', type=int, default=20, help='questions of the bench survey')
+        parser.add_argument('--stub-latency', type=float, default=0.0,
+                            help='seconds added by the stub registry to each answer')
+        parser.add_argument('--label', default='', help='label stored with the results (default: git commit)')
+        parser.add_argument('--output', help='write the results to this JSON file')
+        parser.add_argument('--compare', metavar='JSON', help='print the change against previous results')
+        parser.add_argument('--allow-non-sqlite', action='store_true',
+                            help='run against a database other than SQLite (the bench fixtures are written there)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' and not options['allow_non_sqlite']:
+            raise CommandError("the benchmark writes to the database: use DJANGO_SETTINGS_MODULE=anonpoll.settings_bench "
+                               "or --allow-non-sqlite")
+
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        poll = create_bench_poll(choices=options['choices'])
+        survey = create_bench_survey(questions=options['questions'])
+
+        scenarios = make_scenarios(poll, survey)
+        names = options['scenario'] or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError(f"unknown scenarios: {sorted(unknown)}")
+
+        # the login view calls the registry at CHECK_SUBSCRIBER_WS_URL, served here by the stub
+        registry_port = urlparse(settings.CHECK_SUBSCRIBER_WS_URL).port or 80
+        results = {}
+        with StubSubscriberRegistry(latency=options['stub_latency'], port=registry_port):
+            for name in names:
+                description, setup, request, expected_status = scenarios[name]
+                results[name] = run_scenario(setup, request, expected_status,
+                                             requests=options['requests'], warmup=options['warmup'])
+                self.write_result(name, description, results[name])
+
+        report = {
+            'label': options['label'] or self.git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'scenarios': results,
+        }
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.write_comparison(json.load(f), report)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def write_result(self, name, description, result):
+        line = (f"{name:<20} {result['throughput']:8.1f} req/s  p50 {result['p50_ms']:7.2f} ms  "
+                f"p95 {result['p95_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+                f"{result['queries_per_request']:5.1f} queries/req  ({description})")
+        if result['errors']:
+            self.stdout.write(self.style.WARNING(f"{line}  {result['errors']} unexpected responses"))
+        else:
+            self.stdout.write(line)
+
+    def write_comparison(self, previous, report):
+        self.stdout.write(f"Compared with {previous.get('label') or previous.get('created_at')}:")
+        for name, result in report['scenarios'].items():
+            before = previous.get('scenarios', {}).get(name)
+            if before is None:
+                continue
+            changes = []
+            for metric in COMPARED_METRICS:
+                if before.get(metric):
+                    change = (result[metric] - before[metric]) / before[metric] * 100
+                    changes.append(f"{metric} {change:+.1f}%")
+            self.stdout.write(f"  {name:<20} " + '  '.join(changes))
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
@@ -0,0 +1,115 @@
+import json
+import os
+import subprocess
+import sys
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+
+from core.benchmarks import create_bench_poll, create_bench_survey, make_scenarios, run_scenario_threaded, \
+    run_scenario_async, BENCH_POLL_SLUG, BENCH_SURVEY_SLUG
+from core.models import Question, NamedSurvey
+from core.registry_stub import StubSubscriberRegistry
+
+DEFAULT_SCENARIOS = ['vote_post', 'subscriber_login', 'named_survey_submit']
+MODES = ('wsgi', 'asgi')
+
+
+class Command(BaseCommand):
+    help = ('Runs the same concurrent load against the sync views served by sync worker threads (WSGI) and '
+            'against the async views served by one event loop (ASGI), each in its own process.')
+    # DJANGO_SETTINGS_MODULE=anonpoll.settings_bench ./manage.py bench_servers --concurrency 64 --stub-latency 0.05
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append',
+                            help=f'run only this scenario (can be repeated), default: {", ".join(DEFAULT_SCENARIOS)}')
+        parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients')
+        parser.add_argument('--workers', type=int, default=8, help='sync worker threads of the WSGI run')
+        parser.add_argument('--stub-latency', type=float, default=0.05,
+                            help='seconds added by the stub registry to each answer')
+        parser.add_argument('--output', help='write the results to this JSON file')
+        parser.add_argument('--allow-non-sqlite', action='store_true',
+                            help='run against a database other than SQLite (the bench fixtures are written there)')
+        # internal: run one mode and print its results as JSON
+        parser.add_argument('--mode', choices=MODES, help='run only this mode, in this process')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' and not options['allow_non_sqlite']:
+            raise CommandError("the benchmark writes to the database: use DJANGO_SETTINGS_MODULE=anonpoll.settings_bench "
+                               "or --allow-non-sqlite")
+
+        names = options['scenario'] or DEFAULT_SCENARIOS
+
+        if options['mode']:
+            self.run_mode(options['mode'], names, options)
+            return
+
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        poll = create_bench_poll()
+        survey = create_bench_survey()
+        unknown = set(names) - set(make_scenarios(poll, survey))
+        if unknown:
+            raise CommandError(f"unknown scenarios: {sorted(unknown)}")
+
+        report = {'concurrency': options['concurrency'], 'workers': options['workers'],
+                  'stub_latency': options['stub_latency'], 'requests': options['requests']}
+
+        registry_port = urlparse(settings.CHECK_SUBSCRIBER_WS_URL).port or 80
+        with StubSubscriberRegistry(latency=options['stub_latency'], port=registry_port):
+            for mode in MODES:
+                report[mode] = self.spawn(mode, names, options)
+
+        for name in names:
+            wsgi, asgi = report['wsgi'][name], report['asgi'][name]
+            self.stdout.write(name)
+            for mode, result in (('wsgi', wsgi), ('asgi', asgi)):
+                line = (f"  {mode}  {result['throughput']:8.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+                        f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms")
+                if result['errors']:
+                    line += f"  {result['errors']} unexpected responses"
+                self.stdout.write(line)
+            if wsgi['throughput']:
+                self.stdout.write(f"  asgi/wsgi throughput: {asgi['throughput'] / wsgi['throughput']:.2f}x")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def spawn(self, mode, names, options):
+        # a fresh process per mode, with the URLs of that deployment (ASYNC_VIEWS, see core/urls.py) and without
+        # the registry cache, so that every login waits for the registry
+        env = dict(os.environ, ASYNC_VIEWS=str(mode == 'asgi'), CHECK_SUBSCRIBER_WS_CACHE_TTL='0',
+                   CHECK_SUBSCRIBER_WS_NEGATIVE_CACHE_TTL='0')
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_servers', '--mode', mode,
+                   '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+                   '--workers', str(options['workers'])]
+        for name in names:
+            command += ['--scenario', name]
+        if options['allow_non_sqlite']:
+            command.append('--allow-non-sqlite')
+
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f"the {mode} run failed:\n{completed.stderr}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_mode(self, mode, names, options):
+        scenarios = make_scenarios(Question.objects.get(slug=BENCH_POLL_SLUG),
+                                   NamedSurvey.objects.get(slug=BENCH_SURVEY_SLUG))
+        # the async runner opens its own connections, in the threads of the requests
+        connection.close()
+
+        results = {}
+        for name in names:
+            description, setup, request, expected_status = scenarios[name]
+            if mode == 'wsgi':
+                results[name] = run_scenario_threaded(setup, request, expected_status, requests=options['requests'],
+                                                      concurrency=options['concurrency'], workers=options['workers'])
+            else:
+                results[name] = run_scenario_async(setup, request, expected_status, requests=options['requests'],
+                                                   concurrency=options['concurrency'])
+        self.stdout.write(json.dumps(results))
@@ -0,0 +1,81 @@
+import time
+
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.template import engines
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from anonpoll.templating import build_jinja2_engine, precompile_jinja2_templates
+from core.benchmarks import create_bench_survey, summarize
+from core.forms import make_named_survey_form
+
+
+class Command(BaseCommand):
+    help = ('Compares the render time of the named survey form page with the Django template engine and with '
+            'Jinja2, and the time to compile the Jinja2 hot templates with and without the bytecode cache.')
+    # DJANGO_SETTINGS_MODULE=anonpoll.settings_bench ./manage.py bench_templates --questions 50 --renders 500
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=50, help='questions of the bench survey')
+        parser.add_argument('--renders', type=int, default=300, help='measured renders per engine')
+        parser.add_argument('--warmup', type=int, default=20, help='renders before measuring')
+        parser.add_argument('--compiles', type=int, default=10, help='cold compiles of the Jinja2 templates')
+        parser.add_argument('--allow-non-sqlite', action='store_true',
+                            help='run against a database other than SQLite (the bench survey is written there)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' and not options['allow_non_sqlite']:
+            raise CommandError("the benchmark writes to the database: use DJANGO_SETTINGS_MODULE=anonpoll.settings_bench "
+                               "or --allow-non-sqlite")
+
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        survey = create_bench_survey(questions=options['questions'])
+        request = RequestFactory().get(reverse('core:post-authenticated-survey', args=(survey.slug,)))
+        # the form class is built once, as in the view (its specs are cached)
+        PollForm = make_named_survey_form(survey)
+
+        def render_with(template):
+            def render():
+                return template.render({'form': PollForm(), 'survey': survey}, request)
+            return render
+
+        django_template = engines['django'].get_template('named_polls/poll_form.html')
+        django_result = self.time_renders(render_with(django_template), options)
+
+        # the widgets of the form are rendered with Jinja2 too, as when JINJA2_TEMPLATES is on
+        with override_settings(JINJA2_TEMPLATES=True):
+            jinja2_template = build_jinja2_engine().get_template('named_polls/poll_form.jinja')
+            jinja2_result = self.time_renders(render_with(jinja2_template), options)
+
+        self.stdout.write(f"named survey form, {options['questions']} questions, {options['renders']} renders")
+        for name, result in (('django', django_result), ('jinja2', jinja2_result)):
+            self.stdout.write(f"  {name:<7} mean {result['mean_ms']:7.3f} ms  p50 {result['p50_ms']:7.3f} ms  "
+                              f"p95 {result['p95_ms']:7.3f} ms")
+        if jinja2_result['mean_ms']:
+            self.stdout.write(f"  django/jinja2: {django_result['mean_ms'] / jinja2_result['mean_ms']:.2f}x")
+
+        # a new engine starts with an empty in-memory template cache, as a new worker process does
+        precompile_jinja2_templates(build_jinja2_engine())  # fills the bytecode cache
+        for label, bytecode_cache in (('from source', False), ('from the bytecode cache', True)):
+            timings = []
+            for _ in range(options['compiles']):
+                engine = build_jinja2_engine(bytecode_cache=bytecode_cache)
+                start = time.perf_counter()
+                count = precompile_jinja2_templates(engine)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(f"compile of the {count} Jinja2 templates {label}: "
+                              f"{sum(timings) / len(timings) * 1000:.2f} ms")
+
+    @staticmethod
+    def time_renders(render, options):
+        for _ in range(options['warmup']):
+            render()
+
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(options['renders']):
+            render_start = time.perf_counter()
+            render()
+            latencies.append(time.perf_counter() - render_start)
+        return summarize(latencies, 0, time.perf_counter() - start)
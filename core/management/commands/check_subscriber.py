@@ -1,31 +1,51 @@
+import statistics
+import time
+
 import requests
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
 
+from anonpoll.settings import CHECK_SUBSCRIBER_WS_URL
+from core.registry_stub import StubSubscriberRegistry
+from core.subscriber_registry import SubscriberRegistryClient, get_subscriber_registry_client
+
 
 class Command(BaseCommand):
     help = 'Check if a subscriber with the given matricola and email exists.'
     # ./manage.py check_subscriber 123456 test@example.com http://localhost:8000/registrazione/check-subscriber/
+    # ./manage.py check_subscriber 123456 test@example.com --stub --benchmark 500
 
     def add_arguments(self, parser):
         parser.add_argument('matricola', type=str, help='Matricola of the subscriber')
         parser.add_argument('email', type=str, help='Email of the subscriber')
-        parser.add_argument('url', type=str, help='URL of the web service')
+        parser.add_argument('url', type=str, nargs='?', default=None,
+                            help='URL of the web service (default: CHECK_SUBSCRIBER_WS_URL)')
+        parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                            help='call the web service N times with and without the pooled client and report latencies')
+        parser.add_argument('--stub', action='store_true', help='run against a local stub of the web service')
+        parser.add_argument('--stub-latency', type=float, default=0.0, help='seconds added by the stub to each answer')
 
     def handle(self, *args, **kwargs):
         matricola = kwargs['matricola']
         email = kwargs['email']
-        url = kwargs['url']
 
-        # url = 'http://your_domain.com/check-subscriber/'  # Replace with the actual URL of your web service
-        params = {'matricola': matricola, 'email': email}
+        if kwargs['stub']:
+            with StubSubscriberRegistry(latency=kwargs['stub_latency']) as registry:
+                self.run(matricola, email, registry.url, kwargs)
+        else:
+            self.run(matricola, email, kwargs['url'], kwargs)
+
+    def run(self, matricola, email, url, kwargs):
+        if kwargs['benchmark']:
+            self.benchmark(matricola, email, url or CHECK_SUBSCRIBER_WS_URL, kwargs['benchmark'])
+            return
+
+        # same client used by the login view, unless another URL is given
+        client = SubscriberRegistryClient(url) if url else get_subscriber_registry_client()
 
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            data = response.json()
-            exists = data.get('exists', False)
+            exists, subscriber = client.check(matricola, email)
             if exists:
-                subscriber = data.get('subscriber', {})
                 self.stdout.write(
                     self.style.SUCCESS(f'Subscriber with matricola {matricola} and email {email} exists.'))
                 self.stdout.write(f'Subscriber details: {subscriber}')
@@ -34,3 +54,37 @@ class Command(BaseCommand):
                     self.style.WARNING(f'Subscriber with matricola {matricola} and email {email} does not exist.'))
         except requests.RequestException as e:
             self.stderr.write(self.style.ERROR(f'Error calling CheckSubscriberView: {e}'))
+
+    def benchmark(self, matricola, email, url, n):
+        params = {'matricola': matricola, 'email': email}
+
+        def unpooled():
+            requests.get(url, params=params, timeout=10).json()
+
+        pooled_client = SubscriberRegistryClient(url, cache_ttl=0, negative_cache_ttl=0)
+
+        def pooled():
+            pooled_client.check(matricola, email)
+
+        cached_client = SubscriberRegistryClient(url)
+        cache.delete(cached_client._cache_key(matricola, email))
+
+        def cached():
+            cached_client.check(matricola, email)
+
+        self.stdout.write(f'{n} calls to {url}')
+        for name, call in (('new connection per call', unpooled), ('pooled client', pooled),
+                           ('pooled client + cache', cached)):
+            latencies = []
+            for _ in range(n):
+                start = time.perf_counter()
+                call()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(f'{name:<25} mean {statistics.mean(latencies):8.3f} ms  '
+                              f'p50 {statistics.median(latencies):8.3f} ms  p95 {p95:8.3f} ms')
+
+        pooled_client.close()
+        cached_client.close()
@@ -1,22 +1,48 @@
-from django.core.management import BaseCommand
+import time
 
-from core.models import Question, question_reset_votes
+from django.core.management import BaseCommand, CommandError
+
+from core.models import Question, question_reset_votes, DEFAULT_RESET_CHUNK_SIZE
 
 
 class Command(BaseCommand):
-    #
+    # reset the votes of one or more questions
+    # ./manage.py complete_reset_of_poll_votes --question_id 3 --question_id 4 --dry-run
 
     def add_arguments(self, parser):
-        parser.add_argument('--question_id', type=int, help='question id to reset votes for', required=True)
+        parser.add_argument('--question_id', type=int, action='append', required=True,
+                            help='question id to reset votes for (can be repeated)')
+        parser.add_argument('--dry-run', action='store_true', help='only count the rows that would be reset')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_RESET_CHUNK_SIZE,
+                            help='primary key range deleted per transaction')
 
     def handle(self, *args, **options):
 
-        question_id = options['question_id']
+        question_ids = options['question_id']
+
+        # get instances of Question
+        questions = list(Question.objects.filter(id__in=question_ids).order_by('id'))
+        missing = set(question_ids) - {question.id for question in questions}
+        if missing:
+            raise CommandError(f"questions not found: {sorted(missing)}")
+
+        def progress(table, deleted):
+            self.stdout.write(f"  {table}: {deleted} rows deleted")
+
+        total_rows = 0
+        start = time.perf_counter()
 
-        # get instance of Question
-        question = Question.objects.get(id=question_id)
+        for question in questions:
+            # reset votes for the given question
+            summary = question_reset_votes(question, chunk_size=options['chunk_size'], dry_run=options['dry_run'],
+                                           progress=progress)
+            total_rows += sum(summary.values())
 
-        # reset votes for the given question
-        question_reset_votes(question)
+            verb = "Rows to reset" if options['dry_run'] else "Votes reset"
+            details = ', '.join(f"{table}={count}" for table, count in summary.items())
+            self.stdout.write(f"{verb} for question #{question.id} {question}: {details}")
 
-        print("Votes reset for question: ", question)
+        elapsed = time.perf_counter() - start
+        rate = total_rows / elapsed if elapsed else 0
+        self.stdout.write(f"{len(questions)} questions, {total_rows} rows in {elapsed:.2f} s ({rate:.0f} rows/s)"
+                          + (" (dry run)" if options['dry_run'] else ""))
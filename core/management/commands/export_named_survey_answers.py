@@ -0,0 +1,35 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from core.exports import write_named_survey_answers, DEFAULT_CHUNK_SIZE
+from core.models import NamedSurvey, NamedSurveyAnswer
+
+
+class Command(BaseCommand):
+    help = 'Export the answers of a named survey to an Excel file (for exports too large for the admin).'
+    # ./manage.py export_named_survey_answers --slug my-survey --output answers.xlsx
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slug', type=str, help='slug of the named survey')
+        parser.add_argument('--survey_id', type=int, help='id of the named survey')
+        parser.add_argument('--output', type=str, required=True, help='path of the Excel file to write')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='answers fetched per query')
+
+    def handle(self, *args, **options):
+        if options['slug']:
+            survey = NamedSurvey.objects.filter(slug=options['slug']).first()
+        elif options['survey_id']:
+            survey = NamedSurvey.objects.filter(id=options['survey_id']).first()
+        else:
+            raise CommandError('either --slug or --survey_id is required')
+
+        if survey is None:
+            raise CommandError('named survey not found')
+
+        start = time.perf_counter()
+        count = write_named_survey_answers(NamedSurveyAnswer.objects.filter(response__survey=survey),
+                                           options['output'], chunk_size=options['chunk_size'])
+
+        self.stdout.write(f"{count} answers of \"{survey.title}\" exported to {options['output']} "
+                          f"in {time.perf_counter() - start:.1f} s")
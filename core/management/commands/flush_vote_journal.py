@@ -0,0 +1,30 @@
+import time
+
+from django.core.management import BaseCommand
+
+from core.vote_journal import flush_vote_journal, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Apply the votes queued in journal ingestion mode (VOTE_INGESTION_MODE=journal).'
+    # ./manage.py flush_vote_journal --loop --interval 2
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='votes applied per transaction')
+        parser.add_argument('--loop', action='store_true', help='keep running, flushing the journal every --interval seconds')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between two flushes in --loop mode')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        while True:
+            # votes left over by a crashed flusher are still in the journal and are replayed here
+            applied = flush_vote_journal(batch_size=batch_size)
+
+            if applied or not options['loop']:
+                self.stdout.write(f"Votes applied from the journal: {applied}")
+
+            if not options['loop']:
+                break
+
+            time.sleep(options['interval'])
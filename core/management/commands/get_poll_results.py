@@ -1,13 +1,19 @@
+import csv
+import io
+import json
 import smtplib
 import textwrap
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from anonpoll.settings import TECHNICAL_CONTACT_EMAIL
-from core.models import Question, question_reset_votes
+from core.models import Question
+from core.results import compute_poll_results
 
 
 smtp_server = "localhost"
@@ -41,57 +47,90 @@ def send_email(subject, body, from_email, to_email):
         print(f"Failed to send email: {e}")
 
 
-class Command(BaseCommand):
-    # provide a list of results of a poll
-
-    def add_arguments(self, parser):
-        parser.add_argument('--question_id', type=int, help='question id to calculate votes for', required=True)
+def format_text(results):
+    lines = []
+    for result in results:
+        lines.append(f"Results for question: {result['question_text']}")
+        for choice, votes in result['results']:
+            lines.append(f"{choice}: {votes} votes")
+        for choice, votes, rows in result['mismatches']:
+            lines.append(f"WARNING: {choice}: {votes} votes counted but {rows} vote rows")
+        lines.append("")
+    return "\n".join(lines)
 
-    def handle(self, *args, **options):
 
-        question_id = options['question_id']
+def format_json(results):
+    return json.dumps(results, indent=2, ensure_ascii=False)
 
-        # get instance of Question
-        question = Question.objects.get(id=question_id)
 
-        # get all Choice instances associated to question:
-        choices = question.choice_set.all()
+def format_csv(results):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['question_id', 'question_text', 'choice', 'votes'])
+    for result in results:
+        for choice, votes in result['results']:
+            writer.writerow([result['question_id'], result['question_text'], choice, votes])
+    return output.getvalue()
 
-        # sort choices by votes, descending
-        choices = sorted(choices, key=lambda x: x.votes, reverse=True)
 
-        # create a dict using choice_text as key and votes as value
-        choices = {choice.choice_text: choice.votes for choice in choices}
+FORMATTERS = {'text': format_text, 'json': format_json, 'csv': format_csv}
 
-        # exclude 'ZZZ_USER_DEFINED' choice
-        choices.pop('ZZZ_USER_DEFINED', None)
 
-        # consider also choices suggested by users
-        user_suggested_choices = question.choicesuggestedbyuser_set.all()
-        if user_suggested_choices:
-            # sort user suggested choices by votes, descending
-            user_suggested_choices = sorted(user_suggested_choices, key=lambda x: x.votes, reverse=True)
-
-            # create a dict using choice_text as key and votes as value
-            user_suggested_choices = {choice.choice_text: choice.votes for choice in user_suggested_choices}
+class Command(BaseCommand):
+    # provide the results of one or more polls, and send them to the admin email in a single digest
+    # ./manage.py get_poll_results --question_id 3 --question_id 4
+    # ./manage.py get_poll_results --all-active --format json --no-email
 
-        else:
-            user_suggested_choices = {}
+    def add_arguments(self, parser):
+        parser.add_argument('--question_id', type=int, action='append', default=[],
+                            help='question id to calculate votes for (can be repeated)')
+        parser.add_argument('--all-active', action='store_true', help='all the questions currently active')
+        parser.add_argument('--ended-since', type=str,
+                            help='all the questions ended since this date (YYYY-MM-DD or ISO datetime)')
+        parser.add_argument('--format', choices=FORMATTERS.keys(), default='text', help='output format')
+        parser.add_argument('--verify', action='store_true', help='check the counters against the vote rows')
+        parser.add_argument('--no-email', action='store_true', help='do not send the digest email')
 
-        # join the two dicts
-        choices |= user_suggested_choices
+    def handle(self, *args, **options):
 
-        # sort the dict by votes, descending
-        choices = dict(sorted(choices.items(), key=lambda x: x[1], reverse=True))
+        questions = Question.objects.none()
+        if options['question_id']:
+            questions |= Question.objects.filter(id__in=options['question_id'])
+        if options['all_active']:
+            now = timezone.now()
+            questions |= Question.objects.filter(start_time__lte=now, end_time__gte=now)
+        if options['ended_since']:
+            ended_since = parse_datetime(options['ended_since'])
+            if ended_since is None:
+                ended_since_date = parse_date(options['ended_since'])
+                if ended_since_date is None:
+                    raise CommandError(f"invalid date: {options['ended_since']}")
+                ended_since = datetime.combine(ended_since_date, datetime.min.time())
+            if timezone.is_naive(ended_since):
+                ended_since = timezone.make_aware(ended_since)
+            questions |= Question.objects.filter(end_time__gte=ended_since, end_time__lte=timezone.now())
+
+        if not (options['question_id'] or options['all_active'] or options['ended_since']):
+            raise CommandError('give at least one of --question_id, --all-active, --ended-since')
+
+        missing = set(options['question_id']) - set(questions.values_list('id', flat=True))
+        if missing:
+            raise CommandError(f"questions not found: {sorted(missing)}")
+
+        results = compute_poll_results(questions.order_by('id'), verify=options['verify'])
 
         # print results
-        print(f"Results for question: {question.question_text}")
-        for choice, votes in choices.items():
-            print(f"{choice}: {votes} votes")
+        self.stdout.write(FORMATTERS[options['format']](results))
+
+        if options['no_email'] or not results:
+            return
 
-        # send the same results to the admin email
-        subject = f"Results for question: {question.question_text}"
-        body = "\n".join([f"{choice}: {votes} votes" for choice, votes in choices.items()])
+        # send the same results to the admin email, as a single digest
+        if len(results) == 1:
+            subject = f"Results for question: {results[0]['question_text']}"
+        else:
+            subject = f"Results for {len(results)} questions"
+        body = format_text(results)
 
         now = datetime.now()
         # add timestamp
@@ -101,5 +140,3 @@ class Command(BaseCommand):
         to_email = TECHNICAL_CONTACT_EMAIL
 
         send_email(subject, body, from_email, to_email)
-
-
@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from core.logic import merge_duplicate_subscribers
+
+
+class Command(BaseCommand):
+    help = ('Merge the subscribers having the same (matricola, email). '
+            'Run it once before adding the unique key on (matricola, email).')
+    # ./manage.py merge_duplicate_subscribers --dry-run
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only count the duplicates')
+
+    def handle(self, *args, **options):
+        merged, moved = merge_duplicate_subscribers(dry_run=options['dry_run'])
+
+        verb = "Duplicates found" if options['dry_run'] else "Duplicates merged"
+        self.stdout.write(f"{verb}: {merged} subscribers, {moved} survey responses moved")
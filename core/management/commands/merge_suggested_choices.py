@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+
+from core.vote_counters import merge_duplicate_suggested_choices
+
+
+class Command(BaseCommand):
+    help = ('Merge the choices suggested by users having the same normalized text and fill in the normalized '
+            'text of older rows. Run it once after adding the (question, normalized_text) unique key.')
+    # ./manage.py merge_suggested_choices --dry-run
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question_id', type=int, action='append', help='restrict to this question (can be repeated)')
+        parser.add_argument('--dry-run', action='store_true', help='only count the duplicates')
+
+    def handle(self, *args, **options):
+        merged, repointed = merge_duplicate_suggested_choices(question_ids=options['question_id'],
+                                                              dry_run=options['dry_run'])
+
+        verb = "Duplicates found" if options['dry_run'] else "Duplicates merged"
+        self.stdout.write(f"{verb}: {merged} choices, {repointed} votes re-pointed")
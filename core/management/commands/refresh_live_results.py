@@ -0,0 +1,32 @@
+import time
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from core.live_results import compute_live_results, get_refresh_interval
+from core.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Precompute the cached live results of the active questions, so that no request has to.'
+    # ./manage.py refresh_live_results --loop
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='keep refreshing every --interval seconds')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='seconds between two refreshes in --loop mode (default: LIVE_RESULTS_REFRESH_INTERVAL)')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or get_refresh_interval()
+
+        while True:
+            now = timezone.now()
+            questions = Question.objects.filter(start_time__lte=now, end_time__gte=now)
+            for question in questions:
+                compute_live_results(question)
+
+            if not options['loop']:
+                self.stdout.write(f"Live results refreshed: {len(questions)} questions")
+                break
+
+            time.sleep(interval)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management import BaseCommand
+
+from anonpoll.settings import EMAIL_HOST
+from core.email_outbox import deliver_queued_emails, DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_BACKOFF
+
+
+class Command(BaseCommand):
+    help = 'Deliver the emails of the outbox, reusing the SMTP connection and retrying failures with backoff.'
+    # ./manage.py send_queued_emails --loop --interval 5
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email-host', type=str, default=EMAIL_HOST, help='SMTP server (host or host:port)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='emails sent per SMTP connection')
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='attempts before an email is marked as failed')
+        parser.add_argument('--retry-backoff', type=int, default=DEFAULT_RETRY_BACKOFF, help='seconds before the first retry, doubled at every attempt')
+        parser.add_argument('--loop', action='store_true', help='keep running, checking the outbox every --interval seconds')
+        parser.add_argument('--interval', type=float, default=5.0, help='seconds between two checks in --loop mode')
+
+    def handle(self, *args, **options):
+        while True:
+            while True:
+                sent, failed = deliver_queued_emails(
+                    options['email_host'],
+                    batch_size=options['batch_size'],
+                    max_attempts=options['max_attempts'],
+                    retry_backoff=options['retry_backoff'],
+                )
+                if sent or failed:
+                    self.stdout.write(f"Emails sent: {sent} failed: {failed}")
+                # a full batch of successes means there may be more emails due right now
+                if sent < options['batch_size']:
+                    break
+
+            if not options['loop']:
+                break
+
+            time.sleep(options['interval'])
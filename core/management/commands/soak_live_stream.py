@@ -0,0 +1,115 @@
+import asyncio
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from django.core.asgi import get_asgi_application
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+
+from core.benchmarks import create_bench_poll
+from core.live_stream import get_broadcaster
+from core.logic import register_vote
+
+
+class Command(BaseCommand):
+    help = ('Soak test of the live results stream: many idle server-sent events clients on one worker, '
+            'driven in process through the ASGI application while votes come in.')
+    # DJANGO_SETTINGS_MODULE=anonpoll.settings_bench ./manage.py soak_live_stream --clients 500 --duration 60
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=300, help='concurrent stream clients')
+        parser.add_argument('--duration', type=int, default=20, help='seconds each client stays connected')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between two reads of the tallies')
+        parser.add_argument('--votes-per-second', type=float, default=5.0, help='votes registered during the test')
+        parser.add_argument('--allow-non-sqlite', action='store_true',
+                            help='run against a database other than SQLite (the bench poll is written there)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' and not options['allow_non_sqlite']:
+            raise CommandError("the soak test writes to the database: use DJANGO_SETTINGS_MODULE=anonpoll.settings_bench "
+                               "or --allow-non-sqlite")
+
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        question = create_bench_poll(choices=5)
+
+        with override_settings(LIVE_RESULTS_PUBLIC=True, LIVE_STREAM_INTERVAL=options['interval'],
+                               LIVE_STREAM_MAX_AGE=options['duration'], LIVE_STREAM_HEARTBEAT=5, ALLOWED_HOSTS=['*']):
+            report = asyncio.run(self.soak(question, options))
+
+        self.stdout.write(
+            f"{options['clients']} clients for {options['duration']} s: "
+            f"{report['connected']} connected, {report['snapshots']} snapshots, "
+            f"delta events per client min {report['min_deltas']} / max {report['max_deltas']}, "
+            f"{report['votes']} votes")
+        self.stdout.write(f"tally reads: {report['polls']} (one task for all the clients), "
+                          f"memory: {report['memory_per_client'] / 1024:.1f} KiB per idle client")
+
+    async def soak(self, question, options):
+        application = get_asgi_application()
+        path = reverse('core:results-stream', args=(question.slug,))
+        clients = options['clients']
+        deltas = [0] * clients
+        snapshots = [0] * clients
+        statuses = []
+
+        async def client(n):
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # the client never disconnects, the stream ends after LIVE_STREAM_MAX_AGE
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif message['type'] == 'http.response.body':
+                    snapshots[n] += message.get('body', b'').count(b'event: snapshot')
+                    deltas[n] += message.get('body', b'').count(b'event: delta')
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 10000 + n),
+                'server': ('testserver', 80),
+            }
+            await application(scope, receive, send)
+
+        async def voter():
+            choices = await sync_to_async(list)(question.choice_set.exclude(choice_text='ZZZ_USER_DEFINED'))
+            votes = 0
+            deadline = time.monotonic() + options['duration']
+            while time.monotonic() < deadline:
+                await sync_to_async(register_vote)(question, choices[votes % len(choices)])
+                votes += 1
+                await asyncio.sleep(1 / options['votes_per_second'])
+            return votes
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+        tasks = [asyncio.create_task(client(n)) for n in range(clients)]
+        # let every client connect and receive its snapshot before measuring
+        while sum(snapshots) < clients and not all(task.done() for task in tasks):
+            await asyncio.sleep(0.1)
+        memory_per_client = (tracemalloc.get_traced_memory()[0] - baseline) / clients
+        tracemalloc.stop()
+
+        votes = await voter()
+        await asyncio.gather(*tasks)
+
+        return {
+            'connected': statuses.count(200),
+            'snapshots': sum(snapshots),
+            'min_deltas': min(deltas),
+            'max_deltas': max(deltas),
+            'votes': votes,
+            'polls': get_broadcaster().polls,
+            'memory_per_client': memory_per_client,
+        }
@@ -1,6 +1,8 @@
+import random
+import unicodedata
 import uuid
 
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 
@@ -34,7 +36,8 @@ class EventLog(models.Model):
     LOGIN_FAILED_JSON = "LOGIN_FAILED_JSON"
     REMAINDER_EMAIL_SENT = "REMAINDER_EMAIL_SENT"
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add: buffered events keep the time they happened at, not the time they are written
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     event_type = models.CharField(max_length=128, null=True)
     event_title = models.CharField(max_length=256, null=True)
@@ -44,6 +47,53 @@ class EventLog(models.Model):
     def __str__(self):
         return f"EventLog #{self.id}  event_type={self.event_type} event_target={self.event_target} event_title={self.event_title} {self.created_at}"
 
+    class Meta:
+        indexes = [
+            # admin changelist filtered by type and the retention archiver (see core/event_log_archive.py)
+            models.Index(fields=['event_type', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+
+class OutgoingEmail(models.Model):
+    """
+    An email of the outbox, delivered by the send_queued_emails command (see core/email_outbox.py).
+
+    Addresses are stored as comma separated lists.
+    """
+    QUEUED = "QUEUED"
+    SENT = "SENT"
+    FAILED = "FAILED"
+
+    STATUS_CHOICES = [
+        (QUEUED, 'In coda'),
+        (SENT, 'Inviata'),
+        (FAILED, 'Fallita'),
+    ]
+
+    from_email = models.CharField(max_length=255)
+    to_addresses = models.TextField()
+    cc_addresses = models.TextField(blank=True, default='')
+    bcc_addresses = models.TextField(blank=True, default='')
+    subject = models.CharField(max_length=1024)
+    body = models.TextField()
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"OutgoingEmail #{self.id} status={self.status} to={self.to_addresses} subject={self.subject}"
+
+    class Meta:
+        verbose_name = _("Email in uscita")
+        verbose_name_plural = _("Email in uscita")
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
 
 class Subscriber(models.Model):
     """
@@ -72,6 +122,19 @@ class Subscriber(models.Model):
     class Meta:
         verbose_name = _("Subscriber")
         verbose_name_plural = _("Subscribers")
+        constraints = [
+            # identity of a subscriber, the other attributes are updated in place at login
+            models.UniqueConstraint(fields=['matricola', 'email'], name='unique_subscriber_identity'),
+        ]
+
+
+def shuffle_choices(choices, seed=None):
+    """
+    Returns a shuffled copy of a list of choices; with the same seed the order is always the same.
+    """
+    choices = list(choices)
+    random.Random(seed).shuffle(choices)
+    return choices
 
 
 class Question(models.Model):
@@ -105,13 +168,15 @@ class Question(models.Model):
 
     # Modified method to get all choices related to this question
     # with an optional parameter to randomize the choices
-    def get_choices(self, sorted=False):
+    def get_choices(self, sorted=False, seed=None):
+        choices = list(self.choice_set.order_by('choice_text'))
         if not sorted:
-            # Randomize the order of returned choices
-            return self.choice_set.order_by('?')
+            # Randomize the order of returned choices in Python (no ORDER BY RAND() on the database);
+            # the same seed gives the same order
+            return shuffle_choices(choices, seed)
         else:
             # Return choices in their default order
-            return self.choice_set.order_by('choice_text')
+            return choices
 
     class Meta:
         verbose_name = _("Sondaggio")
@@ -119,18 +184,46 @@ class Question(models.Model):
         ordering = ('-created_at',)
 
 
+def normalize_choice_text(choice_text):
+    """
+    Returns the key used to recognize the same choice typed by different users:
+    unicode NFKC form, case folded, surrounding and repeated whitespace removed.
+    """
+    normalized = unicodedata.normalize('NFKC', choice_text or '')
+    return ' '.join(normalized.casefold().split())[:512]
+
+
 class ChoiceSuggestedByUser(models.Model):
+    """
+    A choice typed by the voters of a question.
+
+    Rows are unique on (question, normalized_text), so "Pizza " and "pizza" count as the same choice;
+    choice_text keeps the text as typed by the first voter. normalized_text is NULL only for rows created
+    before the key was introduced, see the merge_suggested_choices command.
+    """
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=512)
+    normalized_text = models.CharField(max_length=512, null=True, blank=True, editable=False)
     votes = models.IntegerField(default=0)
 
     def __str__(self):
         return f"{self.choice_text}"
 
+    def save(self, *args, **kwargs):
+        # recomputed at every save, so that an edited choice_text is matched by its new key
+        self.normalized_text = normalize_choice_text(self.choice_text)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'choice_text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_text'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = _("Scelta suggerita dall'utente")
         verbose_name_plural = _("Scelte suggerite dagli utenti")
         ordering = ('choice_text',)
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'normalized_text'], name='unique_suggested_choice_text'),
+        ]
 
 
 class Choice(models.Model):
@@ -147,7 +240,29 @@ class Choice(models.Model):
     class Meta:
         verbose_name = _("Scelta di sondaggio")
         verbose_name_plural = _("Scelte di sondaggio")
-        ordering = ('-votes',)
+        # the votes are in the counter shards, see core.vote_counters
+        ordering = ('id',)
+
+
+class ChoiceVoteCounterShard(models.Model):
+    """
+    One of the N counter rows of a Choice.
+
+    Votes are spread over VOTE_COUNTER_SHARDS rows per choice and incremented with an atomic
+    database-side UPDATE, so concurrent voters do not contend on the same Choice row.
+    The total of a choice is Choice.votes plus the sum of its shards (see core.vote_counters).
+    """
+    choice = models.ForeignKey(Choice, related_name='counter_shards', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.choice} shard={self.shard} votes={self.votes}"
+
+    class Meta:
+        verbose_name = _("Contatore parziale di voti")
+        verbose_name_plural = _("Contatori parziali di voti")
+        unique_together = ('choice', 'shard')
 
 
 class ChoiceVote(models.Model):
@@ -174,15 +289,84 @@ class ChoiceVoteSuggestedByUser(models.Model):
         ordering = ('-id',)
 
 
-def question_reset_votes(question):
-    for choice in question.choice_set.all():
-        choice.votes = 0
-        choice.save()
+class JournaledVote(models.Model):
+    """
+    A vote accepted in 'journal' ingestion mode and not yet applied to the counters.
 
-    ChoiceVote.objects.filter(question=question).delete()
-    ChoiceVoteSuggestedByUser.objects.filter(question=question).delete()
+    show_poll_question only inserts one row here and returns; the flush_vote_journal command applies
+    the pending rows in batches (bulk_create of ChoiceVote/ChoiceVoteSuggestedByUser and aggregated
+    counter updates) and deletes them in the same transaction, so a crash never loses or doubles a vote.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    text_choice = models.CharField(max_length=512, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"JournaledVote #{self.id} question={self.question_id} choice={self.choice_id} {self.created_at}"
+
+    class Meta:
+        verbose_name = _("Voto in attesa di registrazione")
+        verbose_name_plural = _("Voti in attesa di registrazione")
+        ordering = ('id',)
 
-    ChoiceSuggestedByUser.objects.filter(question=question).delete()
+
+DEFAULT_RESET_CHUNK_SIZE = 10000
+
+
+def _delete_in_pk_chunks(queryset, chunk_size, progress=None, label=''):
+    """
+    Deletes the rows of a queryset one primary key range at a time, each range in its own transaction,
+    so that no statement locks (or fills the undo log with) more than chunk_size rows.
+    Returns the number of deleted rows.
+    """
+    bounds = queryset.aggregate(low=models.Min('pk'), high=models.Max('pk'))
+    if bounds['low'] is None:
+        return 0
+
+    deleted = 0
+    for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        with transaction.atomic():
+            count, _ = queryset.filter(pk__gte=low, pk__lt=low + chunk_size).delete()
+        deleted += count
+        if progress is not None:
+            progress(label, deleted)
+    return deleted
+
+
+def question_reset_votes(question, chunk_size=DEFAULT_RESET_CHUNK_SIZE, dry_run=False, progress=None):
+    """
+    Resets the votes of a question: counters back to zero, vote rows and suggested choices deleted.
+
+    The counters are reset with a single UPDATE; vote rows are deleted in primary key ranges of chunk_size rows,
+    each in a bounded transaction.
+
+    Parameters:
+    - question (Question): The question.
+    - chunk_size (int): Primary key range deleted per transaction.
+    - dry_run (bool): Only count the rows that would be reset or deleted.
+    - progress (callable, optional): Called as progress(table, rows deleted so far) after each chunk.
+
+    Returns:
+    - dict: {table: number of rows reset or deleted (or to be, with dry_run)}
+    """
+    querysets = [
+        ('ChoiceVoteCounterShard', ChoiceVoteCounterShard.objects.filter(choice__question=question)),
+        ('JournaledVote', JournaledVote.objects.filter(question=question)),
+        ('ChoiceVote', ChoiceVote.objects.filter(question=question)),
+        ('ChoiceVoteSuggestedByUser', ChoiceVoteSuggestedByUser.objects.filter(question=question)),
+        ('ChoiceSuggestedByUser', ChoiceSuggestedByUser.objects.filter(question=question)),
+    ]
+
+    if dry_run:
+        summary = {'Choice': question.choice_set.exclude(votes=0).count()}
+        summary.update({label: queryset.count() for label, queryset in querysets})
+        return summary
+
+    summary = {'Choice': question.choice_set.exclude(votes=0).update(votes=0)}
+    for label, queryset in querysets:
+        summary[label] = _delete_in_pk_chunks(queryset, chunk_size, progress, label)
+    return summary
 
 
 #**********************
@@ -247,6 +431,13 @@ class NamedSurveyResponse(models.Model):
     def __str__(self):
         return f"Response on {self.created_at}"
 
+    def summary(self):
+        """
+        The "question: answer" lines of the response, in the order of the form (the answers are saved in it).
+        """
+        return [f"{answer.question.text}: {answer.text}"
+                for answer in self.answers.select_related('question').order_by('id')]
+
 
 class NamedSurveyAnswer(models.Model):
     response = models.ForeignKey(NamedSurveyResponse, related_name='answers', on_delete=models.CASCADE)
@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.utils import timezone
+
+from .models import Question, shuffle_choices
+
+DEFAULT_POLL_SNAPSHOT_CACHE_TIMEOUT = 300  # in seconds
+
+
+@dataclass(frozen=True)
+class ChoiceSnapshot:
+    """
+    Immutable copy of the fields of a Choice needed to render and validate a vote.
+    """
+    id: int
+    choice_text: str
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return f"{self.choice_text}"
+
+    def is_choice_text_user_defined(self):
+        return self.choice_text == 'ZZZ_USER_DEFINED'
+
+
+@dataclass(frozen=True)
+class QuestionSnapshot:
+    """
+    Immutable copy of a Question and of its choices, as cached by get_poll_snapshot().
+
+    It exposes the same attributes and methods of Question used by the voting views, forms and templates.
+    """
+    id: int
+    name: str
+    question_text: str
+    start_time: object
+    end_time: object
+    slug: str
+    ref_token: object
+    privacy_policy: Optional[str]
+    choices_are_sorted: bool
+    enable_textfield_choice: bool
+    updated_at: object
+    choices: Tuple[ChoiceSnapshot, ...]
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.question_text
+
+    def is_active(self):
+        now = timezone.now()
+        return self.start_time <= now <= self.end_time
+
+    def get_choices(self, sorted=False, seed=None):
+        if not sorted:
+            # Randomize the order of returned choices; the same seed gives the same order
+            return shuffle_choices(self.choices, seed)
+        else:
+            # choices are stored ordered by choice_text
+            return list(self.choices)
+
+    @classmethod
+    def from_question(cls, question):
+        return cls(
+            id=question.id,
+            name=question.name,
+            question_text=question.question_text,
+            start_time=question.start_time,
+            end_time=question.end_time,
+            slug=question.slug,
+            ref_token=question.ref_token,
+            privacy_policy=question.privacy_policy,
+            choices_are_sorted=question.choices_are_sorted,
+            enable_textfield_choice=question.enable_textfield_choice,
+            updated_at=question.updated_at,
+            choices=tuple(ChoiceSnapshot(id=choice_id, choice_text=choice_text)
+                          for choice_id, choice_text in
+                          question.choice_set.order_by('choice_text').values_list('id', 'choice_text')),
+        )
+
+
+def _version_key(slug):
+    return f"poll-snapshot-version:{slug}"
+
+
+def _cache_key(slug, updated_at):
+    return f"poll-snapshot:{slug}:{int(updated_at.timestamp() * 1000000)}"
+
+
+def get_poll_snapshot(slug):
+    """
+    Returns the QuestionSnapshot of the question with the given slug, raising Http404 if it does not exist.
+
+    Snapshots are cached under the slug plus Question.updated_at, and a version key maps the slug to the
+    current updated_at: a warm snapshot costs no database query, a cold version key costs one query on
+    updated_at. The signal handlers in core/signals.py drop the version key whenever a Question or one of its
+    choices changes, so the next read moves to the new snapshot. Both keys expire after
+    POLL_SNAPSHOT_CACHE_TIMEOUT seconds; the invalidation reaches other processes only if the default cache is
+    shared between them (e.g. Redis or Memcached), otherwise they may serve a stale copy until the version key
+    expires.
+    """
+    timeout = getattr(settings, 'POLL_SNAPSHOT_CACHE_TIMEOUT', DEFAULT_POLL_SNAPSHOT_CACHE_TIMEOUT)
+
+    version_key = _version_key(slug)
+    updated_at = cache.get(version_key)
+    if updated_at is None:
+        updated_at = Question.objects.filter(slug=slug).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            raise Http404("No Question matches the given query.")
+        cache.set(version_key, updated_at, timeout)
+
+    snapshot = cache.get(_cache_key(slug, updated_at))
+    if snapshot is None:
+        try:
+            question = Question.objects.get(slug=slug)
+        except Question.DoesNotExist:
+            raise Http404("No Question matches the given query.")
+
+        snapshot = QuestionSnapshot.from_question(question)
+        # the question may have changed since updated_at was read: store the snapshot under its own version
+        cache.set_many({_cache_key(slug, snapshot.updated_at): snapshot, version_key: snapshot.updated_at}, timeout)
+
+    return snapshot
+
+
+def invalidate_poll_snapshot(slug):
+    # the snapshot of the old version is left to expire, nothing reads its key any more
+    cache.delete(_version_key(slug))
@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _StubRegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real service behind its web server
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        matricola = params.get('matricola', [''])[0]
+        email = params.get('email', [''])[0]
+
+        self.server.requests_served += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        exists = not matricola.startswith('0')
+        data = {'exists': exists}
+        if exists:
+            data['subscriber'] = {'matricola': matricola, 'email': email, 'name': 'Nome', 'surname': 'Cognome',
+                                  'uaf': 'UAF', 'structure': 'Struttura'}
+
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSubscriberRegistry(ThreadingHTTPServer):
+    """
+    Local stand-in of the subscriber registry web service, for benchmarks and tests.
+
+    Every matricola is a subscriber except those starting with '0'. latency (seconds) is added to each answer.
+    The server listens on 127.0.0.1, on a free port unless one is given.
+
+    Usage:
+        with StubSubscriberRegistry() as registry:
+            requests.get(registry.url, params={'matricola': '123', 'email': 'a@b.c'})
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.requests_served = 0
+        super().__init__(('127.0.0.1', port), _StubRegistryHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/check-subscriber/"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
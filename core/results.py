@@ -0,0 +1,81 @@
+from collections import defaultdict
+
+from django.db.models import Count, Sum
+
+from .models import Choice, ChoiceSuggestedByUser, ChoiceVote, ChoiceVoteCounterShard, ChoiceVoteSuggestedByUser
+
+USER_DEFINED_CHOICE_TEXT = 'ZZZ_USER_DEFINED'
+
+
+def _count_vote_rows(model, question_ids):
+    # {choice_id: number of vote rows}, one grouped query
+    return dict(model.objects
+                .filter(question_id__in=question_ids)
+                .values('choice_id')
+                .annotate(count=Count('id'))
+                .values_list('choice_id', 'count'))
+
+
+def compute_poll_results(questions, verify=False):
+    """
+    Computes the tallies of many questions at once.
+
+    Each table is read with a single (grouped) query whatever the number of questions: choices, counter shards
+    and choices suggested by users; with verify=True also ChoiceVote and ChoiceVoteSuggestedByUser, whose row
+    counts are compared with the counters.
+
+    Parameters:
+    - questions (iterable of Question): The questions.
+    - verify (bool): Check the counters against the vote rows.
+
+    Returns:
+    - list of dict, one per question, in the order given:
+        {'question_id', 'question_text', 'results': [(choice_text, votes), ...] sorted by votes descending,
+         'total_votes', 'mismatches': [(choice_text, counted votes, vote rows), ...]}
+    """
+    questions = list(questions)
+    question_ids = [question.id for question in questions]
+
+    shard_votes = dict(ChoiceVoteCounterShard.objects
+                       .filter(choice__question_id__in=question_ids)
+                       .values('choice_id')
+                       .annotate(total=Sum('votes'))
+                       .values_list('choice_id', 'total'))
+
+    # (question_id, choice_text, votes) of every choice and suggested choice, by id
+    choices = {choice_id: (question_id, choice_text, votes + (shard_votes.get(choice_id) or 0))
+               for choice_id, question_id, choice_text, votes in
+               Choice.objects.filter(question_id__in=question_ids).values_list('id', 'question_id', 'choice_text', 'votes')
+               if choice_text != USER_DEFINED_CHOICE_TEXT}
+
+    suggested_choices = {choice_id: (question_id, choice_text, votes)
+                         for choice_id, question_id, choice_text, votes in
+                         ChoiceSuggestedByUser.objects.filter(question_id__in=question_ids)
+                         .values_list('id', 'question_id', 'choice_text', 'votes')}
+
+    # {question_id: {choice_text: votes}}; a suggested text equal to a choice adds up to it
+    tallies = defaultdict(dict)
+    for question_id, choice_text, votes in list(choices.values()) + list(suggested_choices.values()):
+        tallies[question_id][choice_text] = tallies[question_id].get(choice_text, 0) + votes
+
+    mismatches = defaultdict(list)
+    if verify:
+        for model, counted in ((ChoiceVote, choices), (ChoiceVoteSuggestedByUser, suggested_choices)):
+            vote_rows = _count_vote_rows(model, question_ids)
+            for choice_id, (question_id, choice_text, votes) in counted.items():
+                rows = vote_rows.get(choice_id, 0)
+                if rows != votes:
+                    mismatches[question_id].append((choice_text, votes, rows))
+
+    results = []
+    for question in questions:
+        question_tallies = sorted(tallies[question.id].items(), key=lambda x: x[1], reverse=True)
+        results.append({
+            'question_id': question.id,
+            'question_text': question.question_text,
+            'results': question_tallies,
+            'total_votes': sum(votes for _, votes in question_tallies),
+            'mismatches': mismatches[question.id],
+        })
+
+    return results
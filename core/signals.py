@@ -0,0 +1,52 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Question, Choice, NamedSurvey, NamedSurveyQuestion, NamedSurveyQuestionOption, Subscriber
+from .poll_snapshots import invalidate_poll_snapshot
+from .subscriber_cache import subscriber_cache
+
+
+@receiver(pre_save, sender=Question)
+def question_pre_save(sender, instance, **kwargs):
+    # if the slug changes, the snapshot cached under the old slug must go as well
+    if instance.pk:
+        old_slug = Question.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+        if old_slug and old_slug != instance.slug:
+            invalidate_poll_snapshot(old_slug)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    invalidate_poll_snapshot(instance.slug)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    # bump the version (updated_at) of the question, then drop its snapshot
+    slug = Question.objects.filter(pk=instance.question_id).values_list('slug', flat=True).first()
+    Question.objects.filter(pk=instance.question_id).update(updated_at=timezone.now())
+    if slug:
+        invalidate_poll_snapshot(slug)
+
+
+@receiver(post_save, sender=NamedSurveyQuestion)
+@receiver(post_delete, sender=NamedSurveyQuestion)
+def named_survey_question_changed(sender, instance, **kwargs):
+    # bump the version stamp (updated_at) of the survey, so its cached form specs are rebuilt
+    NamedSurvey.objects.filter(pk=instance.survey_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=NamedSurveyQuestionOption)
+@receiver(post_delete, sender=NamedSurveyQuestionOption)
+def named_survey_question_option_changed(sender, instance, **kwargs):
+    NamedSurvey.objects.filter(questions__id=instance.question_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Subscriber)
+@receiver(post_delete, sender=Subscriber)
+def subscriber_changed(sender, instance, **kwargs):
+    # edited or deleted outside of the login (e.g. in the admin)
+    subscriber_cache.discard((instance.matricola, instance.email))
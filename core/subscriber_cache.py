@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300  # in seconds
+
+
+class SubscriberCache:
+    """
+    Per-process LRU cache of the subscribers resolved at login, keyed by (matricola, email).
+
+    Each entry holds the attributes the subscriber had when it was cached, so that a login with changed
+    attributes goes to the database and updates the row. Entries expire after ttl seconds, which bounds
+    how long another process may keep serving a subscriber deleted elsewhere.
+
+    Args:
+        maxsize (int): Number of subscribers kept.
+        ttl (float): Seconds an entry is valid.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, attributes):
+        """
+        Returns the cached subscriber if it has the given attributes, otherwise None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == attributes and time.monotonic() < entry[2]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, attributes, subscriber):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (attributes, subscriber, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+subscriber_cache = SubscriberCache(
+    maxsize=getattr(settings, 'SUBSCRIBER_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+    ttl=getattr(settings, 'SUBSCRIBER_CACHE_TTL', DEFAULT_CACHE_TTL),
+)
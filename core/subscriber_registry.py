@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from anonpoll.instrumentation import timed
+from anonpoll.metrics import get_metrics
+
+
+class SubscriberRegistryUnavailable(requests.RequestException):
+    """
+    Raised without calling the web service while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures; while open, calls are refused for reset_timeout seconds,
+    then one trial call is let through (half open): a success closes the circuit, a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half open: let this call through, the next ones wait for its outcome
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+def _as_requests_exception(e):
+    # the requests exception matching an httpx one, so that callers handle both clients alike
+    if isinstance(e, httpx.ConnectTimeout):
+        return requests.ConnectTimeout(e)
+    if isinstance(e, httpx.TimeoutException):
+        return requests.ReadTimeout(e)
+    if isinstance(e, httpx.HTTPStatusError):
+        return requests.HTTPError(e)
+    return requests.ConnectionError(e)
+
+
+class SubscriberRegistryClient:
+    """
+    Client of the web service (CHECK_SUBSCRIBER_WS_URL) that tells whether a (matricola, email) pair is a subscriber.
+
+    - the HTTP connections are kept alive and pooled by a requests.Session;
+    - every call is bounded by (connect, read) timeouts;
+    - positive and negative answers are cached (Django cache) under a hash of (matricola, email), for
+      cache_ttl and negative_cache_ttl seconds; errors are never cached;
+    - a circuit breaker stops calling the service after repeated failures.
+
+    acheck() is the same call for async views, sent by an httpx.AsyncClient (one per event loop, pooled
+    too), so no thread waits for the service; its errors are raised as the same requests exceptions.
+
+    Args:
+        url (str): URL of the web service.
+        timeout (tuple): (connect, read) timeouts in seconds.
+        cache_ttl (int): Seconds a positive answer is cached (0 disables the cache).
+        negative_cache_ttl (int): Seconds a negative answer is cached (0 disables the cache).
+        pool_maxsize (int): Maximum number of pooled connections.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_timeout (int): Seconds the circuit stays open.
+    """
+
+    def __init__(self, url, timeout=(2, 5), cache_ttl=600, negative_cache_ttl=60, pool_maxsize=10,
+                 failure_threshold=5, reset_timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.negative_cache_ttl = negative_cache_ttl
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.pool_maxsize = pool_maxsize
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _cache_key(matricola, email):
+        digest = hashlib.sha256(f"{matricola}\0{email}".encode()).hexdigest()
+        return f"subscriber-registry:{digest}"
+
+    def check(self, matricola, email):
+        """
+        Returns a tuple (exists, subscriber) where subscriber is the dict of attributes returned by the service.
+
+        Raises requests.RequestException (SubscriberRegistryUnavailable while the circuit is open).
+        """
+        key = self._cache_key(matricola, email)
+        if self.cache_ttl or self.negative_cache_ttl:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        if not self.circuit_breaker.allow():
+            raise SubscriberRegistryUnavailable("subscriber registry unavailable (circuit open)")
+
+        metrics = get_metrics()
+        try:
+            with timed('registry'), metrics.time('anonpoll_registry_request_seconds'):
+                response = self.session.get(self.url, params={'matricola': matricola, 'email': email}, timeout=self.timeout)
+            response.raise_for_status()  # Raise an exception for HTTP errors
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self._record_failure()
+            if isinstance(e, requests.RequestException):
+                raise
+            raise requests.RequestException(f"invalid response from subscriber registry: {e}") from e
+
+        result, ttl = self._succeeded(data)
+        if ttl:
+            cache.set(key, result, ttl)
+
+        return result
+
+    async def acheck(self, matricola, email):
+        """
+        Same as check(), without blocking the event loop.
+        """
+        key = self._cache_key(matricola, email)
+        if self.cache_ttl or self.negative_cache_ttl:
+            cached = await cache.aget(key)
+            if cached is not None:
+                return cached
+
+        if not self.circuit_breaker.allow():
+            raise SubscriberRegistryUnavailable("subscriber registry unavailable (circuit open)")
+
+        metrics = get_metrics()
+        try:
+            with timed('registry'), metrics.time('anonpoll_registry_request_seconds'):
+                response = await self._get_async_client().get(self.url, params={'matricola': matricola,
+                                                                                'email': email})
+            response.raise_for_status()
+            data = response.json()
+        except httpx.HTTPError as e:
+            self._record_failure()
+            raise _as_requests_exception(e) from e
+        except ValueError as e:
+            self._record_failure()
+            raise requests.RequestException(f"invalid response from subscriber registry: {e}") from e
+
+        result, ttl = self._succeeded(data)
+        if ttl:
+            await cache.aset(key, result, ttl)
+
+        return result
+
+    def _get_async_client(self):
+        # an httpx.AsyncClient serves only the event loop it was created in
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            connect_timeout, read_timeout = self.timeout
+            # like requests: redirects are followed, proxies and CA bundle are taken from the environment
+            client = self._async_clients[loop] = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_maxsize),
+                follow_redirects=True,
+                headers={'Accept': 'application/json'},
+            )
+        return client
+
+    def _record_failure(self):
+        self.circuit_breaker.record_failure()
+        get_metrics().inc('anonpoll_registry_failures_total')
+
+    def _succeeded(self, data):
+        # returns the result and the seconds it may be cached
+        self.circuit_breaker.record_success()
+
+        exists = bool(data.get('exists', False))
+        result = (exists, data.get('subscriber', {}) if exists else {})
+        return result, self.cache_ttl if exists else self.negative_cache_ttl
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        """
+        Closes the connections of the async client of the running event loop.
+        """
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_subscriber_registry_client():
+    """
+    Returns the SubscriberRegistryClient shared by the process, configured from the settings.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SubscriberRegistryClient(
+                    settings.CHECK_SUBSCRIBER_WS_URL,
+                    timeout=(settings.CHECK_SUBSCRIBER_WS_CONNECT_TIMEOUT, settings.CHECK_SUBSCRIBER_WS_READ_TIMEOUT),
+                    cache_ttl=settings.CHECK_SUBSCRIBER_WS_CACHE_TTL,
+                    negative_cache_ttl=settings.CHECK_SUBSCRIBER_WS_NEGATIVE_CACHE_TTL,
+                    failure_threshold=settings.CHECK_SUBSCRIBER_WS_FAILURE_THRESHOLD,
+                    reset_timeout=settings.CHECK_SUBSCRIBER_WS_RESET_TIMEOUT,
+                )
+    return _client
@@ -1,3 +1,1355 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+from html.parser import HTMLParser
+import smtplib
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import io
+import os
+import shutil
+import tempfile
+import tracemalloc
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from openpyxl import load_workbook
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.messages.storage import default_storage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import AsyncClient, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template import engines
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from anonpoll.access_policy import CIDRMatcher
+from anonpoll.instrumentation import view_stats
+from anonpoll.metrics import MetricsRegistry
+from anonpoll.rate_limit import RateLimiter, RateLimitMiddleware, check_rate_limit_cache
+from anonpoll.templating import build_jinja2_engine, get_jinja2_engine, hot_template, precompile_jinja2_templates
+from .models import Question, Choice, ChoiceVoteCounterShard, ChoiceVote, ChoiceSuggestedByUser, \
+    ChoiceVoteSuggestedByUser, JournaledVote, NamedSurvey, NamedSurveyQuestion, NamedSurveyResponse, \
+    NamedSurveyAnswer, Subscriber, NamedSurveyQuestionOption, OutgoingEmail, EventLog, question_reset_votes
+from .vote_counters import increment_choice_votes, get_choice_votes, get_question_tallies, collapse_choice_shards, \
+    upsert_suggested_choice, merge_duplicate_suggested_choices
+from .vote_journal import journal_vote, flush_vote_journal
+from .poll_snapshots import get_poll_snapshot
+from .forms import VoteForm, make_named_survey_form
+from .benchmarks import create_bench_poll, create_bench_survey, make_scenarios, run_scenario, percentile, \
+    run_scenario_threaded, run_scenario_async, SURVEY_ANSWERS
+from .email_outbox import queue_email, deliver_queued_emails, send_email_in_background
+from .event_log_archive import archive_event_logs, import_event_log_archive, get_archive_path
+from .event_log_buffer import EventLogBuffer
+from .exports import named_survey_answers_response
+from .live_stream import TallyBroadcaster, stream_tallies
+from .logic import register_vote, create_event_log, create_subscriber_if_not_exits
+from .results import compute_poll_results
+from .registry_stub import StubSubscriberRegistry
+from .subscriber_cache import subscriber_cache
+from .subscriber_registry import SubscriberRegistryClient, SubscriberRegistryUnavailable
+from .urls import get_urlpatterns
+
+
+def create_question(slug='test-poll', **kwargs):
+    now = timezone.now()
+    defaults = {
+        'name': 'Test poll',
+        'question_text': 'Which one?',
+        'start_time': now - timedelta(days=1),
+        'end_time': now + timedelta(days=1),
+        'slug': slug,
+    }
+    defaults.update(kwargs)
+    return Question.objects.create(**defaults)
+
+
+def create_named_survey(slug='test-survey', questions=5):
+    now = timezone.now()
+    survey = NamedSurvey.objects.create(title='Test survey', name='Test survey', slug=slug,
+                                        start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+    question_types = ['YNK', 'TXT', 'YN']
+    for i in range(questions):
+        NamedSurveyQuestion.objects.create(survey=survey, text=f'Question {i}',
+                                           question_type=question_types[i % len(question_types)])
+    return survey
+
+
+def named_survey_post_data(survey):
+    answers = {'YNK': 'yes', 'TXT': 'some text', 'YN': 'Sì'}
+    return {f'question_{question.id}': answers[question.question_type] for question in survey.questions.all()}
+
+
+def skip_without_file_database(test_case):
+    # SQLite's in-memory test database refuses writes from other threads ("database table is locked")
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        test_case.skipTest("concurrent writers need a file-backed test database (DATABASES['default']['TEST'])")
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Minimal in-process SMTP stand-in: accepts every message except those for refused_recipients,
+    and records the messages received and the connections opened.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, refused_recipients=()):
+        self.refused_recipients = set(refused_recipients)
+        self.messages = []
+        self.connections = 0
+        super().__init__(('127.0.0.1', 0), LocalSMTPHandler)
+
+    @property
+    def email_host(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply("221 bye")
+                return
+            if command in ('EHLO', 'HELO'):
+                self.reply("250 localhost")
+            elif command == 'MAIL':
+                recipients = []
+                self.reply("250 ok")
+            elif command == 'RCPT':
+                recipient = line.split(':', 1)[1].strip(' <>')
+                if recipient in self.server.refused_recipients:
+                    self.reply("550 no such user")
+                else:
+                    recipients.append(recipient)
+                    self.reply("250 ok")
+            elif command == 'DATA':
+                self.reply("354 end with .")
+                data = []
+                while (data_line := self.rfile.readline().decode()) not in ('.\r\n', ''):
+                    data.append(data_line)
+                self.server.messages.append((recipients, ''.join(data)))
+                self.reply("250 queued")
+            else:
+                self.reply("250 ok")
+
+
+class VoteCountersTest(TestCase):
+
+    def setUp(self):
+        self.question = create_question()
+        self.choice_a = Choice.objects.create(question=self.question, choice_text='A', votes=3)
+        self.choice_b = Choice.objects.create(question=self.question, choice_text='B')
+
+    @override_settings(VOTE_COUNTER_SHARDS=4)
+    def test_increment_spreads_over_shards(self):
+        for _ in range(100):
+            increment_choice_votes(self.choice_b)
+
+        self.assertLessEqual(ChoiceVoteCounterShard.objects.filter(choice=self.choice_b).count(), 4)
+        self.assertEqual(get_choice_votes(self.choice_b), 100)
+
+    def test_tallies_include_choice_votes(self):
+        increment_choice_votes(self.choice_a)
+        increment_choice_votes(self.choice_b, amount=2)
+
+        self.assertEqual(get_question_tallies(self.question), {self.choice_a.id: 4, self.choice_b.id: 2})
+
+    def test_collapse_shards(self):
+        for _ in range(10):
+            increment_choice_votes(self.choice_a)
+
+        collapse_choice_shards(self.choice_a)
+        self.choice_a.refresh_from_db()
+
+        self.assertEqual(self.choice_a.votes, 13)
+        self.assertFalse(ChoiceVoteCounterShard.objects.filter(choice=self.choice_a).exists())
+
+
+class SuggestedChoicesTest(TestCase):
+
+    def setUp(self):
+        self.question = create_question()
+        self.user_defined = Choice.objects.create(question=self.question, choice_text='ZZZ_USER_DEFINED')
+
+    def test_same_normalized_text_is_one_choice(self):
+        for text in ('Pizza', ' pizza ', 'PIZZA'):
+            register_vote(self.question, self.user_defined, text)
+        register_vote(self.question, self.user_defined, 'pasta')
+
+        pizza = ChoiceSuggestedByUser.objects.get(question=self.question, normalized_text='pizza')
+        self.assertEqual((pizza.choice_text, pizza.votes), ('Pizza', 3))
+        self.assertEqual(pizza.choicevotesuggestedbyuser_set.count(), 3)
+        self.assertEqual(ChoiceSuggestedByUser.objects.count(), 2)
+
+    def test_edited_text_changes_the_key(self):
+        register_vote(self.question, self.user_defined, 'Piza')
+        choice = ChoiceSuggestedByUser.objects.get()
+        choice.choice_text = 'Pizza'
+        choice.save(update_fields=['choice_text'])
+
+        register_vote(self.question, self.user_defined, 'pizza')
+
+        choice = ChoiceSuggestedByUser.objects.get()
+        self.assertEqual((choice.normalized_text, choice.votes), ('pizza', 2))
+
+    def test_upsert_is_one_statement(self):
+        upsert_suggested_choice(self.question, 'pizza')
+        with self.assertNumQueries(1):
+            upsert_suggested_choice(self.question, 'Pizza', amount=2)
+        self.assertEqual(ChoiceSuggestedByUser.objects.get().votes, 3)
+
+    def test_merge_legacy_duplicates(self):
+        legacy = ChoiceSuggestedByUser.objects.bulk_create([
+            ChoiceSuggestedByUser(question=self.question, choice_text=text, votes=1)
+            for text in ('Pizza', 'pizza ', 'pasta')])
+        for choice in legacy:
+            ChoiceVoteSuggestedByUser.objects.create(question=self.question, choice=choice)
+
+        self.assertEqual(merge_duplicate_suggested_choices(dry_run=True), (1, 1))
+        self.assertEqual(merge_duplicate_suggested_choices(), (1, 1))
+
+        pizza = ChoiceSuggestedByUser.objects.get(normalized_text='pizza')
+        self.assertEqual((pizza.pk, pizza.votes), (legacy[0].pk, 2))
+        self.assertEqual(pizza.choicevotesuggestedbyuser_set.count(), 2)
+        self.assertFalse(ChoiceSuggestedByUser.objects.filter(normalized_text=None).exists())
+
+
+class VoteJournalTest(TestCase):
+
+    def setUp(self):
+        self.question = create_question()
+        self.choice = Choice.objects.create(question=self.question, choice_text='A')
+        self.user_defined = Choice.objects.create(question=self.question, choice_text='ZZZ_USER_DEFINED')
+
+    def test_flush_applies_votes_in_batches(self):
+        for _ in range(7):
+            journal_vote(self.question, self.choice)
+        for text in ('red', 'red', 'blue'):
+            journal_vote(self.question, self.user_defined, text)
+
+        self.assertEqual(ChoiceVote.objects.count(), 0)
+
+        self.assertEqual(flush_vote_journal(batch_size=3), 10)
+
+        self.assertFalse(JournaledVote.objects.exists())
+        self.assertEqual(get_question_tallies(self.question)[self.choice.id], 7)
+        self.assertEqual(ChoiceVote.objects.filter(choice=self.choice).count(), 7)
+        self.assertEqual(ChoiceSuggestedByUser.objects.get(question=self.question, choice_text='red').votes, 2)
+        self.assertEqual(ChoiceVoteSuggestedByUser.objects.filter(question=self.question).count(), 3)
+
+    def test_max_batches_leaves_the_rest_for_replay(self):
+        for _ in range(5):
+            journal_vote(self.question, self.choice)
+
+        self.assertEqual(flush_vote_journal(batch_size=2, max_batches=1), 2)
+        self.assertEqual(JournaledVote.objects.count(), 3)
+
+        self.assertEqual(flush_vote_journal(), 3)
+        self.assertEqual(ChoiceVote.objects.count(), 5)
+
+
+class PollSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.question = create_question()
+        self.choice = Choice.objects.create(question=self.question, choice_text='A')
+        Choice.objects.create(question=self.question, choice_text='B')
+
+    def test_snapshot_is_invalidated_on_change(self):
+        self.assertEqual([c.choice_text for c in get_poll_snapshot('test-poll').choices], ['A', 'B'])
+
+        Choice.objects.create(question=self.question, choice_text='C')
+        self.assertEqual(len(get_poll_snapshot('test-poll').choices), 3)
+
+        self.question.question_text = 'Changed?'
+        self.question.save()
+        self.assertEqual(get_poll_snapshot('test-poll').question_text, 'Changed?')
+
+    def test_snapshot_is_keyed_by_updated_at(self):
+        self.assertEqual(get_poll_snapshot('test-poll').question_text, 'Which one?')
+
+        # changed by another process, whose invalidation did not reach this cache
+        Question.objects.filter(pk=self.question.pk).update(question_text='Changed?', updated_at=timezone.now())
+        self.assertEqual(get_poll_snapshot('test-poll').question_text, 'Which one?')
+
+        # once the version key expires, the snapshot of the new updated_at is built, the old one is not served
+        cache.delete('poll-snapshot-version:test-poll')
+        self.assertEqual(get_poll_snapshot('test-poll').question_text, 'Changed?')
+
+    def test_vote_costs_no_definition_queries(self):
+        url = reverse('core:show-poll-question', args=('test-poll',))
+        self.client.get(url)  # warm the snapshot cache
+
+        def definition_queries(context):
+            return [q['sql'] for q in context.captured_queries
+                    if '"core_question"' in q['sql'] or '"core_choice"' in q['sql']]
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(definition_queries(context), [])
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, {'choice': self.choice.id, 'accept_privacy_policy': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(definition_queries(context), [])
+        self.assertEqual(ChoiceVote.objects.filter(choice=self.choice).count(), 1)
+
+
+class StaleSnapshotVoteTest(TransactionTestCase):
+    # deferred foreign key checks run at commit, which TestCase never reaches
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question()
+        self.choice = Choice.objects.create(question=self.question, choice_text='A')
+        Choice.objects.create(question=self.question, choice_text='B')
+
+    def test_vote_for_a_deleted_choice_redisplays_the_form(self):
+        url = reverse('core:show-poll-question', args=('test-poll',))
+        for mode in ('sync', 'journal'):
+            with self.subTest(mode=mode), mock.patch('core.views.VOTE_INGESTION_MODE', mode):
+                self.client.cookies.clear()  # the has_voted cookie of the previous mode
+                choice_id = Choice.objects.create(question=self.question, choice_text=f'Deleted in {mode}').id
+                self.assertIn(choice_id, [c.id for c in get_poll_snapshot('test-poll').choices])
+                # deleted by another process: the invalidation does not reach this cache
+                with mock.patch('core.signals.invalidate_poll_snapshot'):
+                    Choice.objects.filter(id=choice_id).delete()
+
+                response = self.client.post(url, {'choice': choice_id, 'accept_privacy_policy': 'yes'})
+
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('choice', response.context['form'].errors)
+                self.assertNotIn(choice_id, [c.id for c in get_poll_snapshot('test-poll').choices])
+
+                response = self.client.post(url, {'choice': self.choice.id, 'accept_privacy_policy': 'yes'})
+                self.assertEqual(response.status_code, 302)
+
+
+class ShuffledChoicesTest(TestCase):
+
+    def setUp(self):
+        self.question = create_question(choices_are_sorted=False)
+        for text in 'ABCDEFGH':
+            Choice.objects.create(question=self.question, choice_text=text)
+
+    def test_same_seed_same_order(self):
+        order = [c.id for c in self.question.get_choices(seed=42)]
+
+        self.assertEqual([c.id for c in self.question.get_choices(seed=42)], order)
+        self.assertEqual([c.id for c in get_poll_snapshot('test-poll').get_choices(seed=42)], order)
+
+    def test_no_random_ordering_on_database(self):
+        with CaptureQueriesContext(connection) as context:
+            self.question.get_choices()
+        self.assertFalse(any('RAND' in q['sql'].upper() for q in context.captured_queries))
+
+    def test_posted_seed_keeps_the_displayed_order(self):
+        snapshot = get_poll_snapshot('test-poll')
+        get_form = VoteForm(question=snapshot)
+        seed = get_form.fields['choice_seed'].initial
+
+        post_form = VoteForm({'choice_seed': seed, 'accept_privacy_policy': 'no'}, question=snapshot)
+        self.assertEqual(post_form.fields['choice'].choices, get_form.fields['choice'].choices)
+
+
+class NamedSurveyFormCacheTest(TestCase):
+
+    def setUp(self):
+        self.survey = create_named_survey(questions=3)
+        self.mcq = NamedSurveyQuestion.objects.create(survey=self.survey, text='Colour', question_type='MCQ')
+        NamedSurveyQuestionOption.objects.create(question=self.mcq, option_text='red')
+
+    def test_warm_form_costs_no_queries(self):
+        self.survey.refresh_from_db()
+        make_named_survey_form(self.survey)()
+
+        with self.assertNumQueries(0):
+            form = make_named_survey_form(self.survey)()
+        self.assertEqual(len(form.fields), 4)
+        self.assertEqual(form.fields[f'question_{self.mcq.id}'].choices, [('red', 'red')])
+
+    def test_option_change_invalidates_the_form(self):
+        self.survey.refresh_from_db()
+        make_named_survey_form(self.survey)()
+
+        NamedSurveyQuestionOption.objects.create(question=self.mcq, option_text='blue')
+        self.survey.refresh_from_db()
+
+        form = make_named_survey_form(self.survey)()
+        self.assertEqual(len(form.fields[f'question_{self.mcq.id}'].choices), 2)
+
+
+class EmailHandoffTest(TransactionTestCase):
+
+    @mock.patch('core.email_outbox.my_send_email')
+    def test_sent_in_background(self, my_send_email):
+        future = send_email_in_background('noreply@example.com', ['mario.rossi@example.com'], 'Riepilogo', 'corpo',
+                                          email_host='localhost', event_data='riepilogo inviato')
+        future.result(timeout=10)
+
+        my_send_email.assert_called_once()
+        self.assertTrue(EventLog.objects.filter(event_type=EventLog.EMAIL_SENT, event_data='riepilogo inviato').exists())
+
+        my_send_email.side_effect = smtplib.SMTPException('relay down')
+        future = send_email_in_background('noreply@example.com', ['mario.rossi@example.com'], 'Riepilogo', 'corpo')
+        self.assertIsInstance(future.exception(timeout=10), smtplib.SMTPException)
+        self.assertTrue(EventLog.objects.filter(event_type=EventLog.ERROR_SENDING_EMAIL).exists())
+
+
+class EmailOutboxTest(TestCase):
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(5):
+            queue_email('poll@example.com', [f'user{i}@example.com'], 'Subject', '<p>body</p>',
+                        bcc_addresses=['debug@example.com'])
+
+        with LocalSMTPServer() as server:
+            self.assertEqual(deliver_queued_emails(server.email_host), (5, 0))
+
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.messages), 5)
+        self.assertIn('debug@example.com', server.messages[0][0])
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 5)
+        self.assertEqual(EventLog.objects.filter(event_type=EventLog.EMAIL_SENT).count(), 5)
+
+    def test_failure_is_retried_with_backoff(self):
+        email = queue_email('poll@example.com', ['refused@example.com'], 'Subject', '<p>body</p>')
+        queue_email('poll@example.com', ['ok@example.com'], 'Subject', '<p>body</p>')
+
+        with LocalSMTPServer(refused_recipients=['refused@example.com']) as server:
+            self.assertEqual(deliver_queued_emails(server.email_host, max_attempts=2, retry_backoff=60), (1, 1))
+
+            # not due yet
+            self.assertEqual(deliver_queued_emails(server.email_host), (0, 0))
+
+            OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(deliver_queued_emails(server.email_host, max_attempts=2), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.FAILED)
+        self.assertEqual(email.attempts, 2)
+        self.assertEqual(EventLog.objects.filter(event_type=EventLog.ERROR_SENDING_EMAIL).count(), 2)
+
+    def test_unreachable_server_keeps_the_email_queued(self):
+        queue_email('poll@example.com', ['user@example.com'], 'Subject', '<p>body</p>')
+
+        # nothing listens on this port
+        self.assertEqual(deliver_queued_emails('127.0.0.1:1'), (0, 1))
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.QUEUED)
+
+
+class EventLogBufferTest(TestCase):
+
+    def make_event(self, n):
+        return EventLog(event_type=EventLog.LOGIN_SUCCESS, event_title=f"login {n}", created_at=timezone.now())
+
+    def test_flush_on_size_with_one_insert(self):
+        buffer = EventLogBuffer(max_size=3, flush_interval=None)
+        happened_at = timezone.now() - timedelta(seconds=30)
+        first = self.make_event(0)
+        first.created_at = happened_at
+
+        with self.assertNumQueries(0):
+            buffer.add(first)
+            buffer.add(self.make_event(1))
+        with self.assertNumQueries(1):
+            buffer.add(self.make_event(2))
+
+        self.assertEqual(EventLog.objects.count(), 3)
+        # the event keeps the time it happened at
+        self.assertEqual(EventLog.objects.get(event_title='login 0').created_at, happened_at)
+
+    def test_close_flushes_and_overflow_is_dropped(self):
+        buffer = EventLogBuffer(max_size=100, flush_interval=None, max_pending=2)
+        with mock.patch('core.event_log_buffer.get_metrics') as get_metrics, \
+                self.assertLogs('core.event_log_buffer', 'WARNING'):
+            for n in range(3):
+                buffer.add(self.make_event(n))
+        buffer.close()
+
+        self.assertEqual(EventLog.objects.count(), 2)
+        self.assertEqual((buffer.stats['buffered'], buffer.stats['written'], buffer.stats['dropped']), (2, 2, 1))
+        get_metrics().inc.assert_has_calls([mock.call('anonpoll_event_log_delayed_total')] * 2 +
+                                           [mock.call('anonpoll_event_log_dropped_total')])
+
+    def test_fallback_writes_one_by_one(self):
+        buffer = EventLogBuffer(max_size=100, flush_interval=None)
+        buffer.add(self.make_event(0))
+        buffer.add(self.make_event(1))
+        with mock.patch.object(EventLog.objects, 'bulk_create', side_effect=Exception('bulk insert failed')), \
+                self.assertLogs('core.event_log_buffer', 'ERROR') as logs:
+            self.assertEqual(buffer.flush(), 2)
+        self.assertIn('bulk insert failed', logs.output[0])
+
+        self.assertEqual(EventLog.objects.count(), 2)
+        self.assertEqual(buffer.stats['fallback_writes'], 2)
+
+    @override_settings(EVENT_LOG_MODE='buffered')
+    def test_create_event_log_is_buffered(self):
+        buffer = EventLogBuffer(max_size=100, flush_interval=None)
+        with mock.patch('core.logic.get_event_log_buffer', return_value=buffer), self.assertNumQueries(0):
+            create_event_log(EventLog.LOGIN_FAILED, "login failed", "data")
+        self.assertEqual(buffer.pending(), 1)
+
+    def test_create_event_log_errors_are_logged(self):
+        with mock.patch.object(EventLog, 'save', side_effect=DatabaseError('disk full')), \
+                self.assertLogs('core.logic', 'ERROR') as logs:
+            self.assertIsNone(create_event_log(EventLog.LOGIN_FAILED, "login failed", "data"))
+        self.assertIn('disk full', logs.output[0])
+
+
+class EventLogArchiveTest(TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        now = timezone.now()
+        self.old_day = (now - timedelta(days=200)).date()
+        EventLog.objects.bulk_create(
+            [EventLog(event_type=EventLog.EMAIL_SENT, event_data=f"<p>{n}</p>", created_at=now - timedelta(days=200 + n % 3))
+             for n in range(7)] +
+            [EventLog(event_type=EventLog.LOGIN_SUCCESS, created_at=now - timedelta(days=1))])
+        self.cutoff = now - timedelta(days=180)
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def test_archive_and_import(self):
+        self.assertEqual(archive_event_logs(self.cutoff, self.archive_dir, dry_run=True)['archived'], 7)
+
+        summary = archive_event_logs(self.cutoff, self.archive_dir, chunk_size=3)
+
+        self.assertEqual(summary['archived'], 7)
+        self.assertEqual(len(summary['files']), 3)
+        self.assertIn(get_archive_path(self.archive_dir, self.old_day), summary['files'])
+        self.assertEqual(EventLog.objects.count(), 1)
+
+        for archive_path in summary['files']:
+            import_event_log_archive(archive_path)
+        # importing twice does not duplicate the events
+        import_event_log_archive(summary['files'][0])
+
+        self.assertEqual(EventLog.objects.filter(event_type=EventLog.EMAIL_SENT).count(), 7)
+        self.assertEqual(EventLog.objects.filter(created_at__lt=self.cutoff, event_data='<p>0</p>').count(), 1)
+
+    def test_open_archives_are_bounded(self):
+        now = timezone.now()
+        # 12 days, out of created_at order, so that some archives are closed and opened again
+        EventLog.objects.bulk_create([EventLog(event_type=EventLog.EMAIL_SENT, event_data=f"<p>{n}</p>",
+                                               created_at=now - timedelta(days=300 + n * 5 % 12))
+                                      for n in range(36)])
+        opened = []
+        gzip_open = gzip.open
+
+        def open_archive(*args, **kwargs):
+            self.assertLess(sum(not archive.closed for archive in opened), 3)
+            archive = gzip_open(*args, **kwargs)
+            opened.append(archive)
+            return archive
+
+        with mock.patch('core.event_log_archive.gzip.open', side_effect=open_archive):
+            summary = archive_event_logs(self.cutoff, self.archive_dir, chunk_size=10, max_open_files=3)
+
+        self.assertEqual(summary['archived'], 43)
+        self.assertEqual(len(summary['files']), 15)
+        self.assertGreater(len(opened), 15)
+        self.assertTrue(all(archive.closed for archive in opened))
+        self.assertEqual(EventLog.objects.count(), 1)
+
+        for archive_path in summary['files']:
+            import_event_log_archive(archive_path)
+        self.assertEqual(EventLog.objects.filter(event_type=EventLog.EMAIL_SENT).count(), 43)
+
+    def test_archive_by_event_type(self):
+        summary = archive_event_logs(timezone.now(), self.archive_dir, event_types=[EventLog.LOGIN_SUCCESS])
+
+        self.assertEqual(summary['archived'], 1)
+        self.assertEqual(EventLog.objects.count(), 7)
+
+
+class SubscriberRegistryClientTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_answers_are_cached(self):
+        with StubSubscriberRegistry() as registry:
+            client = SubscriberRegistryClient(registry.url)
+            for _ in range(3):
+                exists, subscriber = client.check('123456', 'mario.rossi@example.com')
+                self.assertTrue(exists)
+                self.assertEqual(subscriber['matricola'], '123456')
+            for _ in range(3):
+                self.assertEqual(client.check('0123', 'nobody@example.com'), (False, {}))
+            client.close()
+
+        self.assertEqual(registry.requests_served, 2)
+
+    def test_circuit_opens_after_failures(self):
+        # nothing listens on this port
+        client = SubscriberRegistryClient('http://127.0.0.1:1/', timeout=(0.5, 0.5), failure_threshold=2,
+                                          reset_timeout=60)
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                client.check('123456', 'mario.rossi@example.com')
+
+        with self.assertRaises(SubscriberRegistryUnavailable):
+            client.check('123456', 'mario.rossi@example.com')
+
+    def test_async_check(self):
+        async def check(client):
+            try:
+                return [await client.acheck('123456', 'mario.rossi@example.com') for _ in range(3)] + \
+                    [await client.acheck('0123', 'nobody@example.com')]
+            finally:
+                await client.aclose()
+
+        with StubSubscriberRegistry() as registry:
+            results = asyncio.run(check(SubscriberRegistryClient(registry.url)))
+
+        self.assertEqual(registry.requests_served, 2)
+        self.assertTrue(results[0][0])
+        self.assertEqual(results[0][1]['matricola'], '123456')
+        self.assertEqual(results[3], (False, {}))
+
+        # nothing listens on this port
+        client = SubscriberRegistryClient('http://127.0.0.1:1/', timeout=(0.5, 0.5))
+        with self.assertRaises(requests.ConnectionError):
+            asyncio.run(client.acheck('654321', 'luigi.verdi@example.com'))
+
+
+class SubscriberIdentityTest(TestCase):
+    attributes = dict(email='mario.rossi@example.com', name='Mario', surname='Rossi', matricola='123456',
+                      uaf='UAF1', structure='Direzione')
+
+    def setUp(self):
+        subscriber_cache.clear()
+
+    def test_repeat_login_skips_the_database(self):
+        subscriber = create_subscriber_if_not_exits(**self.attributes)
+        with self.assertNumQueries(0):
+            self.assertEqual(create_subscriber_if_not_exits(**self.attributes).pk, subscriber.pk)
+
+    def test_changed_attributes_are_updated_in_place(self):
+        subscriber = create_subscriber_if_not_exits(**self.attributes)
+        moved = create_subscriber_if_not_exits(**dict(self.attributes, structure='Altra struttura'))
+
+        self.assertEqual(moved.pk, subscriber.pk)
+        self.assertEqual(Subscriber.objects.get().structure, 'Altra struttura')
+
+    def test_admin_change_invalidates_the_cache(self):
+        subscriber = create_subscriber_if_not_exits(**self.attributes)
+        subscriber.delete()
+
+        self.assertIsNotNone(create_subscriber_if_not_exits(**self.attributes).pk)
+        self.assertEqual(Subscriber.objects.count(), 1)
+
+
+@mock.patch('core.views.my_send_email')
+class PostAuthenticatedSurveyTest(TestCase):
+    # session write (it is read from the cache), survey, subscriber, response + bulk answers, event log,
+    # savepoints (form specs are cached)
+    QUERY_BUDGET = 10
+
+    def setUp(self):
+        self.subscriber = Subscriber.objects.create(email='mario.rossi@example.com', name='Mario', surname='Rossi',
+                                                    matricola='123456')
+
+    def login(self):
+        session = self.client.session
+        session['subscriber_id'] = self.subscriber.id
+        session.save()
+
+    def submit(self, survey):
+        url = reverse('core:post-authenticated-survey', args=(survey.slug,))
+        data = named_survey_post_data(survey)
+        self.client.get(url)  # the form is displayed (and its specs cached) before being posted
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return len(context.captured_queries)
+
+    def test_answers_are_saved(self, send_email):
+        survey = create_named_survey(questions=6)
+        self.login()
+        self.submit(survey)
+
+        response = NamedSurveyResponse.objects.get(survey=survey)
+        self.assertEqual(response.subscriber, self.subscriber)
+        self.assertEqual(NamedSurveyAnswer.objects.filter(response=response).count(), 6)
+        # the session keeps only the ids, the thank-you page rebuilds the summary from the response
+        self.assertEqual(set(self.client.session.keys()), {'subscriber_id', 'survey_response_id'})
+        page = self.client.get(reverse('core:authenticated-survey-success-url', args=(survey.slug,)))
+        for answer in response.answers.select_related('question'):
+            self.assertContains(page, f"{answer.question.text}: {answer.text}")
+        # the summary is queued in the outbox, not sent from the request
+        send_email.assert_not_called()
+        self.assertEqual(OutgoingEmail.objects.get().to_addresses, self.subscriber.email)
+
+    def test_query_budget_does_not_depend_on_survey_size(self, send_email):
+        self.login()
+        small = self.submit(create_named_survey(slug='small', questions=5))
+        self.login()
+        large = self.submit(create_named_survey(slug='large', questions=40))
+
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.QUERY_BUDGET)
+
+    def test_session_is_read_from_the_cache(self, send_email):
+        survey = create_named_survey()
+        self.login()
+        url = reverse('core:post-authenticated-survey', args=(survey.slug,))
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+            self.client.get(reverse('core:authenticated-survey-success-url', args=(survey.slug,)))
+
+        self.assertFalse([query for query in context.captured_queries if 'django_session' in query['sql']])
+
+
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        view_stats.clear()
+        question = create_question()
+        Choice.objects.create(question=question, choice_text='A')
+        self.url = reverse('core:show-poll-question', args=(question.slug,))
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0)
+    def test_server_timing_and_view_stats(self):
+        response = self.client.get(self.url)
+
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=')
+        (stats,) = view_stats.summary()
+        self.assertEqual((stats['view'], stats['samples']), ('core:show-poll-question', 1))
+        self.assertEqual(sum(stats['histogram']), 1)
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_unsampled_request(self):
+        self.assertFalse(self.client.get(self.url).has_header('Server-Timing'))
+        self.assertEqual(view_stats.summary(), [])
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0)
+    def test_staff_page(self):
+        url = reverse('core:instrumentation')
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        with mock.patch('core.views.get_event_log_stats', return_value={'pending': 3, 'buffered': 250, 'written': 247,
+                                                                        'dropped': 0, 'flushes': 5,
+                                                                        'fallback_writes': 0}):
+            response = self.client.get(url)
+        self.assertContains(response, 'core:show-poll-question')
+        self.assertContains(response, '<td>250</td><td>247</td>', html=False)
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def worker(self, process_id):
+        return MetricsRegistry(self.directory, flush_interval=None, process_id=process_id)
+
+    def test_workers_are_merged(self):
+        worker_a, worker_b = self.worker('worker-a'), self.worker('worker-b')
+        worker_a.inc('anonpoll_votes_total', question='poll')
+        worker_b.inc('anonpoll_votes_total', 2, question='poll')
+        worker_a.observe('anonpoll_registry_request_seconds', 0.02)
+        worker_b.observe('anonpoll_registry_request_seconds', 3)
+        worker_b.flush()
+
+        text = worker_a.render()
+
+        self.assertIn('anonpoll_votes_total{question="poll"} 3', text)
+        self.assertIn('anonpoll_registry_request_seconds_bucket{le="0.025"} 1', text)
+        self.assertIn('anonpoll_registry_request_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('anonpoll_registry_request_seconds_count 2', text)
+
+    def test_dead_workers_are_archived(self):
+        # no process has this pid
+        dead = self.worker('4194999-1')
+        dead.inc('anonpoll_logins_total', result='success')
+        dead.flush()
+        scraper = self.worker('scraper')
+
+        for _ in range(2):
+            self.assertIn('anonpoll_logins_total{result="success"} 1', scraper.render())
+        self.assertFalse(os.path.exists(dead.path))
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_vote_is_counted_and_scraped(self):
+        question = create_question()
+        choice = Choice.objects.create(question=question, choice_text='A')
+        registry = self.worker('worker')
+
+        with mock.patch('core.views.get_metrics', return_value=registry):
+            self.client.post(reverse('core:show-poll-question', args=(question.slug,)),
+                             {'choice': choice.id, 'accept_privacy_policy': 'yes'})
+            response = self.client.get(reverse('core:metrics'))
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertContains(response, 'anonpoll_votes_total{question="test-poll"} 1')
+
+
+class LiveResultsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question()
+        self.choice = Choice.objects.create(question=self.question, choice_text='A')
+        Choice.objects.create(question=self.question, choice_text='B')
+        self.url = reverse('core:results-json', args=(self.question.slug,))
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def aggregate_queries(self, context):
+        return [q['sql'] for q in context.captured_queries if '"core_choice' in q['sql']]
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['results'], [{'choice': 'A', 'votes': 0}, {'choice': 'B', 'votes': 0}])
+        self.assertIn('max-age=10', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as context:
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(self.aggregate_queries(context), [])
+
+    @override_settings(LIVE_RESULTS_REFRESH_INTERVAL=0)
+    def test_new_votes_change_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        register_vote(self.question, self.choice)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['total_votes'], 1)
+
+    def test_html_page_and_permissions(self):
+        response = self.client.get(reverse('core:results', args=(self.question.slug,)))
+        self.assertContains(response, 'Voti totali: 0')
+        self.assertNotEqual(response['ETag'], self.client.get(self.url)['ETag'])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+@override_settings(LIVE_RESULTS_PUBLIC=True)
+class LiveStreamTest(TransactionTestCase):
+    SUBSCRIBERS = 300
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question()
+        self.choice = Choice.objects.create(question=self.question, choice_text='A')
+        Choice.objects.create(question=self.question, choice_text='B')
+
+    def test_idle_subscribers_share_one_poll(self):
+        broadcaster = TallyBroadcaster(interval=0.05)
+
+        async def soak():
+            streams = [stream_tallies(self.question, broadcaster, heartbeat=30, max_age=60)
+                       for _ in range(self.SUBSCRIBERS)]
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            snapshots = await asyncio.gather(*(stream.__anext__() for stream in streams))
+            memory = tracemalloc.get_traced_memory()[0] - baseline
+            tracemalloc.stop()
+
+            deltas = [asyncio.ensure_future(stream.__anext__()) for stream in streams]
+            await sync_to_async(register_vote)(self.question, self.choice)
+            deltas = await asyncio.wait_for(asyncio.gather(*deltas), timeout=10)
+
+            subscribers = broadcaster.subscribers()
+            for stream in streams:
+                await stream.aclose()
+            return snapshots, deltas, memory, subscribers
+
+        snapshots, deltas, memory, subscribers = asyncio.run(soak())
+
+        self.assertEqual(subscribers, self.SUBSCRIBERS)
+        self.assertTrue(all(b'event: snapshot' in snapshot for snapshot in snapshots))
+        self.assertTrue(all(b'"changes": {"A": 1}, "total_votes": 1' in delta for delta in deltas))
+        self.assertEqual(broadcaster.subscribers(), 0)
+        # the tallies are read by one task, not once per subscriber
+        self.assertLess(broadcaster.polls, 50)
+        self.assertLess(memory / self.SUBSCRIBERS, 16 * 1024)
+
+    def test_read_errors_are_logged(self):
+        broadcaster = TallyBroadcaster(interval=0.01)
+
+        async def stream():
+            subscription, tallies = await broadcaster.subscribe(self.question)
+            with mock.patch('core.live_stream.compute_live_results', side_effect=DatabaseError('gone away')):
+                await asyncio.sleep(0.05)
+            await sync_to_async(register_vote)(self.question, self.choice)
+            changes = await subscription.wait(5)
+            broadcaster.unsubscribe(self.question, subscription)
+            return changes
+
+        with self.assertLogs('core.live_stream', 'ERROR'):
+            changes = asyncio.run(stream())
+
+        # the subscription survives the failed reads
+        self.assertEqual(changes, ({'A': 1}, 1))
+
+    def test_reset_clears_the_choices_gone(self):
+        user_defined = Choice.objects.create(question=self.question, choice_text='ZZZ_USER_DEFINED')
+        register_vote(self.question, self.choice)
+        register_vote(self.question, user_defined, 'C')
+        broadcaster = TallyBroadcaster(interval=0.01)
+
+        async def stream():
+            subscription, tallies = await broadcaster.subscribe(self.question)
+            # the suggested choice C is deleted by the reset
+            await sync_to_async(question_reset_votes)(self.question)
+            changes = await subscription.wait(5)
+            broadcaster.unsubscribe(self.question, subscription)
+            return tallies, changes
+
+        tallies, changes = asyncio.run(stream())
+
+        self.assertEqual(tallies, {'A': 1, 'B': 0, 'C': 1})
+        self.assertEqual(changes, ({'A': 0, 'C': 0}, 0))
+
+    def test_endpoint(self):
+        url = reverse('core:results-stream', args=(self.question.slug,))
+
+        async def first_event():
+            response = await AsyncClient().get(url)
+            iterator = response.streaming_content.__aiter__()
+            try:
+                return response, await iterator.__anext__()
+            finally:
+                await iterator.aclose()
+
+        response, event = asyncio.run(first_event())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn(b'"results": {"A": 0, "B": 0}', event)
+        # the WSGI handler would buffer the whole stream
+        self.assertEqual(self.client.get(url).status_code, 501)
+
+
+class VisibleContent(HTMLParser):
+    """
+    What a user gets of a page: its words and its form controls with their attributes, without the layout
+    of the markup, comments, scripts and the value of the csrf token.
+    """
+    CONTROLS = ('a', 'button', 'input', 'option', 'select', 'textarea')
+
+    def __init__(self):
+        super().__init__()
+        self.content = []
+        self._hidden = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._hidden += 1
+        elif tag in self.CONTROLS:
+            attrs = dict(attrs)
+            if attrs.get('name') == 'csrfmiddlewaretoken':
+                attrs['value'] = '<csrf token>'
+            self.content.append((tag, sorted(attrs.items())))
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._hidden -= 1
+
+    def handle_data(self, data):
+        if not self._hidden:
+            self.content.extend(data.split())
+
+
+def visible_content(html):
+    parser = VisibleContent()
+    parser.feed(html)
+    return parser.content
+
+
+# with debug on, django-jinja sends the template_rendered signal used by assertTemplateUsed
+JINJA2_TEMPLATES = [dict(settings.JINJA2_TEMPLATE_BACKEND, OPTIONS=dict(settings.JINJA2_TEMPLATE_BACKEND['OPTIONS'],
+                                                                        debug=True))] + [
+    backend for backend in settings.TEMPLATES if backend['BACKEND'] != settings.JINJA2_TEMPLATE_BACKEND['BACKEND']]
+
+
+@override_settings(JINJA2_TEMPLATES=True, TEMPLATES=JINJA2_TEMPLATES, CACHES=dict(settings.CACHES, **{
+    'jinja2-bytecode': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'jinja2-tests'}}))
+class Jinja2TemplatesTest(TestCase):
+
+    def test_vote_page(self):
+        question = create_question()
+        choice = Choice.objects.create(question=question, choice_text='A')
+        url = reverse('core:show-poll-question', args=(question.slug,))
+
+        response = self.client.get(url)
+
+        self.assertTemplateUsed(response, 'core/vote.jinja')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertContains(response, f'name="choice" value="{choice.id}"')
+        response = self.client.post(url, {'choice': choice.id, 'accept_privacy_policy': 'yes'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_hot_pages_match_the_django_templates(self):
+        poll = create_question(privacy_policy='<p>Informativa</p>', enable_textfield_choice=True)
+        for text in ('A', 'B', 'ZZZ_USER_DEFINED'):
+            Choice.objects.create(question=poll, choice_text=text)
+        question = get_poll_snapshot(poll.slug)
+        survey = create_bench_survey(questions=8)
+        contact = {'TECHNICAL_CONTACT_EMAIL': 'tech@example.com', 'TECHNICAL_CONTACT': 'Tech'}
+        pages = {
+            # one form instance per page: the choices of the vote form are shuffled
+            'core/vote.html': dict(contact, question=question, form=VoteForm(question=question)),
+            'core/thanks_poll_participation.html': dict(contact, question=question, end_date='31 dicembre 2026'),
+            'named_polls/poll_form.html': {'survey': survey, 'form': make_named_survey_form(survey)()},
+            'named_polls/thanks_poll_participation.html': dict(contact, message_body='Ciao Mario,<br><br>riepilogo'),
+        }
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        request._messages = default_storage(request)
+        messages.error(request, 'errore: matricola o email non validi')
+
+        for name, context in pages.items():
+            jinja2_html = get_jinja2_engine().get_template(hot_template(name)).render(context, request)
+            with override_settings(JINJA2_TEMPLATES=False):
+                django_html = engines['django'].get_template(name).render(context, request)
+
+            self.assertEqual(visible_content(jinja2_html), visible_content(django_html), name)
+
+    def test_precompile(self):
+        self.assertEqual(precompile_jinja2_templates(), 6)
+        # a new process finds the templates in the bytecode cache
+        with mock.patch('jinja2.environment.Environment._compile') as compile_template:
+            precompile_jinja2_templates(build_jinja2_engine())
+        compile_template.assert_not_called()
+
+
+class AsyncViewsURLConf:
+    # the URLs of the ASGI deployment
+    urlpatterns = [path('s/', include((get_urlpatterns(async_views=True), 'core')))]
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_middlewares_are_async_capable(self):
+        # a sync only middleware would run the async views in a thread
+        for middleware in settings.MIDDLEWARE:
+            self.assertTrue(import_string(middleware).async_capable, middleware)
+
+    async def test_vote(self):
+        question = await sync_to_async(create_question)()
+        choice = await Choice.objects.acreate(question=question, choice_text='A')
+        url = reverse('core:show-poll-question', args=(question.slug,))
+
+        response = await self.async_client.post(url, {'choice': choice.id, 'accept_privacy_policy': 'yes'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(await sync_to_async(get_question_tallies)(question), {choice.id: 1})
+        self.assertEqual((await self.async_client.get(url)).status_code, 200)
+
+    async def test_login_and_survey_submit(self):
+        survey = await sync_to_async(create_bench_survey)(questions=4)
+        login_url = reverse('core:subscriber-login', args=(survey.slug,))
+
+        with StubSubscriberRegistry() as registry, \
+                mock.patch('core.views.get_subscriber_registry_client',
+                           return_value=SubscriberRegistryClient(registry.url)):
+            response = await self.async_client.post(login_url, {'matricola': '0123', 'email': 'nobody@example.com'})
+            self.assertContains(response, 'matricola o email non validi')
+
+            response = await self.async_client.post(login_url, {'matricola': '123456',
+                                                                'email': 'mario.rossi@example.com'})
+        self.assertRedirects(response, reverse('core:post-authenticated-survey', args=(survey.slug,)),
+                             fetch_redirect_response=False)
+
+        data = {f'question_{question.id}': SURVEY_ANSWERS[question.question_type]
+                async for question in survey.questions.all()}
+        response = await self.async_client.post(reverse('core:post-authenticated-survey', args=(survey.slug,)), data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(await NamedSurveyAnswer.objects.filter(response__survey=survey).acount(), 4)
+        self.assertTrue(await OutgoingEmail.objects.filter(to_addresses='mario.rossi@example.com').aexists())
+
+
+class BenchmarksTest(TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile(values, 99)), (50, 95, 99))
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_vote_scenarios(self):
+        scenarios = make_scenarios(create_bench_poll(choices=3), create_bench_survey(questions=4))
+
+        for name in ('vote_get', 'vote_post', 'free_text_vote'):
+            description, setup, request, expected_status = scenarios[name]
+            result = run_scenario(setup, request, expected_status, requests=10, warmup=2)
+            self.assertEqual(result['errors'], 0, name)
+
+        self.assertEqual(ChoiceVote.objects.count(), 12)
+        self.assertEqual(ChoiceSuggestedByUser.objects.get(normalized_text='proposta 5').votes, 1)
+
+
+class PollResultsTest(TestCase):
+
+    def setUp(self):
+        self.questions = []
+        for i in range(3):
+            question = create_question(slug=f'poll-{i}')
+            for text in ('A', 'B', 'ZZZ_USER_DEFINED'):
+                Choice.objects.create(question=question, choice_text=text)
+            self.questions.append(question)
+
+        for question in self.questions:
+            a, b, user_defined = question.choice_set.order_by('choice_text')
+            for choice, text in ((a, None), (a, None), (b, None), (user_defined, 'C')):
+                register_vote(question, choice, text)
+
+    def test_queries_do_not_depend_on_number_of_questions(self):
+        with self.assertNumQueries(3):
+            results = compute_poll_results(self.questions)
+        with self.assertNumQueries(5):
+            compute_poll_results(self.questions, verify=True)
+
+        self.assertEqual(results[0]['results'], [('A', 2), ('B', 1), ('C', 1)])
+        self.assertEqual(results[0]['total_votes'], 4)
+
+    def test_verify_reports_counters_without_vote_rows(self):
+        ChoiceVote.objects.filter(question=self.questions[1]).delete()
+
+        results = compute_poll_results(self.questions, verify=True)
+        self.assertEqual(results[0]['mismatches'], [])
+        self.assertEqual(sorted(results[1]['mismatches']), [('A', 2, 0), ('B', 1, 0)])
+
+    def test_command_json_output(self):
+        output = io.StringIO()
+        call_command('get_poll_results', '--all-active', '--format', 'json', '--no-email', stdout=output)
+
+        self.assertEqual([result['question_id'] for result in json.loads(output.getvalue())],
+                         [question.id for question in self.questions])
+
+
+class ResetVotesTest(TestCase):
+
+    def setUp(self):
+        self.question = create_question()
+        self.other = create_question(slug='other-poll')
+        for question in (self.question, self.other):
+            choice = Choice.objects.create(question=question, choice_text='A', votes=5)
+            user_defined = Choice.objects.create(question=question, choice_text='ZZZ_USER_DEFINED')
+            for i in range(25):
+                register_vote(question, choice)
+            register_vote(question, user_defined, 'free text')
+
+    def test_dry_run_changes_nothing(self):
+        summary = question_reset_votes(self.question, dry_run=True)
+
+        self.assertEqual(summary['ChoiceVote'], 25)
+        self.assertEqual(summary['ChoiceSuggestedByUser'], 1)
+        self.assertEqual(ChoiceVote.objects.filter(question=self.question).count(), 25)
+
+    def test_chunked_reset(self):
+        progress = []
+        summary = question_reset_votes(self.question, chunk_size=4, progress=lambda *args: progress.append(args))
+
+        self.assertEqual(summary['ChoiceVote'], 25)
+        self.assertFalse(ChoiceVote.objects.filter(question=self.question).exists())
+        self.assertFalse(ChoiceSuggestedByUser.objects.filter(question=self.question).exists())
+        self.assertEqual(sum(get_question_tallies(self.question).values()), 0)
+        self.assertIn(('ChoiceVote', 25), progress)
+
+        # the other question is untouched
+        self.assertEqual(ChoiceVote.objects.filter(question=self.other).count(), 25)
+        self.assertEqual(sum(get_question_tallies(self.other).values()), 30)
+
+
+class NamedSurveyAnswersExportTest(TestCase):
+
+    def test_export_streams_one_row_per_answer(self):
+        survey = create_named_survey(questions=4)
+        subscriber = Subscriber.objects.create(email='mario.rossi@example.com', name='Mario', surname='Rossi',
+                                               matricola='123456')
+        for owner in (subscriber, None):
+            response = NamedSurveyResponse.objects.create(survey=survey, subscriber=owner)
+            NamedSurveyAnswer.objects.bulk_create([NamedSurveyAnswer(response=response, question=question, text='yes')
+                                                   for question in survey.questions.all()])
+
+        with self.assertNumQueries(1):
+            http_response = named_survey_answers_response(NamedSurveyAnswer.objects.all())
+        content = b''.join(http_response.streaming_content)
+        http_response.close()
+
+        rows = list(load_workbook(io.BytesIO(content)).active.values)
+        self.assertEqual(len(rows), 1 + 8)
+        self.assertEqual(rows[1][:4], ('Test survey', 'Question 0', 'yes', 'mario.rossi@example.com'))
+        self.assertEqual(rows[-1][3], 'No Subscriber')
+
+
+class AccessPolicyTest(TestCase):
+
+    def test_matcher(self):
+        matcher = CIDRMatcher(['10.0.0.0/8', '192.168.0.0/16', 'fc00::/7'], deny=['10.66.0.0/16'])
+
+        self.assertTrue(matcher.is_allowed('10.1.2.3'))
+        self.assertTrue(matcher.is_allowed('192.168.1.1'))
+        self.assertTrue(matcher.is_allowed('fd00::1'))
+        self.assertFalse(matcher.is_allowed('10.66.1.1'))
+        self.assertFalse(matcher.is_allowed('93.1.2.3'))
+        self.assertFalse(matcher.is_allowed('2001:db8::1'))
+        self.assertFalse(matcher.is_allowed('not an ip'))
+
+    def test_public_address_is_rejected_without_queries(self):
+        create_question()
+        url = reverse('core:show-poll-question', args=('test-poll',))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_X_REAL_IP='93.1.2.3')
+        self.assertEqual(response.status_code, 403)
+
+        self.assertEqual(self.client.get(url, HTTP_X_REAL_IP='10.1.2.3').status_code, 200)
+
+
+@override_settings(RATE_LIMIT_ENABLED=True)
+class RateLimitTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(RATE_LIMITS={'core:subscriber-login': {'methods': ['POST'], 'per_ip': (3, 60),
+                                                              'global': (4, 60)}})
+    def test_buckets(self):
+        middleware = RateLimitMiddleware(lambda request: None)
+        url = reverse('core:subscriber-login', args=('test-survey',))
+
+        def post(ip):
+            request = RequestFactory().post(url, HTTP_X_REAL_IP=ip)
+            request.resolver_match = resolve(url)
+            return middleware.process_view(request, None, (), {})
+
+        with self.assertNumQueries(0):
+            self.assertEqual([post('10.0.0.1') for _ in range(3)], [None] * 3)
+            response = post('10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # another client has its own bucket, until the global one is empty
+        self.assertIsNone(post('10.0.0.2'))
+        self.assertEqual(post('10.0.0.3').status_code, 429)
+
+        # GET is not limited
+        request = RequestFactory().get(url, HTTP_X_REAL_IP='10.0.0.1')
+        request.resolver_match = resolve(url)
+        self.assertIsNone(middleware.process_view(request, None, (), {}))
+
+    @override_settings(RATE_LIMIT_ENABLED=True)
+    def test_check_warns_about_a_process_local_cache(self):
+        self.assertEqual([message.id for message in check_rate_limit_cache(None)], ['anonpoll.W001'])
+
+        with override_settings(RATE_LIMIT_CACHE='missing'):
+            self.assertEqual([message.id for message in check_rate_limit_cache(None)], ['anonpoll.E001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                                   'LOCATION': 'rate_limit'}}):
+            self.assertEqual(check_rate_limit_cache(None), [])
+
+    def test_refused_requests_are_not_counted(self):
+        limiter = RateLimiter()
+        window_start = 1000 * 60
+
+        with mock.patch('anonpoll.rate_limit.time.time', return_value=window_start):
+            self.assertEqual([limiter.consume([('a', 2, 60), ('all', 3, 60)])[0] for _ in range(2)], [True] * 2)
+            # a client retrying while refused
+            self.assertEqual(limiter.consume([('a', 2, 60), ('all', 3, 60)]), (False, 60))
+            self.assertFalse(any(limiter.consume([('a', 2, 60), ('all', 3, 60)])[0] for _ in range(5)))
+
+            self.assertTrue(limiter.consume([('b', 2, 60), ('all', 3, 60)])[0])
+            # refused by the global limit: not counted against the client either
+            self.assertFalse(limiter.consume([('c', 2, 60), ('all', 3, 60)])[0])
+            self.assertIsNone(cache.get('rate-limit:c:1000'))
+
+        # half of the previous window has slid out: 2 * 0.5 + 1 <= 2, the retries did not count
+        with mock.patch('anonpoll.rate_limit.time.time', return_value=window_start + 90):
+            self.assertTrue(limiter.consume([('a', 2, 60)])[0])
+
+
+class ConcurrentVoteCountersTest(TransactionTestCase):
+    VOTES = 2000
+    WORKERS = 16
+
+    def setUp(self):
+        skip_without_file_database(self)
+
+    def test_no_lost_votes(self):
+        question = create_question()
+        choices = [Choice.objects.create(question=question, choice_text=text) for text in ('A', 'B', 'C')]
+
+        def vote(i):
+            try:
+                increment_choice_votes(choices[i % len(choices)])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            list(executor.map(vote, range(self.VOTES)))
+
+        tallies = get_question_tallies(question)
+        self.assertEqual(sum(tallies.values()), self.VOTES)
+        for i, choice in enumerate(choices):
+            expected = len(range(i, self.VOTES, len(choices)))
+            self.assertEqual(tallies[choice.id], expected)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class ConcurrentBenchmarksTest(TransactionTestCase):
+
+    def setUp(self):
+        skip_without_file_database(self)
+
+    def test_threaded_and_async_runners(self):
+        poll = create_bench_poll(choices=3)
+        scenarios = make_scenarios(poll, create_bench_survey(questions=4))
+
+        for name in ('vote_get', 'vote_post'):
+            description, setup, request, expected_status = scenarios[name]
+            threaded = run_scenario_threaded(setup, request, expected_status, requests=20, concurrency=4, workers=2)
+            asynchronous = run_scenario_async(setup, request, expected_status, requests=20, concurrency=4)
+            for result in (threaded, asynchronous):
+                self.assertEqual(result['requests'], 20)
+                self.assertEqual(result['errors'], 0)
+
+        self.assertEqual(sum(get_question_tallies(poll).values()), 40)
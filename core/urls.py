@@ -1,27 +1,54 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
-app_name = 'core'
-urlpatterns = [
-    path('', views.index, name='index'),
-    # path('<int:question_id>/', views.detail, name='detail'),
-    # path('<int:question_id>/results/', views.results, name='results'),
-    # path('<int:question_id>/vote/', views.vote, name='vote'),
 
-    path('<str:question_slug>/show-poll-question/', views.show_poll_question, name='show-poll-question'),
+def get_urlpatterns(async_views=False):
+    # under ASGI (ASYNC_VIEWS) the vote, login and survey submit flows are served by their async versions
+    if async_views:
+        show_poll_question = views.show_poll_question_async
+        subscriber_login = views.subscriber_login_async
+        post_authenticated_survey = views.post_authenticated_survey_async
+    else:
+        show_poll_question = views.show_poll_question
+        subscriber_login = views.subscriber_login
+        post_authenticated_survey = views.post_authenticated_survey
+
+    return [
+        path('', views.index, name='index'),
+
+        # per-view timings of the sampled requests (staff only)
+        path('staff/instrumentation/', views.instrumentation_stats, name='instrumentation'),
+
+        # scrape endpoint of the metrics (see anonpoll/metrics.py)
+        path('staff/metrics/', views.metrics, name='metrics'),
+        # path('<int:question_id>/', views.detail, name='detail'),
+        # path('<int:question_id>/vote/', views.vote, name='vote'),
+
+        path('<str:question_slug>/show-poll-question/', show_poll_question, name='show-poll-question'),
 
-    path('<str:question_slug>/success_url/', views.success_url, name='success_url'),
+        path('<str:question_slug>/success_url/', views.success_url, name='success_url'),
 
-    path('<str:question_slug>/show-survey-question/', views.show_survey_question, name='show-survey-question'),
+        # live tallies, cached and served with ETag / Cache-Control (see core/live_results.py)
+        path('<str:question_slug>/results/', views.results, name='results'),
+        path('<str:question_slug>/results/json/', views.results_json, name='results-json'),
+        # the same tallies pushed as server-sent events, ASGI only (see core/live_stream.py)
+        path('<str:question_slug>/results/stream/', views.results_stream, name='results-stream'),
 
-    # survey which requires authentication to post
+        path('<str:question_slug>/show-survey-question/', views.show_survey_question, name='show-survey-question'),
 
-    path('<str:question_slug>/login/', views.subscriber_login, name='subscriber-login'),
+        # survey which requires authentication to post
 
-    path('<str:question_slug>/post-authenticated-survey/', views.post_authenticated_survey, name='post-authenticated-survey'),
+        path('<str:question_slug>/login/', subscriber_login, name='subscriber-login'),
 
-    path('<str:question_slug>/authenticated-survey-success-url/', views.authenticated_survey_successl_url, name='authenticated-survey-success-url'),
+        path('<str:question_slug>/post-authenticated-survey/', post_authenticated_survey, name='post-authenticated-survey'),
 
-    path('<str:question_slug>/logout/', views.subscriber_logout, name='subscriber-logout'),
+        path('<str:question_slug>/authenticated-survey-success-url/', views.authenticated_survey_successl_url, name='authenticated-survey-success-url'),
 
-]
+        path('<str:question_slug>/logout/', views.subscriber_logout, name='subscriber-logout'),
+
+    ]
+
+
+app_name = 'core'
+urlpatterns = get_urlpatterns(async_views=getattr(settings, 'ASYNC_VIEWS', False))
@@ -1,24 +1,38 @@
 import locale
-import syslog
 from datetime import date
 
 import pytz
 import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseRedirect
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from anonpoll.email_utils import my_send_email
-from anonpoll.settings import DEBUG, TECHNICAL_CONTACT_EMAIL, TECHNICAL_CONTACT, CHECK_SUBSCRIBER_WS_URL, SUBJECT_EMAIL, \
-    FROM_EMAIL, DEBUG_EMAIL, EMAIL_HOST
-from anonpoll.view_tools import is_private_ip
+from anonpoll.instrumentation import view_stats, HISTOGRAM_BUCKETS_MS, DEFAULT_SAMPLE_RATE
+from anonpoll.metrics import get_metrics
+from anonpoll.templating import hot_template
+from anonpoll.settings import DEBUG, TECHNICAL_CONTACT_EMAIL, TECHNICAL_CONTACT, SUBJECT_EMAIL, \
+    FROM_EMAIL, DEBUG_EMAIL, EMAIL_HOST, VOTE_INGESTION_MODE, EMAIL_OUTBOX_ENABLED
+from .email_outbox import queue_email, send_email_in_background
+from .event_log_buffer import get_event_log_stats
 from .forms import VoteForm, SubscriberLoginForm, make_named_survey_form
-from .logic import create_event_log, create_subscriber_if_not_exits
-from .models import Choice, Question, ChoiceVote, ChoiceSuggestedByUser, ChoiceVoteSuggestedByUser, EventLog, \
-    NamedSurvey, NamedSurveyResponse, NamedSurveyQuestion, NamedSurveyAnswer, Subscriber
+from .live_results import get_live_results, get_refresh_interval
+from .live_stream import stream_tallies
+from .logic import create_event_log, create_subscriber_if_not_exits, register_vote
+from .poll_snapshots import get_poll_snapshot, invalidate_poll_snapshot
+from .subscriber_registry import get_subscriber_registry_client
+from .vote_counters import increment_choice_votes
+from .vote_journal import journal_vote
+from .models import Choice, Question, EventLog, NamedSurvey, NamedSurveyResponse, NamedSurveyAnswer, Subscriber
 
 
 def index(request):
@@ -31,9 +45,65 @@ def detail(request, question_id):
     return HttpResponse(f"You're looking at question {question_id}.")
 
 
-def results(request, question_id):
-    response = "You're looking at the results of question %s."
-    return HttpResponse(response % question_id)
+def _live_results_response(request, question_slug, etag, make_response):
+    # common part of the live results views: permission, conditional GET, caching headers
+    question = get_poll_snapshot(question_slug)
+
+    public = getattr(settings, 'LIVE_RESULTS_PUBLIC', False)
+    if not public and not request.user.is_staff:
+        return HttpResponse("403 Forbidden", status=403)
+
+    live_results = get_live_results(question)
+    etag = f'"{live_results["etag"]}{etag}"'
+
+    # 304 Not Modified if the client already has these tallies
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = make_response(question, live_results)
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=public, private=not public, max_age=get_refresh_interval(),
+                        must_revalidate=True)
+    if not public:
+        patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+async def results_stream(request, question_slug):
+    # live tallies pushed as server-sent events; the stream is held open, so it is served under ASGI only
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("501 Not Implemented - disponibile solo con ASGI", status=501)
+
+    question = await sync_to_async(get_poll_snapshot)(question_slug)
+
+    if not getattr(settings, 'LIVE_RESULTS_PUBLIC', False) \
+            and not await sync_to_async(lambda: request.user.is_staff)():
+        return HttpResponse("403 Forbidden", status=403)
+
+    response = StreamingHttpResponse(stream_tallies(question), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # no buffering by the reverse proxy (nginx)
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def results(request, question_slug):
+    def make_response(question, live_results):
+        context = {
+            'question': question,
+            'results': live_results['payload']['results'],
+            'total_votes': live_results['payload']['total_votes'],
+        }
+        return render(request, 'core/results.html', context)
+
+    return _live_results_response(request, question_slug, '-html', make_response)
+
+
+def results_json(request, question_slug):
+    def make_response(question, live_results):
+        return HttpResponse(live_results['body'], content_type='application/json')
+
+    return _live_results_response(request, question_slug, '', make_response)
 
 
 def vote(request, question_id):
@@ -55,14 +125,13 @@ def vote(request, question_id):
             'error_message': "You didn't select a choice.",
         })
     else:
-        # Increment the vote count for the selected choice and save.
-        selected_choice.votes += 1
-        selected_choice.save()
+        # Increment the vote count for the selected choice (atomic, sharded counter).
+        increment_choice_votes(selected_choice)
 
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
-        response = HttpResponseRedirect(reverse('core:results', args=(question.id,)))
+        response = HttpResponseRedirect(reverse('core:results', args=(question.slug,)))
 
         # Set the cookie to block re-voting, with expiration at the question's end time.
         response.set_cookie(f'has_voted_{question_id}', 'true', expires=question.end_time)
@@ -70,113 +139,113 @@ def vote(request, question_id):
         return response
 
 
-def show_poll_question(request, question_slug):
-    http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
+def _record_vote(question, choice, text_choice):
+    # raises Choice.DoesNotExist when the choice has been deleted since the snapshot was cached: the snapshots
+    # of other processes are not invalidated unless the cache is shared
+    try:
+        with transaction.atomic():
+            if VOTE_INGESTION_MODE == 'journal':
+                # write-behind: the vote is applied later by the flush_vote_journal command
+                journal_vote(question, choice, text_choice)
+            else:
+                register_vote(question, choice, text_choice)
+    except IntegrityError:
+        if Choice.objects.filter(pk=choice.pk, question_id=question.pk).exists():
+            raise
+        raise Choice.DoesNotExist(f"Choice {choice.pk} of question {question.slug} has been deleted.")
 
-    if not request.user.is_authenticated or not request.user.is_superuser:
-        # Check if the IP is private
-        if http_real_ip != '' and not is_private_ip(http_real_ip) and not DEBUG:
-            syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
-            return render(request, 'core/show_generic_message.html',
-                          {'message': "403 Forbidden - accesso consentito solo da intranet"}, status=403)
+    metrics = get_metrics()
+    metrics.inc('anonpoll_votes_total', question=question.slug)
+    if choice.is_choice_text_user_defined():
+        metrics.inc('anonpoll_free_text_suggestions_total', question=question.slug)
 
-    # get question by slug
-    question = get_object_or_404(Question, slug=question_slug)
 
+def _vote_refused_response(request, question):
+    # the answer when the question does not take the vote of this client, None when it does
     if not question.is_active():
         return HttpResponse(_("This poll is not active."))
 
-    cookie_name = f'has_voted_{question.ref_token}'
-
-    if request.COOKIES.get(cookie_name):
+    if request.COOKIES.get(_vote_cookie_name(question)):
         return HttpResponse(_("You have already voted in this poll."))
 
-    if request.method == 'POST':
-        form = VoteForm(request.POST, question=question)
-        if form.is_valid():
-            choice = form.cleaned_data['choice']
-            accept_privacy_policy = form.cleaned_data['accept_privacy_policy']
-            text_choice = form.cleaned_data.get('text_choice', None)
-
-            print(f"form.cleaned_data: {form.cleaned_data}")
-
-            if accept_privacy_policy == 'yes':
-
-                if choice.is_choice_text_user_defined():
-                    # If the user's choice is a user-defined choice, lookup for an instance with the same choice_text
-                    # and question, if it exists, increment the votes, otherwise create a new instance
-                    user_choice = ChoiceSuggestedByUser.objects.filter(
-                        question=question,
-                        choice_text=text_choice,
-                    ).first()
-
-                    if user_choice is None:
-                        user_choice = ChoiceSuggestedByUser(
-                            question=question,
-                            choice_text=text_choice,
-                            votes=1,
-                        )
-                    else:
-                        user_choice.votes += 1
-
-                    user_choice.save()
-
-                    new_vote = ChoiceVoteSuggestedByUser(
-                        question=question,
-                        choice=user_choice,
-                    )
-                    new_vote.save()
-
-                else:
-                    choice.votes += 1
-                    choice.save()
-
-                    # Create a new ChoiceVote instance
-                    new_vote = ChoiceVote(
-                        question=question,
-                        choice=choice,
-                    )
-
-                    new_vote.save()
-
-                # Always return an HttpResponseRedirect after successfully dealing
-                # with POST data. This prevents data from being posted twice if a
-                # user hits the Back button.
-                response = HttpResponseRedirect(reverse('core:success_url', args=(question_slug,)))
-
-                if not DEBUG:
-                    # Set the cookie to block re-voting, with expiration at the question's end time.
-                    response.set_cookie(cookie_name, 'true', expires=question.end_time)
+    return None
 
-                return response
-            else:
-                # Handle the case where privacy policy is not accepted
-                form.add_error('accept_privacy_policy',
-                               _('You must accept the privacy policy to participate to the poll.'))
-    else:
-        form = VoteForm(question=question)
 
+def _vote_cookie_name(question):
+    return f'has_voted_{question.ref_token}'
+
+
+def _bind_vote_form(request, question):
+    """
+    Returns the vote form of the request and, for a valid POST with the privacy policy accepted, the vote to
+    record as a (choice, text_choice) tuple, else None.
+    """
+    if request.method != 'POST':
+        return VoteForm(question=question), None
+
+    form = VoteForm(request.POST, question=question)
+    if form.is_valid():
+        if form.cleaned_data['accept_privacy_policy'] == 'yes':
+            return form, (form.cleaned_data['choice'], form.cleaned_data.get('text_choice', None))
+        # Handle the case where privacy policy is not accepted
+        form.add_error('accept_privacy_policy', _('You must accept the privacy policy to participate to the poll.'))
+    return form, None
+
+
+def _voted_response(question, question_slug):
+    # Always return an HttpResponseRedirect after successfully dealing
+    # with POST data. This prevents data from being posted twice if a
+    # user hits the Back button.
+    response = HttpResponseRedirect(reverse('core:success_url', args=(question_slug,)))
+
+    if not DEBUG:
+        # Set the cookie to block re-voting, with expiration at the question's end time.
+        response.set_cookie(_vote_cookie_name(question), 'true', expires=question.end_time)
+
+    return response
+
+
+def _render_vote_page(request, question, form):
     context = {
         'question': question,
         'form': form,
         'TECHNICAL_CONTACT_EMAIL': TECHNICAL_CONTACT_EMAIL,
         'TECHNICAL_CONTACT': TECHNICAL_CONTACT,
     }
-    return render(request, 'core/vote.html', context)
+    return render(request, hot_template('core/vote.html'), context)
 
 
-def success_url(request, question_slug):
-    http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
+def _render_stale_vote_page(request, question_slug):
+    # the voted choice is gone: rebuild the snapshot and redisplay the form, which now refuses that choice
+    invalidate_poll_snapshot(question_slug)
+    question = get_poll_snapshot(question_slug)
+    return _render_vote_page(request, question, VoteForm(request.POST, question=question))
+
 
-    if not request.user.is_authenticated or not request.user.is_superuser:
-        # Check if the IP is private
-        if http_real_ip != '' and not is_private_ip(http_real_ip) and not DEBUG:
-            syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
-            return render(request, 'core/show_generic_message.html',
-                          {'message': "403 Forbidden - accesso consentito solo da intranet"}, status=403)
+def show_poll_question(request, question_slug):
+    # get question by slug (cached immutable snapshot of the question and its choices)
+    question = get_poll_snapshot(question_slug)
+
+    refused = _vote_refused_response(request, question)
+    if refused is not None:
+        return refused
+
+    form, vote = _bind_vote_form(request, question)
+    if vote is not None:
+        print(f"form.cleaned_data: {form.cleaned_data}")
+
+        try:
+            _record_vote(question, *vote)
+        except Choice.DoesNotExist:
+            return _render_stale_vote_page(request, question_slug)
+        return _voted_response(question, question_slug)
+
+    return _render_vote_page(request, question, form)
 
-    # get question by slug
-    question = get_object_or_404(Question, slug=question_slug)
+
+def success_url(request, question_slug):
+    # get question by slug (cached immutable snapshot)
+    question = get_poll_snapshot(question_slug)
 
     if not question.is_active():
         return HttpResponse("This poll is not active.")
@@ -206,22 +275,13 @@ def success_url(request, question_slug):
         'end_date': formatted_date,
     }
 
-    return render(request, 'core/thanks_poll_participation.html', context)
+    return render(request, hot_template('core/thanks_poll_participation.html'), context)
 
 
 __subscriber_dict = {}
 
 
 def show_survey_question(request, question_slug):
-    http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
-
-    if not request.user.is_authenticated or not request.user.is_superuser:
-        # Check if the IP is private
-        if http_real_ip != '' and not is_private_ip(http_real_ip) and not DEBUG:
-            syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
-            return render(request, 'core/show_generic_message.html',
-                          {'message': "403 Forbidden - accesso consentito solo da intranet"}, status=403)
-
     # check request.session['subscriber_id'] and retrieve the subscriber instance
     subscriber_id = request.session.get('subscriber_id')
     if subscriber_id:
@@ -235,89 +295,62 @@ def show_survey_question(request, question_slug):
     return None
 
 
-def subscriber_login(request, question_slug):
-    # get ip address from request META
-    http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
-
-    # Check if the IP is private
-    if http_real_ip != '' and not is_private_ip(http_real_ip) and not DEBUG:
-        syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
-        return render(request, 'show_message.html', {'message': "403 Forbidden - accesso consentito solo da intranet"},
-                      status=403)
-
-    # check existence of NamedSurvey instance with the given slug
-    named_survey = get_object_or_404(NamedSurvey, slug=question_slug)
-    if named_survey is None:
-        return render(request, 'show_message.html', {'message': "404 Not Found - survey non trovato"}, status=404)
-
-    if request.method == 'POST':
-        form = SubscriberLoginForm(request.POST)
-        if form.is_valid():
-            matricola = form.cleaned_data['matricola']
-            email = form.cleaned_data['email']
-
-            params = {'matricola': matricola, 'email': email}
+def _start_subscriber_session(request, subscriber, question_slug):
+    # Simulate login by saving subscriber's ID in session (example)
+    request.session['subscriber_id'] = subscriber.id
+    request.session['question_slug'] = question_slug
 
-            url = CHECK_SUBSCRIBER_WS_URL
 
-            try:
-                response = requests.get(url, params=params)
-                response.raise_for_status()  # Raise an exception for HTTP errors
-                data = response.json()
-                exists = data.get('exists', False)
-                if exists:
-                    subscriber = data.get('subscriber', {})
-
-                    create_event_log(
-                        event_type=EventLog.LOGIN_SUCCESS,
-                        event_title="Subscriber login success",
-                        event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
-                    )
-
-                    subscriber = create_subscriber_if_not_exits(
-                        email=subscriber.get('email', ''),
-                        name=subscriber.get('name', ''),
-                        surname=subscriber.get('surname', ''),
-                        matricola=subscriber.get('matricola', ''),
-                        uaf=subscriber.get('uaf', ''),
-                        structure=subscriber.get('structure', ''),
-                    )
+def _complete_subscriber_login(request, question_slug, matricola, email, exists, attributes, error=None):
+    """
+    Records the outcome of the registry check of a login (exists and the attributes of the subscriber, or the
+    requests exception raised by the check): event log, metrics and, for a subscriber, the session.
 
-                    # login(request, user, backend=AUTHENTICATION_BACKENDS[0])
+    Returns the redirect to the survey, or None after adding the error message to the request.
+    """
+    # get ip address from request META (already checked by AccessPolicyMiddleware), for the event log
+    http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
+    event_data = f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}"
 
-                    # Simulate login by saving subscriber's ID in session (example)
-                    request.session['subscriber_id'] = subscriber.id
-                    request.session['question_slug'] = question_slug
+    if exists and error is None:
+        get_metrics().inc('anonpoll_logins_total', result='success')
 
-                    # Reverse the URL with the slug parameter
-                    url = reverse('core:post-authenticated-survey', kwargs={'question_slug': question_slug})
+        create_event_log(
+            event_type=EventLog.LOGIN_SUCCESS,
+            event_title="Subscriber login success",
+            event_data=event_data,
+        )
 
-                    return redirect(url)
+        subscriber = create_subscriber_if_not_exits(
+            email=attributes.get('email', ''),
+            name=attributes.get('name', ''),
+            surname=attributes.get('surname', ''),
+            matricola=attributes.get('matricola', ''),
+            uaf=attributes.get('uaf', ''),
+            structure=attributes.get('structure', ''),
+        )
 
-                else:
+        # login(request, user, backend=AUTHENTICATION_BACKENDS[0])
+        _start_subscriber_session(request, subscriber, question_slug)
 
-                    create_event_log(
-                        event_type=EventLog.LOGIN_FAILED,
-                        event_title="Subscriber login failed",
-                        event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
-                    )
+        # Reverse the URL with the slug parameter
+        url = reverse('core:post-authenticated-survey', kwargs={'question_slug': question_slug})
 
-                    messages.error(request, 'errore: matricola o email non validi')
+        return redirect(url)
 
-            except requests.RequestException as e:
-                # self.stderr.write(self.style.ERROR(f'Error calling CheckSubscriberView: {e}'))
+    get_metrics().inc('anonpoll_logins_total', result='failure' if error is None else 'error')
 
-                create_event_log(
-                    event_type=EventLog.LOGIN_FAILED,
-                    event_title="Subscriber login failed",
-                    event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip} error: {e}",
-                )
+    create_event_log(
+        event_type=EventLog.LOGIN_FAILED,
+        event_title="Subscriber login failed",
+        event_data=event_data if error is None else f"{event_data} error: {error}",
+    )
 
-                messages.error(request, 'errore: matricola o email non validi')
+    messages.error(request, 'errore: matricola o email non validi')
+    return None
 
-    else:
-        form = SubscriberLoginForm()
 
+def _render_subscriber_login(request, form):
     context = {
         'APPLICATION_TITLE': '-',
         'TECHNICAL_CONTACT_EMAIL': TECHNICAL_CONTACT_EMAIL,
@@ -329,108 +362,174 @@ def subscriber_login(request, question_slug):
     return render(request, 'subscribers/login.html', context)
 
 
-def post_authenticated_survey(request, question_slug):
+def subscriber_login(request, question_slug):
+    # check existence of NamedSurvey instance with the given slug
+    named_survey = get_object_or_404(NamedSurvey, slug=question_slug)
+    if named_survey is None:
+        return render(request, 'show_message.html', {'message': "404 Not Found - survey non trovato"}, status=404)
 
-    # get ip address from request META
-    http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
+    if request.method == 'POST':
+        form = SubscriberLoginForm(request.POST)
+        if form.is_valid():
+            matricola = form.cleaned_data['matricola']
+            email = form.cleaned_data['email']
 
-    # Check if the IP is private
-    if http_real_ip != '' and not is_private_ip(http_real_ip) and not DEBUG:
-        syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
-        return render(request, 'show_message.html', {'message': "403 Forbidden - accesso consentito solo da intranet"},
-                      status=403)
+            try:
+                # pooled, time-bounded and cached call to the CHECK_SUBSCRIBER_WS_URL web service
+                exists, attributes = get_subscriber_registry_client().check(matricola, email)
+                error = None
+            except requests.RequestException as e:
+                exists, attributes, error = False, {}, e
 
-    survey = get_object_or_404(NamedSurvey, slug=question_slug)
-    if not survey.is_active():
-        return HttpResponse("This named survey is not currently active.", status=403)
+            response = _complete_subscriber_login(request, question_slug, matricola, email, exists, attributes,
+                                                  error)
+            if response is not None:
+                return response
+    else:
+        form = SubscriberLoginForm()
+
+    return _render_subscriber_login(request, form)
+
+
+def _save_named_survey_response(survey, subscriber, form):
+    # saves the answers of a valid survey form, returns the response and the summary lines emailed to the subscriber
+
+    # field specs of the questions of the survey, by question id
+    questions = form.questions
+
+    answers = []
+    summary = []
+    for field, text in form.cleaned_data.items():
+        question = questions[int(field.split('_')[1])]
+        answers.append(NamedSurveyAnswer(question_id=question.question_id, text=text))
+        # prepare a summary of the submitted data by user
+        summary.append(f"{question.text}: {text}")
+
+    # save the response and all its answers at once
+    with transaction.atomic():
+        response = NamedSurveyResponse.objects.create(survey=survey, subscriber=subscriber)
+        for answer in answers:
+            answer.response = response
+        NamedSurveyAnswer.objects.bulk_create(answers)
 
+    return response, summary
+
+
+def _survey_summary_email(survey, subscriber, summary):
+    # returns the subject and the body of the email with the summary of the answers
+    message_subject = f'Riepilogo delle tue risposte al sondaggio "{survey.title}"'
+    message_body = f'Ciao {subscriber.name},<br><br>'
+    message_body += f'grazie per aver partecipato alla nostra indagine.<br><br>'
+    message_body += 'Ecco il riepilogo delle tue risposte:<br><br>'
+    message_body += '<br><br>'.join(summary)
+    return message_subject, message_body
+
+
+def _get_survey_subscriber(request, question_slug):
+    """
+    Returns (subscriber, None) for the subscriber logged in the http session, else (None, the response to send).
+    """
     # check http session for subscriber_id
     subscriber_id = request.session.get('subscriber_id')
     if subscriber_id is None:
         url = reverse('core:subscriber-login', kwargs={'question_slug': question_slug})
-        return redirect(url)
+        return None, redirect(url)
 
     # get subscriber instance using subscriber_id
-
     try:
-        subscriber = Subscriber.objects.get(id=subscriber_id)
+        return Subscriber.objects.get(id=subscriber_id), None
     except Subscriber.DoesNotExist:
         # reset http session
         del request.session['subscriber_id']
-        return render(request, 'show_message.html', {'message': "404 Not Found - subscriber non trovato"}, status=404)
+        return None, render(request, 'show_message.html', {'message': "404 Not Found - subscriber non trovato"},
+                            status=404)
+
+
+def _submit_named_survey(request, survey, subscriber, form, send_in_background=False):
+    # saves a valid survey form and sends the summary of the answers to the subscriber
+    response, summary = _save_named_survey_response(survey, subscriber, form)
+    message_subject, message_body = _survey_summary_email(survey, subscriber, summary)
+
+    # only the id goes in the http session, the thank-you page rebuilds the summary from the response
+    request.session['survey_response_id'] = response.id
+
+    event_data = f"subscriber: {subscriber} email: {subscriber.email} {message_body}"
+    if DEBUG:
+        print(f"debug mode: fake sending email to {subscriber.email}")
+        print(f"message: {message_body}  (debug mode)")
+    elif EMAIL_OUTBOX_ENABLED:
+        # delivered by the send_queued_emails command, which also records the EMAIL_SENT event
+        queue_email(
+            FROM_EMAIL,
+            [subscriber.email],
+            message_subject,
+            message_body,
+            bcc_addresses=[DEBUG_EMAIL],
+        )
+        return
+    elif send_in_background:
+        # the sender thread records the EMAIL_SENT event
+        send_email_in_background(FROM_EMAIL, [subscriber.email], message_subject, message_body,
+                                 bcc_addresses=[DEBUG_EMAIL], email_host=EMAIL_HOST, event_data=event_data)
+        return
+    else:
+        my_send_email(
+            FROM_EMAIL,
+            [subscriber.email],
+            message_subject,
+            message_body,
+            bcc_addresses=[DEBUG_EMAIL],
+            attachments=None,
+            email_host=EMAIL_HOST
+        )
+
+    create_event_log(
+        event_type=EventLog.EMAIL_SENT,
+        event_title=message_subject,
+        event_data=event_data,
+        event_target=subscriber.email,
+    )
+
+
+def _render_survey_form(request, survey, form):
+    return render(request, hot_template('named_polls/poll_form.html'), {'form': form, 'survey': survey})
 
 
-    if subscriber is None:
-        return render(request, 'show_message.html', {'message': "404 Not Found - subscriber non trovato"}, status=404)
+def post_authenticated_survey(request, question_slug):
+    # the client address has already been checked by AccessPolicyMiddleware
+
+    survey = get_object_or_404(NamedSurvey, slug=question_slug)
+    if not survey.is_active():
+        return HttpResponse("This named survey is not currently active.", status=403)
 
+    subscriber, refused = _get_survey_subscriber(request, question_slug)
+    if refused is not None:
+        return refused
 
     PollForm = make_named_survey_form(survey)
     if request.method == 'POST':
         form = PollForm(request.POST)
         if form.is_valid():
-            response = NamedSurveyResponse(survey=survey, subscriber=subscriber)
-            response.save()
-            for field in form.cleaned_data:
-                question_id = field.split('_')[1]
-                question = get_object_or_404(NamedSurveyQuestion, id=question_id)
-                text = form.cleaned_data[field]
-                NamedSurveyAnswer.objects.create(response=response, question=question, text=text)
-
-            # prepare a summary of the submitted data by user
-            summary = []
-            for field in form.cleaned_data:
-                question_id = field.split('_')[1]
-                question = get_object_or_404(NamedSurveyQuestion, id=question_id)
-                text = form.cleaned_data[field]
-                summary.append(f"{question.text}: {text}")
-
-            # send an email to the user with the summary
-            # get Subscriber istance using subscriber_id
-            subscriber = get_object_or_404(Subscriber, id=subscriber_id)
-
-            message_subject = f'Riepilogo delle tue risposte al sondaggio "{survey.title}"'
-            message_body = f'Ciao {subscriber.name},<br><br>'
-            message_body += f'grazie per aver partecipato alla nostra indagine.<br><br>'
-            message_body += 'Ecco il riepilogo delle tue risposte:<br><br>'
-            message_body += '<br><br>'.join(summary)
-
-            # add data to the http session
-            request.session['survey_summary'] = summary
-            request.session['survey_id'] = survey.id
-            request.session['message_body'] = message_body
-            request.session['message_subject'] = message_subject
-
-            if DEBUG:
-                print(f"debug mode: fake sending email to {subscriber.email}")
-                print(f"message: {message_body}  (debug mode)")
-            else:
-                my_send_email(
-                    FROM_EMAIL,
-                    [subscriber.email],
-                    message_subject,
-                    message_body,
-                    bcc_addresses=[DEBUG_EMAIL],
-                    attachments=None,
-                    email_host=EMAIL_HOST
-                )
-
-            create_event_log(
-                event_type=EventLog.EMAIL_SENT,
-                event_title=message_subject,
-                event_data=f"subscriber: {subscriber} email: {subscriber.email} {message_body}",
-                event_target=subscriber.email,
-            )
+            _submit_named_survey(request, survey, subscriber, form)
 
             success_url = reverse('core:authenticated-survey-success-url', args=(survey.slug,))
             return redirect(success_url)
     else:
         form = PollForm()
 
-    return render(request, 'named_polls/poll_form.html', {'form': form, 'survey': survey})
+    return _render_survey_form(request, survey, form)
 
 
 def authenticated_survey_successl_url(request, question_slug):
-    message_body = request.session.get('message_body')
+    # the summary of the answers just saved, rebuilt from the response in the session
+    message_body = None
+    response_id = request.session.get('survey_response_id')
+    if response_id is not None:
+        response = NamedSurveyResponse.objects.select_related('survey', 'subscriber') \
+            .filter(id=response_id, survey__slug=question_slug).first()
+        if response is not None:
+            message_subject, message_body = _survey_summary_email(response.survey, response.subscriber,
+                                                                  response.summary())
 
     context = {
         'APPLICATION_TITLE': '-',
@@ -441,7 +540,7 @@ def authenticated_survey_successl_url(request, question_slug):
         # 'question_slug': question_slug,
     }
 
-    return render(request, 'named_polls/thanks_poll_participation.html', context)
+    return render(request, hot_template('named_polls/thanks_poll_participation.html'), context)
 
 
 def subscriber_logout(request, question_slug):
@@ -451,3 +550,103 @@ def subscriber_logout(request, question_slug):
 
     url = reverse('core:subscriber-login', kwargs={'question_slug': question_slug})
     return redirect(url)
+
+
+# async versions of the vote, login and survey submit flows, served under ASGI (see core/urls.py): the
+# registry check and the mail handoff do not hold a thread, the ORM work runs in the thread sensitive thread
+# of the request (sync_to_async) or through the async ORM methods
+
+
+async def _aget_object_or_404(model, **kwargs):
+    try:
+        return await model.objects.aget(**kwargs)
+    except model.DoesNotExist:
+        raise Http404(f"No {model._meta.object_name} matches the given query.")
+
+
+async def show_poll_question_async(request, question_slug):
+    question = await sync_to_async(get_poll_snapshot)(question_slug)
+
+    refused = _vote_refused_response(request, question)
+    if refused is not None:
+        return refused
+
+    form, vote = _bind_vote_form(request, question)
+    if vote is not None:
+        try:
+            await sync_to_async(_record_vote)(question, *vote)
+        except Choice.DoesNotExist:
+            return await sync_to_async(_render_stale_vote_page)(request, question_slug)
+        return _voted_response(question, question_slug)
+
+    return await sync_to_async(_render_vote_page)(request, question, form)
+
+
+async def subscriber_login_async(request, question_slug):
+    await _aget_object_or_404(NamedSurvey, slug=question_slug)
+
+    if request.method == 'POST':
+        form = SubscriberLoginForm(request.POST)
+        if form.is_valid():
+            matricola = form.cleaned_data['matricola']
+            email = form.cleaned_data['email']
+
+            try:
+                exists, attributes = await get_subscriber_registry_client().acheck(matricola, email)
+                error = None
+            except requests.RequestException as e:
+                exists, attributes, error = False, {}, e
+
+            response = await sync_to_async(_complete_subscriber_login)(request, question_slug, matricola, email,
+                                                                       exists, attributes, error)
+            if response is not None:
+                return response
+    else:
+        form = SubscriberLoginForm()
+
+    return await sync_to_async(_render_subscriber_login)(request, form)
+
+
+async def post_authenticated_survey_async(request, question_slug):
+    survey = await _aget_object_or_404(NamedSurvey, slug=question_slug)
+    if not survey.is_active():
+        return HttpResponse("This named survey is not currently active.", status=403)
+
+    # loads the session: from here on it is read and written in memory, and saved by SessionMiddleware
+    subscriber, refused = await sync_to_async(_get_survey_subscriber)(request, question_slug)
+    if refused is not None:
+        return refused
+
+    PollForm = await sync_to_async(make_named_survey_form)(survey)
+    if request.method == 'POST':
+        form = PollForm(request.POST)
+        if form.is_valid():
+            # the mail is handed to a sender thread, the view does not wait for the SMTP server
+            await sync_to_async(_submit_named_survey)(request, survey, subscriber, form, send_in_background=True)
+            return redirect(reverse('core:authenticated-survey-success-url', args=(survey.slug,)))
+    else:
+        form = PollForm()
+
+    return await sync_to_async(_render_survey_form)(request, survey, form)
+
+
+@staff_member_required
+def instrumentation_stats(request):
+    # per-view timings collected by InstrumentationMiddleware in this process
+    context = {
+        'views': view_stats.summary(),
+        'buckets': [f"≤{bound}" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}"],
+        'sample_rate': getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', DEFAULT_SAMPLE_RATE),
+        # buffered EventLog writer of this process
+        'event_log': get_event_log_stats(),
+    }
+    return render(request, 'core/instrumentation.html', context)
+
+
+def metrics(request):
+    # scrape endpoint: the metrics of all the worker processes, in the Prometheus text format
+    # (the client address is checked by AccessPolicyMiddleware)
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and request.META.get('HTTP_AUTHORIZATION') != f"Bearer {token}":
+        return HttpResponse("401 Unauthorized", status=401, content_type='text/plain; charset=utf-8')
+    return HttpResponse(get_metrics().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
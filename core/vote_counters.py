@@ -0,0 +1,186 @@
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+
+from .models import Choice, ChoiceVoteCounterShard, ChoiceSuggestedByUser, ChoiceVoteSuggestedByUser, \
+    normalize_choice_text
+
+DEFAULT_VOTE_COUNTER_SHARDS = 8
+
+
+def get_shard_count():
+    """
+    Returns the number of counter shards used for each Choice (setting VOTE_COUNTER_SHARDS).
+    """
+    return max(1, int(getattr(settings, 'VOTE_COUNTER_SHARDS', DEFAULT_VOTE_COUNTER_SHARDS)))
+
+
+def increment_choice_votes(choice, amount=1):
+    """
+    Adds votes to a Choice without a read-modify-write on the Choice row.
+
+    A random shard is picked and incremented with a single `UPDATE ... SET votes = votes + amount`.
+    The first vote landing on a shard creates its row; if another request creates it concurrently,
+    the unique constraint on (choice, shard) makes us fall back to the UPDATE.
+
+    Parameters:
+    - choice (Choice, ChoiceSnapshot or int): The choice (or choice id) to vote for.
+    - amount (int): Number of votes to add.
+    """
+    choice_id = getattr(choice, 'pk', choice)
+    shard = random.randrange(get_shard_count())
+
+    shard_qs = ChoiceVoteCounterShard.objects.filter(choice_id=choice_id, shard=shard)
+    if shard_qs.update(votes=F('votes') + amount):
+        return
+
+    try:
+        with transaction.atomic():
+            ChoiceVoteCounterShard.objects.create(choice_id=choice_id, shard=shard, votes=amount)
+    except IntegrityError:
+        # the shard row has been created by a concurrent vote in the meantime
+        shard_qs.update(votes=F('votes') + amount)
+
+
+def get_choice_votes(choice):
+    """
+    Returns the total votes of a Choice: the votes stored on the Choice row plus the sum of its shards.
+    """
+    shard_votes = ChoiceVoteCounterShard.objects.filter(choice=choice).aggregate(total=Sum('votes'))['total']
+    return choice.votes + (shard_votes or 0)
+
+
+def get_question_tallies(question):
+    """
+    Returns a dict {choice_id: total votes} for all choices of a question, using one grouped query for the shards.
+    """
+    tallies = dict(question.choice_set.values_list('id', 'votes'))
+
+    shard_totals = (ChoiceVoteCounterShard.objects
+                    .filter(choice__question=question)
+                    .values('choice_id')
+                    .annotate(total=Sum('votes'))
+                    .values_list('choice_id', 'total'))
+
+    for choice_id, total in shard_totals:
+        tallies[choice_id] = tallies.get(choice_id, 0) + (total or 0)
+
+    return tallies
+
+
+def collapse_choice_shards(choice):
+    """
+    Folds the shards of a Choice back into Choice.votes (e.g. after a poll has ended).
+    """
+    with transaction.atomic():
+        shards = list(ChoiceVoteCounterShard.objects.select_for_update().filter(choice=choice))
+        shard_votes = sum(shard.votes for shard in shards)
+        if shard_votes:
+            Choice.objects.filter(pk=choice.pk).update(votes=F('votes') + shard_votes)
+        ChoiceVoteCounterShard.objects.filter(pk__in=[shard.pk for shard in shards]).delete()
+
+
+def _upsert_suggested_choice_sql(vendor):
+    table = connection.ops.quote_name(ChoiceSuggestedByUser._meta.db_table)
+    insert = (f"INSERT INTO {table} (question_id, choice_text, normalized_text, votes) "
+              f"VALUES (%s, %s, %s, %s) ")
+    if vendor == 'mysql':
+        # LAST_INSERT_ID(id) makes lastrowid return the id of the existing row too
+        return insert + "ON DUPLICATE KEY UPDATE votes = votes + VALUES(votes), id = LAST_INSERT_ID(id)"
+    if vendor in ('postgresql', 'sqlite'):
+        return insert + (f"ON CONFLICT (question_id, normalized_text) "
+                         f"DO UPDATE SET votes = {table}.votes + excluded.votes RETURNING id")
+    return None
+
+
+def upsert_suggested_choice(question, choice_text, amount=1):
+    """
+    Adds votes to the choice typed by a voter, creating it if needed, and returns its id.
+
+    The row is looked up by the normalized text (see normalize_choice_text) and inserted or incremented with
+    a single statement relying on the unique key (question, normalized_text), so concurrent votes for the
+    same text never create duplicates. Databases without an upsert statement fall back to update-then-insert.
+
+    Parameters:
+    - question (Question, QuestionSnapshot or int): The question (or question id).
+    - choice_text (str): The text typed by the voter.
+    - amount (int): Number of votes to add.
+    """
+    question_id = getattr(question, 'pk', question)
+    normalized_text = normalize_choice_text(choice_text)
+
+    sql = _upsert_suggested_choice_sql(connection.vendor)
+    if sql is not None:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [question_id, choice_text, normalized_text, amount])
+            if connection.vendor == 'mysql':
+                return cursor.lastrowid
+            return cursor.fetchone()[0]
+
+    choice_qs = ChoiceSuggestedByUser.objects.filter(question_id=question_id, normalized_text=normalized_text)
+    if choice_qs.update(votes=F('votes') + amount):
+        return choice_qs.values_list('id', flat=True).get()
+
+    try:
+        with transaction.atomic():
+            return ChoiceSuggestedByUser.objects.create(question_id=question_id, choice_text=choice_text,
+                                                        normalized_text=normalized_text, votes=amount).pk
+    except IntegrityError:
+        # created by a concurrent vote in the meantime
+        choice_qs.update(votes=F('votes') + amount)
+        return choice_qs.values_list('id', flat=True).get()
+
+
+def merge_duplicate_suggested_choices(question_ids=None, dry_run=False):
+    """
+    Merges the choices suggested by users that share the same normalized text, and fills in the missing
+    normalized_text of the rows created before the unique key was introduced.
+
+    For every group of duplicates the oldest row is kept: it gets the votes of the others, their
+    ChoiceVoteSuggestedByUser rows are re-pointed to it and they are deleted. Each question is merged
+    in its own transaction.
+
+    Parameters:
+    - question_ids (list, optional): Restrict the merge to these questions.
+    - dry_run (bool): Only count, do not change anything.
+
+    Returns:
+    - tuple: (number of duplicate rows merged, number of votes re-pointed)
+    """
+    choices = ChoiceSuggestedByUser.objects.all()
+    if question_ids:
+        choices = choices.filter(question_id__in=question_ids)
+
+    merged = repointed = 0
+
+    for question_id in choices.values_list('question_id', flat=True).distinct().order_by('question_id'):
+        with transaction.atomic():
+            groups = {}
+            rows = (ChoiceSuggestedByUser.objects.select_for_update().filter(question_id=question_id)
+                    .order_by('id').values_list('id', 'choice_text', 'normalized_text', 'votes'))
+            for row in rows:
+                groups.setdefault(normalize_choice_text(row[1]), []).append(row)
+
+            for normalized_text, group in groups.items():
+                (keep_id, _, keep_normalized_text, _), duplicates = group[0], group[1:]
+                duplicate_ids = [row[0] for row in duplicates]
+
+                votes = ChoiceVoteSuggestedByUser.objects.filter(choice_id__in=duplicate_ids)
+                merged += len(duplicate_ids)
+                if dry_run:
+                    repointed += votes.count()
+                    continue
+
+                if duplicate_ids:
+                    repointed += votes.update(choice_id=keep_id)
+                    ChoiceSuggestedByUser.objects.filter(pk=keep_id).update(
+                        votes=F('votes') + sum(row[3] for row in duplicates))
+                    ChoiceSuggestedByUser.objects.filter(pk__in=duplicate_ids).delete()
+
+                if keep_normalized_text != normalized_text:
+                    # after the delete, so that a duplicate holding the key does not collide
+                    ChoiceSuggestedByUser.objects.filter(pk=keep_id).update(normalized_text=normalized_text)
+
+    return merged, repointed
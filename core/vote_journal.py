@@ -0,0 +1,95 @@
+from collections import Counter
+
+from django.db import transaction
+
+from .models import JournaledVote, Choice, ChoiceVote, ChoiceVoteSuggestedByUser
+from .vote_counters import increment_choice_votes, upsert_suggested_choice
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def journal_vote(question, choice, text_choice=None):
+    """
+    Appends a vote to the journal (a single INSERT) without touching counters or vote rows.
+
+    The vote is applied later by flush_vote_journal().
+    """
+    return JournaledVote.objects.create(
+        question_id=question.pk,
+        choice_id=choice.pk,
+        text_choice=text_choice if choice.is_choice_text_user_defined() else None,
+    )
+
+
+def _apply_journaled_votes(journaled_votes):
+    """
+    Applies a batch of JournaledVote instances: aggregated counter updates plus bulk inserts of vote rows.
+    """
+    choice_counts = Counter()
+    suggested_counts = Counter()
+
+    user_defined_choice_ids = set(Choice.objects.filter(
+        pk__in={journaled_vote.choice_id for journaled_vote in journaled_votes},
+        choice_text='ZZZ_USER_DEFINED',
+    ).values_list('id', flat=True))
+
+    for journaled_vote in journaled_votes:
+        if journaled_vote.choice_id in user_defined_choice_ids:
+            suggested_counts[(journaled_vote.question_id, journaled_vote.text_choice)] += 1
+        else:
+            choice_counts[(journaled_vote.question_id, journaled_vote.choice_id)] += 1
+
+    # regular choices: one counter increment per choice, one bulk insert for all the votes
+    for (question_id, choice_id), count in choice_counts.items():
+        increment_choice_votes(choice_id, amount=count)
+
+    ChoiceVote.objects.bulk_create([
+        ChoiceVote(question_id=question_id, choice_id=choice_id)
+        for (question_id, choice_id), count in choice_counts.items()
+        for _ in range(count)
+    ])
+
+    # choices suggested by users: increment the existing ones, create the missing ones
+    suggested_votes = []
+    for (question_id, choice_text), count in suggested_counts.items():
+        user_choice_id = upsert_suggested_choice(question_id, choice_text, amount=count)
+
+        suggested_votes += [ChoiceVoteSuggestedByUser(question_id=question_id, choice_id=user_choice_id)
+                            for _ in range(count)]
+
+    ChoiceVoteSuggestedByUser.objects.bulk_create(suggested_votes)
+
+
+def flush_vote_journal(batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """
+    Applies the pending journaled votes in batches and returns the number of votes applied.
+
+    Every batch is applied and removed from the journal in the same transaction: if the process dies
+    in the middle of a batch nothing is committed and the next run replays it.
+    Rows are locked with SKIP LOCKED (where supported) so that several flushers can run side by side.
+
+    Parameters:
+    - batch_size (int): Maximum number of votes applied per transaction.
+    - max_batches (int, optional): Stop after this many batches (default: until the journal is empty).
+    """
+    applied = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            journaled_votes = list(
+                JournaledVote.objects
+                .select_for_update(skip_locked=True)
+                .order_by('id')[:batch_size]
+            )
+            if not journaled_votes:
+                break
+
+            _apply_journaled_votes(journaled_votes)
+
+            JournaledVote.objects.filter(pk__in=[journaled_vote.pk for journaled_vote in journaled_votes]).delete()
+
+        applied += len(journaled_votes)
+        batches += 1
+
+    return applied